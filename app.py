@@ -4,11 +4,39 @@ import json
 from uuid import uuid4
 from urllib.parse import urlparse
 import requests
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
+from connection import Connection
+from blockchain.blockchain import Blockchain
+from blockchain.mempool import mempool
+from blockchain.outbox import outbox
+from database import fragmentador
 from route import routes
+import metricas
 import uvicorn
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Se abre el pool de conexiones compartido al arrancar y se libera al apagar
+    conexion = Connection()
+    conexion.iniciar_nosql()
+    conexion.iniciar_nosql_async()
+    await run_in_threadpool(Blockchain().iniciar_cabeza) # Carga en memoria el último bloque de la cadena
+    await run_in_threadpool(mempool.iniciar)
+    await run_in_threadpool(outbox.iniciar) # Registra en SQL los bloques pendientes de antes de arrancar
+    yield
+    await run_in_threadpool(mempool.detener) # Sella los eventos que queden en cola
+    await run_in_threadpool(outbox.detener) # Registra las filas SQL que queden pendientes
+    await run_in_threadpool(fragmentador.cerrar_pool)
+    conexion.cerrar_nosql()
+    await conexion.cerrar_nosql_async()
+    conexion.cerrar_sql()
+
+app = FastAPI(lifespan=lifespan)
+
+# Duración de cada petición por ruta para /metrics
+app.add_middleware(metricas.MedidorPeticiones)
 
 # Definimos las rutas
 app.include_router(routes.router)
@@ -0,0 +1,53 @@
+import argparse
+import json
+import time
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519
+from cryptography.hazmat.primitives import serialization
+from security.authentication import Authentication
+
+
+def clave_pem(private_key_obj):
+    return private_key_obj.private_bytes(encoding=serialization.Encoding.PEM,
+                                         format=serialization.PrivateFormat.PKCS8,
+                                         encryption_algorithm=serialization.NoEncryption()).decode()
+
+
+def operaciones_por_segundo(funcion, operaciones):
+    inicio = time.perf_counter()
+    for _ in range(operaciones):
+        funcion()
+    return operaciones / (time.perf_counter() - inicio)
+
+
+def medir(nombre, private_pem, operaciones):
+    # Mismas operaciones que un bloque: proof, proof_signature y signature, y su verificación
+    auth = Authentication()
+    public_pem = auth.get_public_key(private_pem)
+    block = {'index': 1, 'data': 'a' * 64, 'previous_hash': 'b' * 64, 'metadatos': {'file_id': 1, 'nombre': 'archivo'},
+             'algoritmo': auth.algoritmo(private_pem)}
+    proof = auth.sign_proof(block['previous_hash'], private_pem)
+    firmado = dict(block, signature=auth.sign_block(block, private_pem))
+
+    firma_proof = operaciones_por_segundo(lambda: auth.sign_proof(block['previous_hash'], private_pem), operaciones)
+    firma_bloque = operaciones_por_segundo(lambda: auth.sign_block(block, private_pem), operaciones)
+    verifica_proof = operaciones_por_segundo(lambda: auth.verify_proof(block['previous_hash'], proof, public_pem), operaciones)
+    verifica_bloque = operaciones_por_segundo(lambda: auth.verify_block(firmado, public_pem), operaciones)
+
+    return {'esquema': nombre,
+            'firma_proof_ops': round(firma_proof),
+            'firma_bloque_ops': round(firma_bloque),
+            'verifica_proof_ops': round(verifica_proof),
+            'verifica_bloque_ops': round(verifica_bloque),
+            'bytes_firma': len(firmado['signature'])}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compara las operaciones por segundo de los esquemas de firma de bloques')
+    parser.add_argument('--operaciones', type=int, default=500, help='Operaciones por medición')
+    parser.add_argument('--bits-rsa', type=int, default=2048, help='Tamaño de la clave RSA')
+    args = parser.parse_args()
+
+    esquemas = [('rsa-%d' % args.bits_rsa, clave_pem(rsa.generate_private_key(public_exponent=65537, key_size=args.bits_rsa))),
+                ('ed25519', clave_pem(ed25519.Ed25519PrivateKey.generate()))]
+    for nombre, private_pem in esquemas:
+        print(json.dumps(medir(nombre, private_pem, args.operaciones)))
@@ -5,6 +5,9 @@ from error_handler import Errores
 from database import sql, nosql
 from security import hashing
 from security.authentication import Authentication
+from decouple import config
+from blockchain import cabeza_cadena, codificacion, merkle, outbox, secuenciador
+import metricas
 
 class Blockchain:
     def __init__(self):
@@ -13,66 +16,187 @@ class Blockchain:
         self.db_sql = sql.Sql()
         self.authentication = Authentication()
         self.error_handle = Errores()
+        self.cabeza = cabeza_cadena.cabeza # Último bloque en memoria, compartido en el proceso
+        self.secuenciador = secuenciador.secuenciador
+        self.outbox = outbox.outbox # Registro diferido de las filas SQL
+        self.codificacion = config('BLOQUE_CODIFICACION', default='json') # 'json' (original) o 'binario'
 
-    def create_block(self, file_hash, metadatos, private_key):
+    def create_block(self, file_hash, metadatos, private_key, entradas=None):
         try:
-            # Obteniendo el hash del último bloque registrado en la BD NoSQL
-            previous_hash = self.get_previous_hash()
-            if previous_hash is None:
-                return self.error_handle.manejar_error(Exception('No se pudo obtener el hash del último bloque'), levantar=False)
-
-            # Verificando la integridad del último bloque en la BD NoSQL
-            if not self.db_sql.ultimo_hash(previous_hash):
-                return self.error_handle.manejar_error(Exception('La integridad del último bloque está comprometida'), levantar=False)
-
-            # Obtener la prueba de autoridad (PoA)
-            proof_data = self.proof_of_authority(previous_hash, private_key)
-            if 'message' in proof_data:
-                return self.error_handle.manejar_error(Exception(proof_data['message']), levantar=False) # Error si la clave privada no es del servidor
-
-            # Obteniendo el ultimo index
-            index = self.db_nosql.get_last_index()
-            if index is None:
-                return self.error_handle.manejar_error(Exception('No se pudo obtener el índice del último bloque'), levantar=False)
-            index += 1
-
-            # Construcción del bloque
-            block = {'index': index,
-                     'timestamp': str(datetime.datetime.now()),
-                     'data': file_hash,
-                     'previous_hash': previous_hash,
-                     'metadatos': metadatos,
-                     'proof': proof_data['proof'],
-                     'validator': proof_data['validator']
-            }
-
-            # Firma digital del proof
-            block['proof_signature'] = self.authentication.sign_proof(str(block['proof']), private_key)
-
-            # Calcular el hash del bloque antes de la firma digital
-            block['hash'] = self.hash(block)
-
-            # Crear la firma digital usando la clave privada del validador
-            block['signature'] = self.authentication.sign_block(block, private_key)
-
-            # Guarda el bloque en la BD NoSQL
-            id_block = self.db_nosql.save_block(block)
-            if id_block is None:
-                return self.error_handle.manejar_error(Exception('No se pudo guarda el bloque en la BD NoSQL'), levantar=False)
-
-            # Guardar el hash en la BD SQL
-            self.db_sql.save_hash_file(block['hash'], file_hash, metadatos['file_id'], id_block, metadatos['nombre'])
-
-            return {'message': 'Registro agregado con suceso', 'block': block['hash']}
+            # Todo bloque guarda sus entradas y la raíz de Merkle que las cubre (en uno individual, la hoja de la única entrada)
+            lote = bool(entradas)
+            if not lote:
+                entradas = [{'file_hash': file_hash, 'metadatos': metadatos}]
+            merkle_root = file_hash if lote else merkle.hoja(entradas[0])
+
+            # Asegura los índices únicos que impiden dos bloques con el mismo índice o previous_hash
+            self.secuenciador.asegurar_indices(self.db_nosql)
+
+            for intento in range(self.secuenciador.max_intentos):
+                # Último bloque de la cadena: desde memoria y, si no está cargado, desde la BD
+                cabeza = self.cabeza.obtener()
+                if cabeza is None:
+                    with metricas.medir('cadena_cabeza'):
+                        cabeza = self.cargar_cabeza()
+                    if cabeza is None:
+                        return self.error_handle.manejar_error(Exception('No se pudo obtener el hash del último bloque'), levantar=False)
+
+                    # Verificando la integridad del último bloque en la BD SQL (o que aún está en el outbox) solo la
+                    # primera vez: al recargar tras un conflicto la fila SQL del bloque ganador puede no estar escrita
+                    # todavía, y los índices únicos de registros_block ya garantizan que la cabeza enlaza con la cadena
+                    if not self.cabeza.validada:
+                        with metricas.medir('cadena_integridad'):
+                            integra = self.db_sql.ultimo_hash(cabeza['hash']) or self.outbox.bloque_pendiente(cabeza['hash'])
+                        if not integra:
+                            return self.error_handle.manejar_error(Exception('La integridad del último bloque está comprometida'), levantar=False)
+
+                    self.cabeza.actualizar(cabeza['index'], cabeza['hash'], cabeza['proof'])
+
+                previous_hash = cabeza['hash']
+
+                # Obtener la prueba de autoridad (PoA)
+                with metricas.medir('prueba_autoridad'):
+                    proof_data = self.proof_of_authority(previous_hash, private_key)
+                if 'message' in proof_data:
+                    return self.error_handle.manejar_error(Exception(proof_data['message']), levantar=False) # Error si la clave privada no es del servidor
+
+                index = cabeza['index'] + 1
+
+                # Construcción del bloque
+                block = {'index': index,
+                         'timestamp': str(datetime.datetime.now()),
+                         'data': file_hash,
+                         'previous_hash': previous_hash,
+                         'metadatos': metadatos,
+                         'proof': proof_data['proof'],
+                         'validator': proof_data['validator'],
+                         'merkle_root': merkle_root,
+                         'algoritmo': proof_data.get('algoritmo', 'rsa') # Esquema de firma del bloque (rsa o ed25519)
+                }
+
+                # Firma digital del proof
+                with metricas.medir('firma'):
+                    block['proof_signature'] = self.authentication.sign_proof(str(block['proof']), private_key)
+
+                if self.codificacion == codificacion.BINARIO:
+                    # El bloque se serializa una sola vez: los mismos bytes se hashean, se firman y se guardan
+                    cuerpo = codificacion.codificar(block)
+                    block['hash'] = hashlib.sha256(cuerpo).hexdigest()
+                    with metricas.medir('firma'):
+                        block['signature'] = self.authentication.sign_bytes(cuerpo, private_key)
+                    documento = codificacion.compactar(block, cuerpo)
+                else:
+                    # Calcular el hash del bloque antes de la firma digital
+                    block['hash'] = self.hash(block)
+
+                    # Crear la firma digital usando la clave privada del validador
+                    with metricas.medir('firma'):
+                        block['signature'] = self.authentication.sign_block(block, private_key)
+                    documento = block
+
+                # Guarda el bloque en la BD NoSQL (inserción condicionada por los índices únicos)
+                with metricas.medir('bloque_guardado'):
+                    if self.outbox.activo:
+                        id_block = self.db_nosql.save_block(documento, entradas, pendiente_sql=True)
+                    else:
+                        id_block = self.db_nosql.save_block(documento, entradas)
+                if id_block is False:
+                    # Otro worker anexó primero: se recarga la cabeza y se reconstruye el bloque
+                    self.cabeza.invalidar()
+                    self.secuenciador.conflicto(intento)
+                    continue
+
+                if id_block is None:
+                    self.cabeza.invalidar()
+                    return self.error_handle.manejar_error(Exception('No se pudo guarda el bloque en la BD NoSQL'), levantar=False)
+
+                # El nuevo bloque pasa a ser la cabeza de la cadena
+                self.cabeza.avanzar(previous_hash, index, block['hash'], block['proof'])
+                self.secuenciador.anexado()
+                metricas.bloques.incrementar()
+
+                # Con outbox las filas SQL se registran en segundo plano
+                if self.outbox.activo:
+                    self.outbox.encolado()
+                    return {'message': 'Registro agregado con suceso', 'block': block['hash']}
+
+                # Guardar el hash en la BD SQL (una fila por archivo del bloque; los lotes en una sola transacción)
+                filas = [(block['hash'], entrada['file_hash'], entrada['metadatos']['file_id'],
+                          id_block, entrada['metadatos']['nombre']) for entrada in entradas]
+                with metricas.medir('sql_registro'):
+                    if len(filas) == 1:
+                        self.db_sql.save_hash_file(*filas[0])
+                    else:
+                        self.db_sql.save_hash_files(filas)
+
+                return {'message': 'Registro agregado con suceso', 'block': block['hash']}
+
+            self.secuenciador.agotado()
+            return self.error_handle.manejar_error(Exception('No se pudo anexar el bloque: demasiados conflictos con otros workers'), levantar=False)
 
         except Exception as e:
             self.error_handle.manejar_error(e)
             return {'message': f'Error al agregar el bloque: {str(e)}'}
 
+    def create_batch_block(self, entradas, private_key):
+        # Sella varias operaciones de archivo en un solo bloque: se firma una vez la raíz de Merkle de todas
+        merkle_root = merkle.raiz([merkle.hoja(entrada) for entrada in entradas])
+        return self.create_block(merkle_root, {'entradas': len(entradas)}, private_key, entradas)
+
+    def prueba_inclusion(self, file_hash=None, file_id=None, index=None):
+        # Prueba de que un archivo está en un bloque: la hoja, los hermanos hasta la raíz y la cabecera firmada
+        documento = self.db_nosql.bloque_con_entrada(file_hash, file_id, index)
+        if documento is None:
+            return {'message': 'No hay ningún bloque con ese archivo'}
+
+        block = dict(codificacion.expandir(documento['block']))
+        for campo in ('signature', 'cuerpo'):
+            if isinstance(block.get(campo), bytes):
+                block[campo] = block[campo].hex()
+
+        # Bloques anteriores a las raíces de Merkle: el 'data' del bloque es directamente el hash del archivo
+        if 'merkle_root' not in block:
+            return {'block': block, 'entrada': {'file_hash': block['data'], 'metadatos': block['metadatos']},
+                    'hoja': block['data'], 'prueba': [], 'merkle_root': None}
+
+        # El bloque puede coincidir por su file_hash de nivel superior (la raíz de un lote) sin que ninguna entrada sea ese archivo
+        entradas = documento.get('entradas', [])
+        posicion = next((i for i, entrada in enumerate(entradas)
+                         if (file_hash and entrada['file_hash'] == file_hash)
+                         or (file_id and str(entrada['metadatos'].get('file_id')) == str(file_id))), None)
+        if posicion is None:
+            return {'message': 'No hay ningún bloque con ese archivo'}
+        hojas = [merkle.hoja(entrada) for entrada in entradas]
+
+        entrada = {'file_hash': entradas[posicion]['file_hash'], 'metadatos': entradas[posicion]['metadatos']}
+        return {'block': block, 'entrada': entrada, 'hoja': hojas[posicion],
+                'prueba': merkle.prueba(hojas, posicion), 'merkle_root': block['merkle_root']}
+
     def get_previous_hash(self):
         previous_hash = self.db_nosql.ultimo_registro()
         return previous_hash
 
+    def cargar_cabeza(self):
+        # Último bloque guardado; si la cadena aún no tiene bloques se parte del registro génesis
+        ultimo = self.db_nosql.ultimo_bloque()
+        if ultimo:
+            ultimo = codificacion.expandir(ultimo)
+            return {'index': ultimo['index'], 'hash': ultimo['hash'], 'proof': ultimo['proof']}
+
+        previous_hash = self.get_previous_hash()
+        if previous_hash is None:
+            return None
+        return {'index': 0, 'hash': previous_hash, 'proof': None}
+
+    def iniciar_cabeza(self):
+        # Carga la cabeza al arrancar la API; si la BD no responde se cargará en el primer bloque
+        try:
+            cabeza = self.cargar_cabeza()
+            if cabeza and (self.db_sql.ultimo_hash(cabeza['hash']) or self.outbox.bloque_pendiente(cabeza['hash'])):
+                self.cabeza.actualizar(cabeza['index'], cabeza['hash'], cabeza['proof'])
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+
     def proof_of_authority(self, previous_proof, private_key):
         try:
             # Obtner la clave pública del servidor a partir de la clave privada
@@ -85,7 +209,7 @@ class Blockchain:
             # Firmar el previous_proof con la clave privada del servidor
             proof = self.authentication.sign_proof(previous_proof, private_key)
 
-            return {'proof': proof, 'validador': server_public_key}
+            return {'proof': proof, 'validator': server_public_key, 'algoritmo': self.authentication.algoritmo(private_key)}
         except Exception as e:
             self.error_handle.manejar_error(e)
             return {'message': f'Error en el PoA: {str(e)}'}
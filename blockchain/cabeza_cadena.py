@@ -0,0 +1,53 @@
+import threading
+
+
+class CabezaCadena:
+    # Guarda en memoria el último bloque de la cadena (índice, hash y proof) para no consultarlo en cada bloque
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cabeza = None
+        self.validada = False # La cabeza cargada de la BD ya se contrastó una vez con la BD SQL
+        self.aciertos = 0
+        self.fallos = 0
+        self.conflictos = 0
+
+    def obtener(self):
+        with self._lock:
+            if self._cabeza is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+            return dict(self._cabeza)
+
+    def actualizar(self, index, hash, proof):
+        with self._lock:
+            self._cabeza = {'index': index, 'hash': hash, 'proof': proof}
+            self.validada = True
+
+    def avanzar(self, previous_hash, index, hash, proof):
+        # Solo avanza si la cabeza sigue siendo el bloque sobre el que se construyó el nuevo;
+        # si otro bloque se adelantó se invalida para revalidar contra la BD
+        with self._lock:
+            if self._cabeza is None or self._cabeza['hash'] != previous_hash:
+                self.conflictos += 1
+                self._cabeza = None
+                return False
+            self._cabeza = {'index': index, 'hash': hash, 'proof': proof}
+            return True
+
+    def invalidar(self):
+        with self._lock:
+            self._cabeza = None
+
+    def estadisticas(self):
+        with self._lock:
+            return {'cargada': self._cabeza is not None,
+                    'validada': self.validada,
+                    'index': self._cabeza['index'] if self._cabeza else None,
+                    'aciertos': self.aciertos,
+                    'fallos': self.fallos,
+                    'conflictos': self.conflictos}
+
+
+# Cabeza compartida por todas las instancias de Blockchain del proceso
+cabeza = CabezaCadena()
@@ -0,0 +1,104 @@
+import datetime
+import json
+import struct
+
+# Formato binario de un bloque: cabecera, campos de ancho fijo y firmas en bytes crudos.
+# Los bloques en JSON (formato original) no llevan el campo 'codificacion'
+BINARIO = 'binario'
+CABECERA = b'BVB\x01' # Identificador del formato y su versión
+ALGORITMOS = {'rsa': 0, 'ed25519': 1}
+EPOCA = datetime.datetime(1970, 1, 1)
+
+
+def _hash(valor):
+    # Los hashes SHA-256 en hexadecimal ocupan 32 bytes; cualquier otro valor (p. ej. el génesis) va con su longitud
+    if len(valor) == 64:
+        try:
+            return b'\x00' + bytes.fromhex(valor)
+        except ValueError:
+            pass
+    datos = valor.encode()
+    return b'\x01' + struct.pack('>H', len(datos)) + datos
+
+
+def _leer_hash(cuerpo, posicion):
+    if cuerpo[posicion] == 0:
+        return cuerpo[posicion + 1:posicion + 33].hex(), posicion + 33
+    longitud, = struct.unpack_from('>H', cuerpo, posicion + 1)
+    inicio = posicion + 3
+    return cuerpo[inicio:inicio + longitud].decode(), inicio + longitud
+
+
+def _variable(datos, formato='>H'):
+    return struct.pack(formato, len(datos)) + datos
+
+
+def _leer_variable(cuerpo, posicion, formato='>H'):
+    longitud, = struct.unpack_from(formato, cuerpo, posicion)
+    inicio = posicion + struct.calcsize(formato)
+    return cuerpo[inicio:inicio + longitud], inicio + longitud
+
+
+def codificar(block):
+    # Bytes del bloque sin 'hash' ni 'signature': se hashean y se firman tal cual, una sola serialización
+    timestamp = datetime.datetime.fromisoformat(block['timestamp'])
+    microsegundos = (timestamp - EPOCA) // datetime.timedelta(microseconds=1)
+    metadatos = json.dumps(block['metadatos'], sort_keys=True, separators=(',', ':'), ensure_ascii=True).encode()
+
+    return b''.join([CABECERA,
+                     struct.pack('>QqB', block['index'], microsegundos, ALGORITMOS[block.get('algoritmo', 'rsa')]),
+                     _hash(block['data']),
+                     _hash(block['previous_hash']),
+                     _hash(block['merkle_root']),
+                     _variable(bytes.fromhex(block['proof'])),
+                     _variable(bytes.fromhex(block['proof_signature'])),
+                     _variable(block['validator'].encode()),
+                     _variable(metadatos, '>I')])
+
+
+def decodificar(cuerpo):
+    if cuerpo[:len(CABECERA)] != CABECERA:
+        raise ValueError('Formato de bloque binario desconocido')
+
+    posicion = len(CABECERA)
+    index, microsegundos, algoritmo = struct.unpack_from('>QqB', cuerpo, posicion)
+    posicion += struct.calcsize('>QqB')
+    data, posicion = _leer_hash(cuerpo, posicion)
+    previous_hash, posicion = _leer_hash(cuerpo, posicion)
+    merkle_root, posicion = _leer_hash(cuerpo, posicion)
+    proof, posicion = _leer_variable(cuerpo, posicion)
+    proof_signature, posicion = _leer_variable(cuerpo, posicion)
+    validator, posicion = _leer_variable(cuerpo, posicion)
+    metadatos, posicion = _leer_variable(cuerpo, posicion, '>I')
+
+    return {'index': index,
+            'timestamp': str(EPOCA + datetime.timedelta(microseconds=microsegundos)),
+            'data': data,
+            'previous_hash': previous_hash,
+            'metadatos': json.loads(metadatos),
+            'proof': proof.hex(),
+            'validator': validator.decode(),
+            'merkle_root': merkle_root,
+            'algoritmo': next(nombre for nombre, codigo in ALGORITMOS.items() if codigo == algoritmo),
+            'proof_signature': proof_signature.hex()}
+
+
+def compactar(block, cuerpo):
+    # Documento guardado en registros_block: los campos consultados por la BD y el cuerpo binario
+    return {'index': block['index'],
+            'data': block['data'],
+            'previous_hash': block['previous_hash'],
+            'hash': block['hash'],
+            'codificacion': BINARIO,
+            'cuerpo': cuerpo,
+            'signature': block['signature']}
+
+
+def expandir(block):
+    # Bloque completo a partir del documento guardado; los bloques JSON se devuelven sin cambios
+    if block.get('codificacion') != BINARIO:
+        return block
+    completo = decodificar(bytes(block['cuerpo']))
+    completo.update({'hash': block['hash'], 'signature': block['signature'],
+                     'codificacion': BINARIO, 'cuerpo': bytes(block['cuerpo'])})
+    return completo
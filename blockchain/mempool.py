@@ -0,0 +1,181 @@
+import threading
+import uuid
+from decouple import config
+from error_handler import Errores
+from database import nosql
+from blockchain.blockchain import Blockchain
+
+
+class Mempool:
+    # Acumula los eventos de archivos (guardados en la BD) y los sella en un solo bloque
+    # cada MEMPOOL_LOTE eventos o cada MEMPOOL_INTERVALO_MS milisegundos
+    def __init__(self):
+        self.activo = config('MEMPOOL_ACTIVO', default=False, cast=bool)
+        self.tamano_lote = config('MEMPOOL_LOTE', default=100, cast=int)
+        self.intervalo = config('MEMPOOL_INTERVALO_MS', default=200, cast=int) / 1000
+        self.espera_max = config('MEMPOOL_ESPERA_MAX', default=30, cast=float)
+        self.concesion = config('MEMPOOL_CONCESION', default=60, cast=float) # Segundos que un worker retiene los eventos que sella
+        self.ruta_clave = config('MEMPOOL_CLAVE_PRIVADA_PATH', default='') # Para sellar lo recuperado sin esperar a una petición
+        self.propietario = uuid.uuid4().hex # Identifica a este worker al reclamar eventos
+        self.db_nosql = nosql.Nosql()
+        self.blockchain = Blockchain()
+        self.error_handle = Errores()
+        self._condicion = threading.Condition()
+        self._pendientes = 0
+        self._esperas = {} # evento_id -> (loop, future) de las peticiones que esperan el sellado
+        self._clave = None
+        self._hilo = None
+        self._detener = False
+        self.lotes = 0
+        self.eventos_sellados = 0
+
+    def iniciar(self):
+        if not self.activo or self._hilo is not None:
+            return
+        if self.ruta_clave:
+            with open(self.ruta_clave, 'r') as file:
+                if not self.autorizar(file.read()):
+                    self.error_handle.manejar_error(Exception('MEMPOOL_CLAVE_PRIVADA_PATH no contiene la clave del servidor'), levantar=False)
+        self.recuperar()
+        self._detener = False
+        self._hilo = threading.Thread(target=self.ciclo, name='mempool', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        if self._hilo is None:
+            return
+        with self._condicion:
+            self._detener = True
+            self._condicion.notify()
+        self._hilo.join()
+        self._hilo = None
+
+    def recuperar(self):
+        # Eventos pendientes que ya entraron en un bloque antes de una caída: se marcan como sellados
+        pendientes = self.db_nosql.eventos_pendientes(10 ** 6)
+        sellados = self.db_nosql.eventos_en_bloques([evento['_id'] for evento in pendientes])
+        for evento in pendientes:
+            hash_block = sellados.get(str(evento['_id']))
+            if hash_block:
+                self.db_nosql.marcar_sellados([evento['_id']], hash_block)
+        self._pendientes = len(pendientes) - len(sellados)
+
+    def autorizar(self, private_key):
+        # Misma comprobación que la prueba de autoridad de create_block, pero antes de encolar: solo la clave
+        # del servidor (único validador) puede añadir eventos, y solo ella se guarda para sellar los lotes
+        authentication = self.blockchain.authentication
+        publica = authentication.get_public_key(private_key)
+        if publica is None or publica != authentication.get_server_public_key():
+            return False
+        self._clave = private_key
+        return True
+
+    def nuevo_evento(self, evento_id, loop=None):
+        # Se registra antes de guardar el evento para no perder un sellado muy rápido;
+        # si se pasa el event loop devuelve un future que se resuelve con el hash del bloque
+        if loop is None:
+            return None
+        future = loop.create_future()
+        with self._condicion:
+            self._esperas[evento_id] = (loop, future)
+        return future
+
+    def encolado(self):
+        with self._condicion:
+            self._pendientes += 1
+            if self._pendientes >= self.tamano_lote:
+                self._condicion.notify()
+
+    def descartar(self, evento_id):
+        with self._condicion:
+            self._esperas.pop(evento_id, None)
+
+    def ciclo(self):
+        while True:
+            with self._condicion:
+                if not self._detener and self._pendientes < self.tamano_lote:
+                    self._condicion.wait(self.intervalo)
+                detener = self._detener
+            self.sellar()
+            if detener:
+                return
+
+    def sellar(self):
+        # Sin clave autorizada (ni MEMPOOL_CLAVE_PRIVADA_PATH ni ninguna petición todavía) no se puede firmar el bloque
+        try:
+            while self._clave is not None:
+                # Los eventos se reclaman antes de construir el bloque: otro worker no puede sellarlos a la vez
+                eventos = self.db_nosql.reclamar_eventos(self.tamano_lote, self.propietario, self.concesion)
+                if not eventos:
+                    return
+
+                # Un evento ya reclamado antes (concesión caducada o sellado fallido) puede estar en un bloque guardado
+                eventos = self.descartar_sellados(eventos)
+                if not eventos:
+                    continue
+
+                entradas = [{'file_hash': evento['file_hash'], 'metadatos': evento['metadatos'], 'evento_id': str(evento['_id'])}
+                            for evento in eventos]
+                ids = [evento['_id'] for evento in eventos]
+                resultado = self.blockchain.create_batch_block(entradas, self._clave)
+                if 'block' not in resultado:
+                    self.db_nosql.liberar_eventos(ids, self.propietario)
+                    return # Los eventos vuelven a la cola y se reintenta en el próximo ciclo
+
+                self.db_nosql.marcar_sellados(ids, resultado['block'])
+                self.resolver(ids, resultado['block'])
+
+                with self._condicion:
+                    self._pendientes = max(self._pendientes - len(ids), 0)
+                    self.lotes += 1
+                    self.eventos_sellados += len(ids)
+
+                if len(eventos) < self.tamano_lote:
+                    return
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+
+    def descartar_sellados(self, eventos):
+        reintentos = [evento['_id'] for evento in eventos if evento.get('intentos', 1) > 1]
+        sellados = self.db_nosql.eventos_en_bloques(reintentos) if reintentos else {}
+        if not sellados:
+            return eventos
+
+        restantes = []
+        for evento in eventos:
+            hash_block = sellados.get(str(evento['_id']))
+            if hash_block:
+                self.db_nosql.marcar_sellados([evento['_id']], hash_block)
+                self.resolver([evento['_id']], hash_block)
+            else:
+                restantes.append(evento)
+        with self._condicion:
+            self._pendientes = max(self._pendientes - (len(eventos) - len(restantes)), 0)
+        return restantes
+
+    def resolver(self, ids, hash_block):
+        with self._condicion:
+            esperas = [self._esperas.pop(evento_id, None) for evento_id in ids]
+
+        for espera in esperas:
+            if espera:
+                loop, future = espera
+                loop.call_soon_threadsafe(self.completar, future, hash_block)
+
+    def completar(self, future, hash_block):
+        if not future.done():
+            future.set_result(hash_block)
+
+    def estadisticas(self):
+        with self._condicion:
+            return {'activo': self.activo,
+                    'pendientes': self._pendientes,
+                    'esperando': len(self._esperas),
+                    'lotes': self.lotes,
+                    'eventos_sellados': self.eventos_sellados,
+                    'tamaño_medio_lote': self.eventos_sellados / self.lotes if self.lotes else 0.0}
+
+
+# Mempool compartido por el proceso
+mempool = Mempool()
@@ -0,0 +1,57 @@
+import hashlib
+import json
+
+# Prefijos distintos para hojas y nodos internos (como en RFC 6962) para que una hoja no pueda hacerse pasar por un nodo
+PREFIJO_HOJA = b'\x00'
+PREFIJO_NODO = b'\x01'
+
+
+def hoja(entrada):
+    # Hash de una entrada: su file_hash y sus metadatos en JSON canónico
+    contenido = json.dumps({'file_hash': entrada['file_hash'], 'metadatos': entrada['metadatos']}, sort_keys=True).encode()
+    return hashlib.sha256(PREFIJO_HOJA + contenido).hexdigest()
+
+
+def nodo(izquierda, derecha):
+    return hashlib.sha256(PREFIJO_NODO + bytes.fromhex(izquierda) + bytes.fromhex(derecha)).hexdigest()
+
+
+def siguiente_nivel(nivel):
+    # Combina los nodos de dos en dos; si el número es impar el último sube sin cambios
+    siguiente = [nodo(nivel[i], nivel[i + 1]) for i in range(0, len(nivel) - 1, 2)]
+    if len(nivel) % 2:
+        siguiente.append(nivel[-1])
+    return siguiente
+
+
+def raiz(hojas):
+    if not hojas:
+        return None
+
+    nivel = list(hojas)
+    while len(nivel) > 1:
+        nivel = siguiente_nivel(nivel)
+    return nivel[0]
+
+
+def prueba(hojas, posicion):
+    # Hermanos necesarios para recalcular la raíz desde la hoja indicada (O(log n) hashes)
+    camino = []
+    nivel = list(hojas)
+    while len(nivel) > 1:
+        hermano = posicion ^ 1
+        if hermano < len(nivel):
+            camino.append({'hash': nivel[hermano], 'lado': 'izquierda' if hermano < posicion else 'derecha'})
+        nivel = siguiente_nivel(nivel)
+        posicion //= 2
+    return camino
+
+
+def verificar(hash_hoja, camino, merkle_root):
+    actual = hash_hoja
+    for paso in camino:
+        if paso['lado'] == 'izquierda':
+            actual = nodo(paso['hash'], actual)
+        else:
+            actual = nodo(actual, paso['hash'])
+    return actual == merkle_root
@@ -0,0 +1,126 @@
+import datetime
+import threading
+import uuid
+from decouple import config
+from error_handler import Errores
+from database import nosql, sql
+import metricas
+
+
+class OutboxSql:
+    # Las filas SQL de cada bloque se marcan como pendientes en el propio documento del bloque (una sola
+    # escritura en la petición) y este hilo las registra en SQL por lotes, cada OUTBOX_LOTE bloques
+    # o cada OUTBOX_INTERVALO_MS milisegundos
+    def __init__(self):
+        self.activo = config('OUTBOX_ACTIVO', default=False, cast=bool)
+        self.tamano_lote = config('OUTBOX_LOTE', default=500, cast=int)
+        self.intervalo = config('OUTBOX_INTERVALO_MS', default=500, cast=int) / 1000
+        self.concesion = config('OUTBOX_CONCESION', default=60, cast=int)
+        self.propietario = uuid.uuid4().hex # Identifica los lotes que reclama este worker
+        self.db_nosql = nosql.Nosql()
+        self.db_sql = sql.Sql()
+        self.error_handle = Errores()
+        self._condicion = threading.Condition()
+        self._pendientes = 0
+        self._hilo = None
+        self._detener = False
+        self.lotes = 0
+        self.filas = 0
+        self.repetidos = 0
+        self.errores = 0
+
+    def iniciar(self):
+        if not self.activo or self._hilo is not None:
+            return
+        self._detener = False
+        self._hilo = threading.Thread(target=self.ciclo, name='outbox-sql', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        if self._hilo is None:
+            return
+        with self._condicion:
+            self._detener = True
+            self._condicion.notify()
+        self._hilo.join()
+        self._hilo = None
+
+    def encolado(self):
+        with self._condicion:
+            self._pendientes += 1
+            if self._pendientes >= self.tamano_lote:
+                self._condicion.notify()
+
+    def ciclo(self):
+        # Al arrancar se drena lo que quedó pendiente antes de una caída
+        while True:
+            self.drenar()
+            with self._condicion:
+                if self._detener:
+                    return
+                if self._pendientes < self.tamano_lote:
+                    self._condicion.wait(self.intervalo)
+
+    def drenar(self):
+        try:
+            while True:
+                documentos = self.db_nosql.reclamar_pendientes_sql(self.tamano_lote, self.propietario, self.concesion)
+                if not documentos:
+                    return
+                ids = [documento['_id'] for documento in documentos]
+
+                try:
+                    # Reanudación idempotente: los bloques cuyas filas ya están en SQL (caída entre el commit
+                    # y la marca en la BD NoSQL, o concesión caducada mientras otro worker los escribía) no se
+                    # vuelven a escribir
+                    registrados = self.db_sql.bloques_registrados([documento['block']['hash'] for documento in documentos])
+                    filas = [(documento['block']['hash'], entrada['file_hash'], entrada['metadatos']['file_id'],
+                              documento['_id'], entrada['metadatos']['nombre'])
+                             for documento in documentos if documento['block']['hash'] not in registrados
+                             for entrada in documento.get('entradas', [])]
+
+                    # Todas las filas del lote en una transacción; si falla, los bloques siguen pendientes
+                    if filas:
+                        with metricas.medir('outbox_lote'):
+                            self.db_sql.save_hash_files(filas)
+                except Exception:
+                    self.db_nosql.liberar_pendientes_sql(ids, self.propietario)
+                    raise
+
+                if not self.db_nosql.marcar_registrados_sql(ids, self.propietario):
+                    return
+
+                with self._condicion:
+                    self._pendientes = max(self._pendientes - len(documentos), 0)
+                    self.lotes += 1
+                    self.filas += len(filas)
+                    self.repetidos += len(registrados)
+
+                if len(documentos) < self.tamano_lote:
+                    return
+
+        except Exception as e:
+            with self._condicion:
+                self.errores += 1
+            self.error_handle.manejar_error(e, levantar=False)
+
+    def bloque_pendiente(self, hash_block):
+        # Un bloque aún en el outbox todavía no aparece en SQL y no por eso está comprometido
+        return self.activo and self.db_nosql.bloque_pendiente_sql(hash_block)
+
+    def estadisticas(self):
+        pendientes, antiguo = self.db_nosql.retraso_sql() if self.activo else (0, None)
+        if antiguo and antiguo.tzinfo is None:
+            antiguo = antiguo.replace(tzinfo=datetime.timezone.utc) # La BD devuelve las fechas en UTC sin zona
+        with self._condicion:
+            return {'activo': self.activo,
+                    'pendientes': pendientes,
+                    'retraso_segundos': (datetime.datetime.now(datetime.timezone.utc) - antiguo).total_seconds() if antiguo else 0.0,
+                    'lotes': self.lotes,
+                    'filas': self.filas,
+                    'repetidos': self.repetidos,
+                    'errores': self.errores}
+
+
+# Outbox compartido por el proceso
+outbox = OutboxSql()
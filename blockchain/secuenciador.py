@@ -0,0 +1,48 @@
+import random
+import threading
+import time
+from decouple import config
+
+
+class Secuenciador:
+    # Coordina el anexado de bloques entre procesos: la BD rechaza dos bloques con el mismo índice
+    # o el mismo previous_hash (índices únicos) y el bloque perdedor se reconstruye sobre la nueva cabeza
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.max_intentos = config('SECUENCIADOR_INTENTOS', default=5, cast=int)
+        self.espera_base = config('SECUENCIADOR_ESPERA_MS', default=5, cast=int) / 1000
+        self.indices_creados = False
+        self.anexados = 0
+        self.conflictos = 0
+        self.agotados = 0
+
+    def asegurar_indices(self, db_nosql):
+        if not self.indices_creados:
+            self.indices_creados = db_nosql.crear_indices_bloques()
+
+    def anexado(self):
+        with self._lock:
+            self.anexados += 1
+
+    def conflicto(self, intento):
+        with self._lock:
+            self.conflictos += 1
+
+        # Espera aleatoria creciente para que los workers en conflicto no vuelvan a chocar
+        time.sleep(random.uniform(0, self.espera_base * (2 ** intento)))
+
+    def agotado(self):
+        with self._lock:
+            self.agotados += 1
+
+    def estadisticas(self):
+        with self._lock:
+            intentos = self.anexados + self.conflictos
+            return {'anexados': self.anexados,
+                    'conflictos': self.conflictos,
+                    'agotados': self.agotados,
+                    'tasa_conflicto': self.conflictos / intentos if intentos else 0.0}
+
+
+# Secuenciador compartido por todas las instancias de Blockchain del proceso
+secuenciador = Secuenciador()
@@ -0,0 +1,215 @@
+import collections
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decouple import config, Csv
+from error_handler import Errores
+from database import nosql
+from security.authentication import Authentication
+from blockchain import codificacion, merkle
+from blockchain.blockchain import Blockchain
+
+# Una sola verificación a la vez en el proceso: cada una arranca su propio pool de procesos
+_verificacion = threading.Lock()
+
+
+def verificar_firmas(claves, bloques):
+    # Se ejecuta en los procesos del pool: comprueba proof, proof_signature y signature de cada bloque
+    # con el algoritmo registrado en el bloque (los bloques anteriores a su registro son RSA)
+    authentication = Authentication()
+    errores = []
+    for block in bloques:
+        algoritmo = block.get('algoritmo', 'rsa')
+
+        # Clave del validador del bloque si es de confianza; sin validador se prueba con todas las claves
+        validator = block.get('validator')
+        candidatas = ([validator] if validator in claves else []) if validator else claves
+        if not candidatas:
+            errores.append({'index': block['index'], 'error': 'validator no autorizado'})
+            continue
+
+        public_key = next((clave for clave in candidatas
+                           if authentication.verify_proof(block['previous_hash'], block['proof'], clave, algoritmo)), None)
+        if public_key is None:
+            errores.append({'index': block['index'], 'error': 'proof inválido'})
+        elif not authentication.verify_proof(str(block['proof']), block['proof_signature'], public_key, algoritmo):
+            errores.append({'index': block['index'], 'error': 'proof_signature inválida'})
+        elif not authentication.verify_block(block, public_key):
+            errores.append({'index': block['index'], 'error': 'signature inválida'})
+    return errores
+
+
+class Verificador:
+    # Recorre registros_block en orden de índice: el hash, el enlace con el bloque anterior y la raíz de Merkle
+    # se comprueban en este proceso y las firmas (lo costoso) se reparten por lotes en un pool de procesos
+    def __init__(self, procesos=None, tamano_lote=None, max_errores=None):
+        self.procesos = procesos or config('VERIFICADOR_PROCESOS', default=os.cpu_count() or 1, cast=int)
+        self.tamano_lote = tamano_lote or config('VERIFICADOR_LOTE', default=500, cast=int)
+        self.max_errores = max_errores or config('VERIFICADOR_MAX_ERRORES', default=100, cast=int)
+        self.checkpoints_revisados = config('VERIFICADOR_CHECKPOINTS', default=5, cast=int)
+        self.rutas_claves_anteriores = config('VERIFICADOR_CLAVES_ANTERIORES', default='', cast=Csv()) # PEM de claves ya rotadas
+        self.db_nosql = nosql.Nosql()
+        self.blockchain = Blockchain()
+        self.authentication = Authentication()
+        self.error_handle = Errores()
+
+    def verificar(self, desde=None, progreso=None, private_key=None):
+        if not _verificacion.acquire(blocking=False):
+            return {'message': 'Ya hay una verificación de la cadena en curso'}
+        try:
+            return self._verificar(desde, progreso, private_key)
+        finally:
+            _verificacion.release()
+
+    def _verificar(self, desde, progreso, private_key):
+        # Sin 'desde' se reanuda desde el último checkpoint válido y solo se verifican los bloques nuevos;
+        # con la clave privada del servidor se firma un checkpoint nuevo al terminar sin errores
+        inicio = time.monotonic()
+        resumen = {'bloques': 0, 'errores': [], 'total_errores': 0, 'ultimo_index': None, 'ultimo_hash': None}
+
+        public_key = self.authentication.get_server_public_key()
+        if public_key is None:
+            return self.error_handle.manejar_error(Exception('No se pudo obtener la clave pública del servidor'), levantar=False)
+        claves = [public_key] + self.claves_anteriores() # Tras rotar la clave (p. ej. de RSA a Ed25519) la cadena es mixta
+
+        checkpoint = self.ultimo_checkpoint(public_key) if desde is None else None
+        if checkpoint:
+            desde, previous_hash, acumulador = checkpoint['index'], checkpoint['hash'], checkpoint['acumulador']
+        elif not desde:
+            # Desde el principio, el primer bloque debe enlazar con el registro génesis
+            desde, previous_hash, acumulador = 0, self.blockchain.get_previous_hash(), ''
+        else:
+            previous_hash, acumulador = None, None # Sin acumulador previo no se puede firmar un checkpoint
+
+        # 'spawn': en la API el proceso tiene hilos vivos (clientes de Mongo, mempool, outbox) que fork copiaría a medias
+        with ProcessPoolExecutor(max_workers=self.procesos, mp_context=multiprocessing.get_context('spawn')) as pool:
+            pendientes = collections.deque() # Lotes enviados al pool, limitados para no cargar la cadena en memoria
+            lote = []
+
+            for documento in self.db_nosql.iterar_bloques(desde, self.tamano_lote):
+                try:
+                    block = codificacion.expandir(documento['block'])
+                except (ValueError, KeyError, struct.error):
+                    # Cuerpo binario corrupto: se informa y se sigue enlazando con el hash guardado
+                    self.anotar(resumen, documento['block'].get('index'), 'bloque ilegible')
+                    previous_hash = documento['block'].get('hash')
+                    resumen['bloques'] += 1
+                    continue
+                self.verificar_estructura(block, documento.get('entradas'), previous_hash, resumen)
+                previous_hash = block['hash']
+                if acumulador is not None:
+                    acumulador = self.acumular(acumulador, block['hash'])
+                resumen['bloques'] += 1
+                resumen['ultimo_index'] = block['index']
+                resumen['ultimo_hash'] = block['hash']
+
+                lote.append(block)
+                if len(lote) >= self.tamano_lote:
+                    pendientes.append(pool.submit(verificar_firmas, claves, lote))
+                    lote = []
+
+                    if len(pendientes) >= self.procesos * 2:
+                        self.recoger(pendientes.popleft(), resumen)
+                        if progreso:
+                            progreso(self.avance(resumen, inicio))
+
+            if lote:
+                pendientes.append(pool.submit(verificar_firmas, claves, lote))
+            while pendientes:
+                self.recoger(pendientes.popleft(), resumen)
+
+        resultado = self.avance(resumen, inicio)
+        resultado['errores'] = resumen['errores']
+        resultado['valida'] = resumen['total_errores'] == 0
+        resultado['desde'] = desde
+        resultado['checkpoint'] = checkpoint['index'] if checkpoint else None
+        resultado['checkpoint_guardado'] = False
+
+        if resultado['valida'] and resumen['bloques'] and acumulador is not None and private_key:
+            resultado['checkpoint_guardado'] = self.guardar_checkpoint(resumen['ultimo_index'], resumen['ultimo_hash'],
+                                                                       acumulador, private_key, public_key)
+        if progreso:
+            progreso(resultado)
+        return resultado
+
+    def claves_anteriores(self):
+        claves = []
+        for ruta in self.rutas_claves_anteriores:
+            with open(ruta, 'r') as file:
+                claves.append(file.read())
+        return claves
+
+    def acumular(self, acumulador, hash_block):
+        # Acumulador encadenado de los hashes verificados: resume toda la cadena hasta el bloque en un solo valor
+        return hashlib.sha256((acumulador + hash_block).encode()).hexdigest()
+
+    def contenido_checkpoint(self, index, hash_block, acumulador):
+        return json.dumps({'index': index, 'hash': hash_block, 'acumulador': acumulador}, sort_keys=True)
+
+    def ultimo_checkpoint(self, public_key):
+        # El checkpoint más reciente con firma válida del servidor cuyo bloque sigue en la cadena con el mismo hash
+        for checkpoint in self.db_nosql.checkpoints_recientes(self.checkpoints_revisados):
+            contenido = self.contenido_checkpoint(checkpoint['index'], checkpoint['hash'], checkpoint['acumulador'])
+            if not self.authentication.verify_proof(contenido, checkpoint['firma'], public_key):
+                continue
+
+            block = self.db_nosql.bloque_por_indice(checkpoint['index'])
+            if block and block['hash'] == checkpoint['hash']:
+                return checkpoint
+        return None
+
+    def guardar_checkpoint(self, index, hash_block, acumulador, private_key, public_key):
+        # Solo el servidor (único validador) firma checkpoints
+        if self.authentication.get_public_key(private_key) != public_key:
+            self.error_handle.manejar_error(Exception('Clave privada incorrecta para firmar el checkpoint'), levantar=False)
+            return False
+
+        firma = self.authentication.sign_proof(self.contenido_checkpoint(index, hash_block, acumulador), private_key)
+        checkpoint = {'index': index,
+                      'hash': hash_block,
+                      'acumulador': acumulador,
+                      'firma': firma,
+                      'timestamp': str(datetime.datetime.now())}
+        return self.db_nosql.guardar_checkpoint(checkpoint) is not None
+
+    def verificar_estructura(self, block, entradas, previous_hash, resumen):
+        # Mismo JSON canónico que Blockchain.hash (el hash se calculó sin 'hash' ni 'signature')
+        # o, en los bloques binarios, los bytes guardados de los que se decodificaron los campos
+        if 'cuerpo' in block:
+            calculado = hashlib.sha256(block['cuerpo']).hexdigest()
+        else:
+            calculado = self.blockchain.hash({clave: valor for clave, valor in block.items() if clave not in ('hash', 'signature')})
+        if calculado != block.get('hash'):
+            self.anotar(resumen, block['index'], 'hash incorrecto')
+
+        if previous_hash is not None and block.get('previous_hash') != previous_hash:
+            self.anotar(resumen, block['index'], 'previous_hash no enlaza con el bloque anterior')
+
+        # Bloques anteriores a las raíces de Merkle no guardan entradas
+        if 'merkle_root' in block and entradas:
+            if merkle.raiz([merkle.hoja(entrada) for entrada in entradas]) != block['merkle_root']:
+                self.anotar(resumen, block['index'], 'merkle_root no corresponde a las entradas')
+
+    def recoger(self, futuro, resumen):
+        for error in futuro.result():
+            self.anotar(resumen, error['index'], error['error'])
+
+    def anotar(self, resumen, index, error):
+        resumen['total_errores'] += 1
+        if len(resumen['errores']) < self.max_errores:
+            resumen['errores'].append({'index': index, 'error': error})
+
+    def avance(self, resumen, inicio):
+        segundos = time.monotonic() - inicio
+        return {'bloques': resumen['bloques'],
+                'total_errores': resumen['total_errores'],
+                'ultimo_index': resumen['ultimo_index'],
+                'ultimo_hash': resumen['ultimo_hash'],
+                'segundos': round(segundos, 3),
+                'bloques_por_segundo': round(resumen['bloques'] / segundos, 1) if segundos else 0.0}
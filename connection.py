@@ -1,8 +1,96 @@
+import threading
+import time
+from contextlib import contextmanager
 from decouple import config
 from error_handler import Errores
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient, monitoring
 from pymongo.errors import PyMongoError
 import mysql.connector
+import mysql.connector.pooling
+
+
+class EstadisticasPool(monitoring.ConnectionPoolListener):
+    # Lleva la cuenta de las conexiones prestadas, las peticiones en espera y el tiempo de espera del pool
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.creadas = 0
+        self.cerradas = 0
+        self.prestadas = 0
+        self.esperando = 0
+        self.prestamos = 0
+        self.fallos = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.creadas += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.cerradas += 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.esperando += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.esperando -= 1
+            self.fallos += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.esperando -= 1
+            self.prestadas += 1
+            self.prestamos += 1
+            self.espera_total += event.duration
+            self.espera_max = max(self.espera_max, event.duration)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.prestadas -= 1
+
+    def resumen(self):
+        with self._lock:
+            return {'abiertas': self.creadas - self.cerradas,
+                    'prestadas': self.prestadas,
+                    'esperando': self.esperando,
+                    'prestamos': self.prestamos,
+                    'fallos': self.fallos,
+                    'espera_media_ms': (self.espera_total / self.prestamos * 1000) if self.prestamos else 0.0,
+                    'espera_max_ms': self.espera_max * 1000}
+
+
+# Cliente de MongoDB compartido por todo el proceso (se crea en el arranque y se cierra al apagar la API)
+_cliente_nosql = None
+_estadisticas_nosql = EstadisticasPool()
+_lock_nosql = threading.Lock()
+
+# Cliente asíncrono compartido, usado por las rutas async para no bloquear el event loop
+_cliente_nosql_async = None
+_estadisticas_nosql_async = EstadisticasPool()
+
+# Pool de conexiones MySQL compartido; el semáforo limita los préstamos y permite esperar a que se libere una
+_pool_sql = None
+_semaforo_sql = None
+_lock_sql = threading.Lock()
+_estadisticas_sql = {'prestadas': 0, 'esperas': 0, 'espera_total': 0.0, 'reconexiones': 0, 'agotado': 0}
 
 
 class Connection:
@@ -11,20 +99,168 @@ class Connection:
 
     def connection_sql(self):
         try:
-            return mysql.connector.connect(host=config('MYSQL_HOST'),
-                                           database=config('MYSQL_BD'),
-                                           port=config('MYSQL_PORT'),
-                                           user=config('MYSQL_USER'),
-                                           password=config('MYSQL_PASSWORD'))
+            # Toma una conexión del pool y comprueba que siga viva antes de entregarla
+            conn = self.iniciar_sql().get_connection()
+            if not conn.is_connected():
+                conn.reconnect(attempts=2, delay=0)
+                with _lock_sql:
+                    _estadisticas_sql['reconexiones'] += 1
+            return conn
         except mysql.connector.Error as err:
             self.error_handle.manejar_error(err)
 
+    def iniciar_sql(self):
+        global _pool_sql
+        with _lock_sql:
+            if _pool_sql is None:
+                tamano = config('MYSQL_POOL_SIZE', default=10, cast=int)
+                _pool_sql = mysql.connector.pooling.MySQLConnectionPool(pool_name='blockvault',
+                                                                        pool_size=tamano,
+                                                                        pool_reset_session=True,
+                                                                        host=config('MYSQL_HOST'),
+                                                                        database=config('MYSQL_BD'),
+                                                                        port=config('MYSQL_PORT'),
+                                                                        user=config('MYSQL_USER'),
+                                                                        password=config('MYSQL_PASSWORD'))
+            return _pool_sql
+
+    def semaforo_sql(self):
+        global _semaforo_sql
+        with _lock_sql:
+            if _semaforo_sql is None:
+                _semaforo_sql = threading.BoundedSemaphore(config('MYSQL_POOL_SIZE', default=10, cast=int))
+            return _semaforo_sql
+
+    @contextmanager
+    def sesion_sql(self):
+        # Presta una conexión y un cursor; al salir se cierra el cursor y la conexión vuelve al pool
+        semaforo = self.semaforo_sql()
+        inicio = time.monotonic()
+        if not semaforo.acquire(timeout=config('MYSQL_POOL_TIMEOUT', default=10, cast=float)):
+            with _lock_sql:
+                _estadisticas_sql['agotado'] += 1
+            raise mysql.connector.errors.PoolError('No hay conexiones SQL disponibles en el pool')
+        with _lock_sql:
+            _estadisticas_sql['prestadas'] += 1
+            _estadisticas_sql['esperas'] += 1
+            _estadisticas_sql['espera_total'] += time.monotonic() - inicio
+
+        conn = None
+        cursor = None
+        try:
+            conn = self.connection_sql()
+            cursor = conn.cursor()
+            yield conn, cursor
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+            with _lock_sql:
+                _estadisticas_sql['prestadas'] -= 1
+            semaforo.release()
+
+    def cerrar_sql(self):
+        global _pool_sql
+        if _pool_sql is None:
+            return
+
+        # Se espera a que vuelvan las conexiones prestadas: cada permiso del semáforo es una conexión fuera del pool
+        semaforo = self.semaforo_sql()
+        espera = config('MYSQL_POOL_TIMEOUT', default=10, cast=float)
+        tamano = config('MYSQL_POOL_SIZE', default=10, cast=int)
+        tomados = 0
+        while tomados < tamano and semaforo.acquire(timeout=espera):
+            tomados += 1
+
+        with _lock_sql:
+            pool = _pool_sql
+            _pool_sql = None
+        try:
+            # Solo con la API pública del conector: se sacan las conexiones del pool y se desconectan
+            # en lugar de devolverlas (close() las devolvería al pool)
+            for _ in range(pool.pool_size if pool is not None else 0):
+                try:
+                    conn = pool.get_connection()
+                except mysql.connector.errors.PoolError:
+                    break # El pool ya está vacío
+                try:
+                    conn.disconnect()
+                except mysql.connector.Error:
+                    pass
+        finally:
+            for _ in range(tomados):
+                semaforo.release()
+
+    def estadisticas_sql(self):
+        with _lock_sql:
+            resumen = dict(_estadisticas_sql)
+        esperas = resumen.pop('esperas')
+        resumen['espera_media_ms'] = (resumen.pop('espera_total') / esperas * 1000) if esperas else 0.0
+        resumen['tamaño_max'] = config('MYSQL_POOL_SIZE', default=10, cast=int)
+        return resumen
+
     def connection_nosql(self):
+        # Devuelve el cliente compartido; si la API no lo inició todavía se crea aquí
+        if _cliente_nosql is None:
+            return self.iniciar_nosql()
+        return _cliente_nosql
+
+    def opciones_nosql(self):
+        return {'host': config('NOSQL_HOST'),
+                'port': int(config('NOSQL_PORT')),
+                'maxPoolSize': config('NOSQL_POOL_SIZE', default=50, cast=int),
+                'minPoolSize': config('NOSQL_POOL_MIN', default=0, cast=int),
+                'waitQueueTimeoutMS': config('NOSQL_POOL_TIMEOUT_MS', default=10000, cast=int)}
+
+    def iniciar_nosql(self):
+        global _cliente_nosql
+        try:
+            with _lock_nosql:
+                if _cliente_nosql is None:
+                    _cliente_nosql = MongoClient(event_listeners=[_estadisticas_nosql], **self.opciones_nosql())
+                return _cliente_nosql
+
+        except PyMongoError as err:
+            self.error_handle.manejar_error(err)
+
+    def connection_nosql_async(self):
+        if _cliente_nosql_async is None:
+            return self.iniciar_nosql_async()
+        return _cliente_nosql_async
+
+    def iniciar_nosql_async(self):
+        global _cliente_nosql_async
         try:
-            cliente = MongoClient(host=config('NOSQL_HOST'),
-                                  port=int(config('NOSQL_PORT')))
-            return cliente
+            with _lock_nosql:
+                if _cliente_nosql_async is None:
+                    _cliente_nosql_async = AsyncMongoClient(event_listeners=[_estadisticas_nosql_async],
+                                                            **self.opciones_nosql())
+                return _cliente_nosql_async
 
         except PyMongoError as err:
             self.error_handle.manejar_error(err)
 
+    def cerrar_nosql(self):
+        global _cliente_nosql
+        with _lock_nosql:
+            if _cliente_nosql is not None:
+                _cliente_nosql.close()
+                _cliente_nosql = None
+
+    async def cerrar_nosql_async(self):
+        global _cliente_nosql_async
+        cliente = _cliente_nosql_async
+        _cliente_nosql_async = None
+        if cliente is not None:
+            await cliente.close()
+
+    def estadisticas_nosql(self):
+        resumen = _estadisticas_nosql.resumen()
+        resumen['tamaño_max'] = config('NOSQL_POOL_SIZE', default=50, cast=int)
+        return resumen
+
+    def estadisticas_nosql_async(self):
+        resumen = _estadisticas_nosql_async.resumen()
+        resumen['tamaño_max'] = config('NOSQL_POOL_SIZE', default=50, cast=int)
+        return resumen
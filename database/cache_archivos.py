@@ -0,0 +1,134 @@
+import collections
+import threading
+from decouple import config
+
+
+class ArchivoEnMemoria:
+    # Archivo servido desde la caché: misma interfaz de lectura que AsyncGridOut (length, seek, readchunk, read)
+    def __init__(self, contenido, content_type, metadata, filename=None, tamano_chunk=255 * 1024):
+        self.contenido = contenido
+        self.length = len(contenido)
+        self.content_type = content_type
+        self.metadata = metadata
+        self.filename = filename
+        self.tamano_chunk = tamano_chunk
+        self._posicion = 0
+
+    async def seek(self, posicion):
+        self._posicion = posicion
+
+    async def readchunk(self):
+        datos = self.contenido[self._posicion:self._posicion + self.tamano_chunk]
+        self._posicion += len(datos)
+        return datos
+
+    async def read(self):
+        datos = self.contenido[self._posicion:]
+        self._posicion = self.length
+        return datos
+
+
+class CacheArchivos:
+    # Contenido de los archivos más leídos, indexado por su hash (los archivos con el mismo contenido lo comparten)
+    # y con un índice file_id -> hash. Se expulsan los menos usados hasta caber en CACHE_ARCHIVOS_BYTES;
+    # los archivos de más de CACHE_ARCHIVOS_MAX_ARCHIVO bytes no se guardan
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.max_bytes = config('CACHE_ARCHIVOS_BYTES', default=64 * 1024 * 1024, cast=int)
+        self.max_archivo = config('CACHE_ARCHIVOS_MAX_ARCHIVO', default=4 * 1024 * 1024, cast=int)
+        self._contenidos = collections.OrderedDict() # hash -> (contenido, content_type, metadata)
+        self._ids = {} # file_id -> hash
+        self._archivos = {} # hash -> file_ids que lo usan
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.omitidos = 0
+        self.expulsiones = 0
+        self.bytes_ahorrados = 0
+
+    def admite(self, tamano):
+        return 0 < self.max_bytes and tamano <= min(self.max_archivo, self.max_bytes)
+
+    def obtener(self, file_id):
+        with self._lock:
+            file_hash = self._ids.get(str(file_id))
+            entrada = self._contenidos.get(file_hash)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._contenidos.move_to_end(file_hash)
+            self.aciertos += 1
+            self.bytes_ahorrados += len(entrada[0])
+
+        contenido, content_type, metadata = entrada
+        return ArchivoEnMemoria(contenido, content_type, metadata)
+
+    def omitido(self):
+        with self._lock:
+            self.omitidos += 1
+
+    def guardar(self, file_id, file_hash, contenido, content_type, metadata):
+        if not self.admite(len(contenido)):
+            return
+
+        with self._lock:
+            anterior = self._ids.get(str(file_id))
+            if anterior is not None:
+                self._quitar_referencia(anterior, str(file_id))
+            self._ids[str(file_id)] = file_hash
+            self._archivos.setdefault(file_hash, set()).add(str(file_id))
+
+            if file_hash in self._contenidos:
+                self._contenidos.move_to_end(file_hash)
+            else:
+                self._contenidos[file_hash] = (bytes(contenido), content_type, metadata)
+                self.bytes += len(contenido)
+
+            # Expulsa los contenidos menos usados hasta volver al presupuesto
+            while self.bytes > self.max_bytes:
+                expulsado, (datos, _, _) = self._contenidos.popitem(last=False)
+                self.bytes -= len(datos)
+                self.expulsiones += 1
+                for id_expulsado in self._archivos.pop(expulsado, ()):
+                    del self._ids[id_expulsado]
+
+    def invalidar(self, file_id):
+        # Al borrar un archivo; su contenido solo sale de la caché si ningún otro archivo lo usa
+        with self._lock:
+            file_hash = self._ids.pop(str(file_id), None)
+            if file_hash is not None:
+                self._quitar_referencia(file_hash, str(file_id))
+
+    def _quitar_referencia(self, file_hash, file_id):
+        archivos = self._archivos.get(file_hash, set())
+        archivos.discard(file_id)
+        if not archivos:
+            self._archivos.pop(file_hash, None)
+            entrada = self._contenidos.pop(file_hash, None)
+            if entrada is not None:
+                self.bytes -= len(entrada[0])
+
+    def vaciar(self):
+        with self._lock:
+            self._contenidos.clear()
+            self._ids.clear()
+            self._archivos.clear()
+            self.bytes = 0
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {'archivos': len(self._ids),
+                    'contenidos': len(self._contenidos),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes,
+                    'aciertos': self.aciertos,
+                    'fallos': self.fallos,
+                    'omitidos': self.omitidos,
+                    'expulsiones': self.expulsiones,
+                    'bytes_ahorrados': self.bytes_ahorrados,
+                    'tasa_acierto': self.aciertos / consultas if consultas else 0.0}
+
+
+# Caché compartida por el proceso
+cache_archivos = CacheArchivos()
@@ -0,0 +1,72 @@
+import bz2
+import lzma
+import zlib
+from decouple import config
+
+# Códecs de la biblioteca estándar; cada marco se comprime por separado para poder leer desde cualquier posición
+CODECS = {'zlib': (lambda datos: zlib.compress(datos, 6), zlib.decompress),
+          'lzma': (lambda datos: lzma.compress(datos, preset=1), lzma.decompress),
+          'bz2': (lambda datos: bz2.compress(datos, 9), bz2.decompress)}
+
+
+def comprimir(codec, datos):
+    return CODECS[codec][0](datos)
+
+
+def descomprimir(codec, datos):
+    return CODECS[codec][1](datos)
+
+
+def elegir_codec(muestra):
+    # Solo se comprime si la muestra (el principio del archivo) se reduce lo suficiente; los archivos
+    # cifrados o ya comprimidos se guardan tal cual y no pagan la compresión
+    if not config('COMPRESION_ACTIVA', default=False, cast=bool) or not muestra:
+        return None
+
+    codec = config('COMPRESION_CODEC', default='zlib')
+    ratio = len(comprimir(codec, muestra)) / len(muestra)
+    return codec if ratio <= config('COMPRESION_RATIO_MAX', default=0.8, cast=float) else None
+
+
+class ArchivoComprimido:
+    # Archivo de GridFS guardado comprimido por marcos: expone el tamaño y el contenido originales con la misma
+    # interfaz de lectura que AsyncGridOut (length, seek, readchunk, read) y descomprime un marco cada vez
+    def __init__(self, grid_out):
+        self.grid_out = grid_out
+        self.metadata = grid_out.metadata
+        self.content_type = grid_out.content_type
+        self.filename = grid_out.filename
+        self.length = grid_out.metadata['tamaño']
+        self.codec = grid_out.metadata['codec']
+        self.marco = grid_out.metadata['marco']
+        self.longitudes = grid_out.metadata['marcos']
+        self._desplazamientos = [0]
+        for longitud in self.longitudes[:-1]:
+            self._desplazamientos.append(self._desplazamientos[-1] + longitud)
+        self._posicion = 0
+        self._actual = (None, b'') # Último marco descomprimido
+
+    async def seek(self, posicion):
+        self._posicion = posicion
+
+    async def readchunk(self):
+        if self._posicion >= self.length:
+            return b''
+
+        indice = self._posicion // self.marco
+        if self._actual[0] != indice:
+            await self.grid_out.seek(self._desplazamientos[indice])
+            comprimido = await self.grid_out.read(self.longitudes[indice])
+            self._actual = (indice, descomprimir(self.codec, comprimido))
+
+        inicio = self._posicion - indice * self.marco
+        self._posicion = indice * self.marco + len(self._actual[1])
+        return self._actual[1][inicio:]
+
+    async def read(self):
+        partes = []
+        while True:
+            datos = await self.readchunk()
+            if not datos:
+                return b''.join(partes)
+            partes.append(datos)
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from decouple import config
+
+# Tabla Gear fija (derivada de SHA-256) para que los cortes sean iguales en todos los procesos y versiones
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)]
+MASCARA_64 = (1 << 64) - 1
+
+
+def buscar_cortes(datos, minimo, maximo, umbral):
+    # Fines de los fragmentos completos de 'datos' (el resto queda pendiente). Es una función pura sobre bytes
+    # para poder ejecutarla en otro proceso: el bucle byte a byte es CPU en Python y retiene el GIL
+    cortes = []
+    inicio = 0
+    total = len(datos)
+    while True:
+        limite = min(total, inicio + maximo)
+        h = 0
+        corte = None
+
+        # Los primeros 'minimo' bytes de cada fragmento nunca forman un corte: no hace falta pasarlos por el hash
+        for i in range(inicio + minimo, limite):
+            h = ((h << 1) + GEAR[datos[i]]) & MASCARA_64
+            if h < umbral:
+                corte = i + 1
+                break
+
+        if corte is None:
+            if total - inicio < maximo:
+                return cortes
+            corte = inicio + maximo
+        cortes.append(corte)
+        inicio = corte
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    # Procesos compartidos para buscar los cortes sin bloquear el resto de peticiones del worker
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=config('FRAGMENTOS_PROCESOS', default=2, cast=int),
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def cerrar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+class Fragmentador:
+    # Troceado definido por el contenido (rolling hash Gear, como FastCDC): los cortes dependen de los bytes
+    # y no de la posición, así que insertar o borrar unos KB solo cambia los fragmentos de alrededor
+    def __init__(self, minimo=None, medio=None, maximo=None):
+        self.minimo = minimo or config('FRAGMENTO_MIN', default=8 * 1024, cast=int)
+        self.medio = medio or config('FRAGMENTO_MEDIO', default=32 * 1024, cast=int)
+        self.maximo = maximo or config('FRAGMENTO_MAX', default=128 * 1024, cast=int)
+
+        # Tras el mínimo se corta en cada byte con probabilidad 1 / (medio - minimo) (hash por debajo del umbral),
+        # así el tamaño medio es 'medio' (algo menos por el recorte en 'maximo'); con una máscara de bits la
+        # probabilidad solo podría ser una potencia de dos
+        self.umbral = (MASCARA_64 + 1) // max(self.medio - self.minimo, 1)
+        self._buffer = bytearray()
+
+    def agregar(self, datos):
+        # Devuelve los fragmentos completos; el resto queda pendiente hasta el siguiente bloque
+        self._buffer += datos
+        return self.separar(buscar_cortes(self._buffer, self.minimo, self.maximo, self.umbral))
+
+    async def agregar_en_proceso(self, datos):
+        # Igual que agregar, pero los cortes se buscan en el pool de procesos
+        self._buffer += datos
+        futuro = pool().submit(buscar_cortes, bytes(self._buffer), self.minimo, self.maximo, self.umbral)
+        return self.separar(await asyncio.wrap_future(futuro))
+
+    def separar(self, cortes):
+        fragmentos = []
+        inicio = 0
+        for corte in cortes:
+            fragmentos.append(bytes(self._buffer[inicio:corte]))
+            inicio = corte
+        del self._buffer[:inicio]
+        return fragmentos
+
+    def terminar(self):
+        # Lo pendiente ya se recorrió al agregarlo sin encontrar un corte: es el último fragmento
+        fragmentos = [bytes(self._buffer)] if self._buffer else []
+        self._buffer.clear()
+        return fragmentos
+
+
+def hash_manifiesto(manifiesto):
+    # Hash del manifiesto (lista de [hash del fragmento, tamaño]) que se registra en el bloque
+    return hashlib.sha256(json.dumps(manifiesto, separators=(',', ':')).encode()).hexdigest()
@@ -1,4 +1,7 @@
+import datetime
+from bson import ObjectId
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from error_handler import Errores
 from connection import Connection
 import gridfs
@@ -24,10 +27,6 @@ class Nosql:
         except Exception as e:
             self.error_handle.manejar_error(e)
 
-        finally:
-            if cliente:
-                cliente.close()
-
     def ultimo_registro(self):
         try:
             cliente = self.conect.connection_nosql()
@@ -48,39 +47,79 @@ class Nosql:
         except Exception as e:
             self.error_handle.manejar_error(e)
 
-    def save_block(self, block):
+    def ultimo_bloque(self):
+        try:
+            cliente = self.conect.connection_nosql()
+            db = cliente['mi_base_de_datos_blockchain']
+            collection = db['registros_block']
+
+            # El campo 'name' guarda el índice del bloque
+            documento = collection.find_one({}, sort=[('name', -1)])
+            return documento['block'] if documento else None
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    def crear_indices_bloques(self):
+        try:
+            cliente = self.conect.connection_nosql()
+            db = cliente['mi_base_de_datos_blockchain']
+            collection = db['registros_block']
+
+            # Un índice y un previous_hash solo pueden tener un bloque: así dos workers no bifurcan la cadena
+            collection.create_index('name', unique=True)
+            collection.create_index('block.previous_hash', unique=True)
+
+            # Solo los bloques pendientes de registrar en SQL tienen el campo: el índice disperso se mantiene pequeño
+            collection.create_index('pendiente_sql', sparse=True)
+            collection.create_index('outbox_lote', sparse=True)
+
+            # Mempool: eventos por estado y por lote reclamado, y bloque de cada evento al recuperar un lote
+            collection.create_index('entradas.evento_id', sparse=True)
+            db['mempool'].create_index('estado')
+            db['mempool'].create_index('lote', sparse=True)
+            return True
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return False
+
+    def save_block(self, block, entradas=None, pendiente_sql=False):
         try:
             cliente = self.conect.connection_nosql()
             db = cliente['mi_base_de_datos_blockchain']
             collection = db['registros_block']
 
-            # Guardando el registro en la bd
-            collection.insert_one({'name': block['index'], 'file_hash': block['data'], 'block': block, 'enable': True})
+            # Guardando el registro en la bd; las entradas de un lote van fuera del bloque (las cubre su merkle_root)
+            documento = {'name': block['index'], 'file_hash': block['data'], 'block': block, 'enable': True}
+            if entradas:
+                documento['entradas'] = entradas
+            if pendiente_sql:
+                # Outbox: la fila SQL queda pendiente en el mismo documento (una sola escritura atómica)
+                documento['pendiente_sql'] = datetime.datetime.now(datetime.timezone.utc)
+            resultado = collection.insert_one(documento)
 
-            document = collection.find()
-            return document[0]['_id']
+            return resultado.inserted_id
 
+        except DuplicateKeyError:
+            # Otro proceso ya anexó un bloque con ese índice o sobre el mismo bloque anterior
+            return False
         except Exception as e:
             self.error_handle.manejar_error(e)
-        finally:
-            if cliente:
-                cliente.close()
 
     def get_last_index(self):
         try:
             cliente = self.conect.connection_nosql()
-            db = cliente['mi_base-datos-blockchain']
+            db = cliente['mi_base_de_datos_blockchain']
             collection = db['registros_block']
 
-            last_block = collection.find_one({}, sort=[('index', -1)]) # Obtener el bloque con el mayor indice
-            return last_block['index'] if last_block else 0 # Si no hay bloque, retorna 0
+            # El índice del bloque se guarda en 'name' (con índice único); el bloque va anidado en 'block'
+            last_block = collection.find_one({}, {'name': 1}, sort=[('name', -1)]) # Obtener el bloque con el mayor indice
+            return last_block['name'] if last_block else 0 # Si no hay bloque, retorna 0
 
         except Exception as e:
             self.error_handle.manejar_error(e)
             return 0 # Retorna 0 en caso de error para evitar fallos en otras funciones
-        finally:
-            if cliente:
-                cliente.close()
 
     def get_file(self, file_id):
         try:
@@ -99,13 +138,7 @@ class Nosql:
         except Exception as e:
             self.error_handle.manejar_error(e)
 
-        finally:
-            if cliente:
-                cliente.close()
-
     def delete_file(self, file_id):
-        cliente = None # Previene errores en finally si falla la conexión
-
         try:
             cliente = self.conect.connection_nosql()
             fs = gridfs.GridFS(cliente['mi_base_de_datos_file'])
@@ -120,6 +153,221 @@ class Nosql:
             self.error_handle.manejar_error(e)
             return {'message': f'Error al eliminar el archivo: {str(e)}'}
 
-        finally:
-            if cliente:
-                cliente.close()
\ No newline at end of file
+    def iterar_bloques(self, desde=0, tamano_lote=1000):
+        # Recorre la cadena en orden de índice sin cargarla entera en memoria
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['registros_block']
+
+            cursor = collection.find({'name': {'$gt': desde}}, {'block': 1, 'entradas': 1}).sort('name', 1).batch_size(tamano_lote)
+            for documento in cursor:
+                yield documento
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    def bloque_por_indice(self, index):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['registros_block']
+
+            documento = collection.find_one({'name': index}, {'block': 1})
+            return documento['block'] if documento else None
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    def guardar_checkpoint(self, checkpoint):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['checkpoints_verificacion']
+
+            return collection.insert_one(checkpoint).inserted_id
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return None
+
+    def checkpoints_recientes(self, limite):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['checkpoints_verificacion']
+
+            # Del checkpoint más avanzado al más antiguo
+            return list(collection.find({}, {'_id': 0}).sort('index', -1).limit(limite))
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return []
+
+    def bloque_con_entrada(self, file_hash=None, file_id=None, index=None):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['registros_block']
+
+            # Un archivo aparece en varios bloques (subida, cargas, eliminación): por defecto el más reciente
+            if file_hash:
+                filtro = {'$or': [{'entradas.file_hash': file_hash}, {'file_hash': file_hash}]}
+            else:
+                filtro = {'$or': [{'entradas.metadatos.file_id': file_id}, {'block.metadatos.file_id': file_id}]}
+            if index is not None:
+                filtro['name'] = index
+
+            return collection.find_one(filtro, sort=[('name', -1)])
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    def eventos_pendientes(self, limite):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['mempool']
+
+            # Los eventos más antiguos primero, para sellarlos en el orden en que llegaron
+            return list(collection.find({'estado': 'pendiente'}).sort('_id', 1).limit(limite))
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return []
+
+    def reclamar_eventos(self, limite, propietario, concesion):
+        # Reclama de forma atómica hasta 'limite' eventos pendientes (o cuya concesión caducó porque su worker
+        # cayó): cada evento pasa a 'sellando' a nombre de un solo worker y solo ese worker lo sella
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['mempool']
+
+            ahora = datetime.datetime.now(datetime.timezone.utc)
+            disponibles = {'$or': [{'estado': 'pendiente'}, {'estado': 'sellando', 'concesion': {'$lt': ahora}}]}
+            ids = [evento['_id'] for evento in collection.find(disponibles, {'_id': 1}).sort('_id', 1).limit(limite)]
+            if not ids:
+                return []
+
+            # El filtro se vuelve a evaluar en cada documento: los que otro worker reclamó entre medias se saltan
+            lote = ObjectId()
+            collection.update_many({'_id': {'$in': ids}, **disponibles},
+                                   {'$set': {'estado': 'sellando', 'propietario': propietario, 'lote': lote,
+                                             'concesion': ahora + datetime.timedelta(seconds=concesion)},
+                                    '$inc': {'intentos': 1}})
+            return list(collection.find({'lote': lote}).sort('_id', 1))
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return []
+
+    def liberar_eventos(self, ids, propietario):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['mempool']
+
+            # Vuelven a la cola si el sellado falló (solo los que siguen a nombre de este worker)
+            collection.update_many({'_id': {'$in': ids}, 'estado': 'sellando', 'propietario': propietario},
+                                   {'$set': {'estado': 'pendiente'}, '$unset': {'propietario': '', 'lote': '', 'concesion': ''}})
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+
+    def marcar_sellados(self, ids, hash_block):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['mempool']
+
+            collection.update_many({'_id': {'$in': ids}}, {'$set': {'estado': 'sellado', 'block': hash_block},
+                                                           '$unset': {'propietario': '', 'lote': '', 'concesion': ''}})
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+
+    def eventos_en_bloques(self, ids):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['registros_block']
+
+            # Eventos que ya forman parte de un bloque guardado (por ejemplo si el proceso cayó antes de marcarlos)
+            sellados = {}
+            for documento in collection.find({'entradas.evento_id': {'$in': [str(i) for i in ids]}}, {'entradas': 1, 'block.hash': 1}):
+                for entrada in documento['entradas']:
+                    sellados[entrada.get('evento_id')] = documento['block']['hash']
+            return sellados
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return {}
+
+    def reclamar_pendientes_sql(self, limite, propietario, concesion):
+        # Reclama de forma atómica hasta 'limite' bloques pendientes de SQL (o cuya concesión caducó porque su
+        # worker cayó): así dos outbox en workers distintos no escriben las mismas filas a la vez
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['registros_block']
+
+            ahora = datetime.datetime.now(datetime.timezone.utc)
+            disponibles = {'pendiente_sql': {'$exists': True},
+                           '$or': [{'outbox_concesion': {'$exists': False}}, {'outbox_concesion': {'$lt': ahora}}]}
+            ids = [documento['_id'] for documento in collection.find(disponibles, {'_id': 1}).sort('name', 1).limit(limite)]
+            if not ids:
+                return []
+
+            # El filtro se vuelve a evaluar en cada documento: los que otro worker reclamó entre medias se saltan
+            lote = ObjectId()
+            collection.update_many({'_id': {'$in': ids}, **disponibles},
+                                   {'$set': {'outbox_propietario': propietario, 'outbox_lote': lote,
+                                             'outbox_concesion': ahora + datetime.timedelta(seconds=concesion)}})
+
+            # En orden de la cadena, con solo lo necesario para escribir las filas SQL
+            return list(collection.find({'outbox_lote': lote}, {'block.hash': 1, 'entradas': 1}).sort('name', 1))
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return []
+
+    def liberar_pendientes_sql(self, ids, propietario):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['registros_block']
+
+            # Siguen pendientes y cualquier worker puede volver a reclamarlos (solo los de este worker)
+            collection.update_many({'_id': {'$in': ids}, 'outbox_propietario': propietario},
+                                   {'$unset': {'outbox_propietario': '', 'outbox_lote': '', 'outbox_concesion': ''}})
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+
+    def marcar_registrados_sql(self, ids, propietario):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['registros_block']
+
+            collection.update_many({'_id': {'$in': ids}, 'outbox_propietario': propietario},
+                                   {'$unset': {'pendiente_sql': '', 'outbox_propietario': '', 'outbox_lote': '',
+                                               'outbox_concesion': ''}})
+            return True
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return False
+
+    def bloque_pendiente_sql(self, hash_block):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['registros_block']
+
+            return collection.find_one({'pendiente_sql': {'$exists': True}, 'block.hash': hash_block}, {'_id': 1}) is not None
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return False
+
+    def retraso_sql(self):
+        try:
+            cliente = self.conect.connection_nosql()
+            collection = cliente['mi_base_de_datos_blockchain']['registros_block']
+
+            # Bloques pendientes y fecha del más antiguo (el retraso del outbox)
+            filtro = {'pendiente_sql': {'$exists': True}}
+            antiguo = collection.find_one(filtro, {'pendiente_sql': 1}, sort=[('pendiente_sql', 1)])
+            return collection.count_documents(filtro), antiguo['pendiente_sql'] if antiguo else None
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return None, None
@@ -0,0 +1,485 @@
+import bisect
+import collections
+import datetime
+import hashlib
+import itertools
+import re
+from bson import ObjectId
+from decouple import config
+from gridfs import AsyncGridFS
+from pymongo import ReturnDocument, UpdateOne, WriteConcern
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+from error_handler import Errores
+from connection import Connection
+from database import compresion, fragmentador
+import metricas
+
+_indices_archivos = False # Los índices del almacén por contenido se crean una vez por proceso
+
+
+class ArchivoFragmentado:
+    # Archivo guardado como fragmentos: misma interfaz de lectura que AsyncGridOut (length, seek, readchunk, read)
+    # para enviarlo por streaming; los fragmentos se piden a la BD por grupos a medida que se leen
+    def __init__(self, coleccion, blob, manifiesto, referencia):
+        self.coleccion = coleccion
+        self.manifiesto = manifiesto
+        self.length = blob['tamaño']
+        self.content_type = referencia.get('content_type')
+        self.filename = referencia.get('nombre')
+        self.metadata = {'sha256': blob['_id'], 'manifiesto': blob['manifiesto']}
+        self.prelectura = config('FRAGMENTOS_PRELECTURA', default=16, cast=int)
+        self._inicios = list(itertools.accumulate((tamano for _, tamano in self.manifiesto[:-1]), initial=0))
+        self._posicion = 0
+        self._cache = {}
+
+    async def seek(self, posicion):
+        self._posicion = posicion
+
+    async def readchunk(self):
+        if self._posicion >= self.length:
+            return b''
+
+        indice = bisect.bisect_right(self._inicios, self._posicion) - 1
+        hash_fragmento = self.manifiesto[indice][0]
+        if hash_fragmento not in self._cache:
+            await self._cargar(indice)
+
+        datos = self._cache[hash_fragmento]
+        desplazamiento = self._posicion - self._inicios[indice]
+        self._posicion = self._inicios[indice] + len(datos)
+        return datos[desplazamiento:]
+
+    async def _cargar(self, indice):
+        # Solo se mantienen en memoria los fragmentos del grupo actual
+        hashes = list({hash_fragmento for hash_fragmento, _ in self.manifiesto[indice:indice + self.prelectura]})
+        self._cache = {documento['_id']: documento['datos']
+                       async for documento in self.coleccion.find({'_id': {'$in': hashes}})}
+        if self.manifiesto[indice][0] not in self._cache:
+            raise ValueError(f'Fragmento {self.manifiesto[indice][0]} no encontrado')
+
+    async def read(self):
+        partes = []
+        while True:
+            datos = await self.readchunk()
+            if not datos:
+                return b''.join(partes)
+            partes.append(datos)
+
+class ArchivoReferenciado:
+    # Archivo GridFS de un blob visto a través de una referencia: el contenido (y su hash) es el del blob,
+    # pero el tipo de contenido y el nombre son los de la referencia, no los de quien subió primero esos bytes
+    def __init__(self, archivo, referencia):
+        self.archivo = archivo
+        self.length = archivo.length
+        self.metadata = archivo.metadata
+        self.content_type = referencia.get('content_type')
+        self.filename = referencia.get('nombre')
+
+    async def seek(self, posicion):
+        await self.archivo.seek(posicion)
+
+    async def readchunk(self):
+        return await self.archivo.readchunk()
+
+    async def read(self):
+        return await self.archivo.read()
+
+class NosqlAsync:
+    # Mismas operaciones que Nosql pero sobre el cliente asíncrono, para usarlas desde las rutas async
+    def __init__(self):
+        self.conect = Connection()
+        self.error_handle = Errores()
+
+    def object_id(self, file_id):
+        # En SQL el id se guarda como cadena; GridFS lo indexa como ObjectId
+        if isinstance(file_id, str) and ObjectId.is_valid(file_id):
+            return ObjectId(file_id)
+        return file_id
+
+    async def asegurar_indices(self, db):
+        # Índices del almacén por contenido: nombre lógico del archivo y archivo GridFS de cada blob
+        global _indices_archivos
+        if not _indices_archivos:
+            await db['referencias'].create_index('nombre')
+            await db['blobs'].create_index('gridfs_id')
+            await db['manifiestos'].create_index([('lista', 1), ('n', 1)], unique=True)
+            _indices_archivos = True
+
+    async def nombre_en_uso(self, db, filename):
+        # Un nombre está ocupado si tiene referencia o si es un archivo anterior al almacén por contenido.
+        # Los archivos GridFS de los blobs no cuentan: se nombran por su hash, pero los blobs anteriores
+        # conservan el nombre de su primera subida aunque esa referencia ya se haya borrado
+        if await db['referencias'].find_one({'nombre': filename}, {'_id': 1}):
+            return True
+        async for documento in db['fs.files'].find({'filename': filename}, {'_id': 1}):
+            if not await db['blobs'].find_one({'gridfs_id': documento['_id']}, {'_id': 1}):
+                return True
+        return False
+
+    async def hash_subida(self, file, tamano_lectura):
+        # Primera pasada sobre la subida (ya en disco local): SHA-256, tamaño y una muestra del principio
+        # para decidir si compensa comprimir, sin escribir nada en GridFS
+        hash_file = hashlib.sha256()
+        file_size = 0
+        tamano_muestra = config('COMPRESION_MUESTRA', default=256 * 1024, cast=int)
+        muestra = bytearray()
+        while True:
+            bloque = await file.read(tamano_lectura)
+            if not bloque:
+                break
+            hash_file.update(bloque)
+            file_size += len(bloque)
+            if len(muestra) < tamano_muestra:
+                muestra += bloque[:tamano_muestra - len(muestra)]
+        return hash_file.hexdigest(), file_size, bytes(muestra)
+
+    async def escribir_comprimido(self, grid_in, file, codec, tamano_lectura):
+        # Comprime por marcos de tamaño fijo del contenido original; las longitudes comprimidas permiten
+        # saltar a cualquier marco al leer por intervalos
+        marco = config('COMPRESION_MARCO', default=1024 * 1024, cast=int)
+        pendiente = bytearray()
+        longitudes = []
+        tamano = 0
+        while True:
+            bloque = await file.read(tamano_lectura)
+            pendiente += bloque
+            tamano += len(bloque)
+            while len(pendiente) >= marco or (not bloque and pendiente):
+                datos = bytes(pendiente[:marco])
+                del pendiente[:marco]
+                comprimido = await run_in_threadpool(compresion.comprimir, codec, datos) # Los códecs liberan el GIL
+                await grid_in.write(comprimido)
+                longitudes.append(len(comprimido))
+            if not bloque:
+                return {'codec': codec, 'marco': marco, 'marcos': longitudes, 'tamaño': tamano}
+
+    async def escribir_gridfs(self, fs, file, content_type, file_hash, tamano_lectura, codec=None):
+        # El archivo GridFS de un blob se nombra por su hash: lo comparten todas las referencias con ese contenido
+        grid_in = fs.new_file(filename=file_hash, content_type=content_type)
+        try:
+            if codec:
+                metadata = await self.escribir_comprimido(grid_in, file, codec, tamano_lectura)
+            else:
+                metadata = {}
+                while True:
+                    bloque = await file.read(tamano_lectura)
+                    if not bloque:
+                        break
+                    await grid_in.write(bloque)
+
+            # El hash (del contenido original) queda en los metadatos de GridFS para no tener que releer el archivo después
+            metadata['sha256'] = file_hash
+            await grid_in.set('metadata', metadata)
+            await grid_in.close()
+            return grid_in._id
+        except Exception:
+            if not grid_in.closed:
+                await grid_in.abort() # Borra los chunks ya escritos
+            raise
+
+    async def escribir_fragmentos(self, db, file, tamano_lectura):
+        # Segunda pasada: trocea la subida y devuelve el manifiesto [[hash, tamaño], ...] en orden.
+        # Si falla a medias se restan las referencias que ya se sumaron a los fragmentos guardados
+        troceador = fragmentador.Fragmentador()
+        manifiesto = []
+        try:
+            while True:
+                bloque = await file.read(tamano_lectura)
+                if bloque:
+                    fragmentos = await troceador.agregar_en_proceso(bloque) # El rolling hash es CPU: va al pool de procesos
+                else:
+                    fragmentos = troceador.terminar()
+                await self.guardar_fragmentos(db, fragmentos, manifiesto)
+                if not bloque:
+                    return manifiesto
+        except Exception:
+            await self.liberar_fragmentos(db, manifiesto)
+            raise
+
+    async def guardar_fragmentos(self, db, fragmentos, manifiesto):
+        if not fragmentos:
+            return
+
+        hashes = [hashlib.sha256(fragmento).hexdigest() for fragmento in fragmentos]
+        cuenta = collections.Counter(hashes)
+        datos = dict(zip(hashes, fragmentos))
+
+        # Los fragmentos ya guardados solo suman referencias; el contenido viaja solo para los nuevos.
+        # Todas las operaciones son upsert por si otro archivo borra un fragmento entre la consulta y la escritura
+        existentes = {documento['_id'] async for documento in db['chunks'].find({'_id': {'$in': list(cuenta)}}, {'_id': 1})}
+        orden = list(cuenta)
+        operaciones = []
+        for hash_fragmento in orden:
+            cambios = {'$inc': {'refs': cuenta[hash_fragmento]}}
+            if hash_fragmento not in existentes:
+                cambios['$setOnInsert'] = {'datos': datos[hash_fragmento], 'tamaño': len(datos[hash_fragmento])}
+            operaciones.append(UpdateOne({'_id': hash_fragmento}, cambios, upsert=True))
+        resultado = await db['chunks'].bulk_write(operaciones, ordered=False)
+
+        # Un fragmento que se creía existente y se acaba de crear vacío recibe ahora su contenido
+        for posicion in resultado.upserted_ids:
+            hash_fragmento = orden[posicion]
+            if hash_fragmento in existentes:
+                await db['chunks'].update_one({'_id': hash_fragmento},
+                                              {'$set': {'datos': datos[hash_fragmento], 'tamaño': len(datos[hash_fragmento])}})
+
+        # Entran en el manifiesto solo cuando sus referencias ya están sumadas: es lo que se libera si algo falla
+        manifiesto.extend([hash_fragmento, len(fragmento)] for hash_fragmento, fragmento in zip(hashes, fragmentos))
+
+    async def liberar_fragmentos(self, db, manifiesto):
+        # Resta las referencias del manifiesto y borra los fragmentos que ya no usa ningún blob
+        cuenta = collections.Counter(hash_fragmento for hash_fragmento, _ in manifiesto)
+        if not cuenta:
+            return
+        await db['chunks'].bulk_write([UpdateOne({'_id': hash_fragmento}, {'$inc': {'refs': -veces}})
+                                       for hash_fragmento, veces in cuenta.items()], ordered=False)
+        await db['chunks'].delete_many({'_id': {'$in': list(cuenta)}, 'refs': {'$lte': 0}})
+
+    async def guardar_manifiesto(self, db, lista, fragmentos):
+        # El manifiesto va en páginas aparte: en el documento del blob superaría los 16 MB de Mongo con archivos de varios GB
+        por_pagina = config('FRAGMENTOS_POR_PAGINA', default=20000, cast=int)
+        await db['manifiestos'].insert_many([{'lista': lista, 'n': n, 'fragmentos': fragmentos[inicio:inicio + por_pagina]}
+                                             for n, inicio in enumerate(range(0, len(fragmentos), por_pagina))])
+
+    async def cargar_manifiesto(self, db, blob):
+        # Los blobs anteriores a las páginas guardan el manifiesto en el propio documento
+        if 'fragmentos' in blob:
+            return blob['fragmentos']
+        fragmentos = []
+        async for pagina in db['manifiestos'].find({'lista': blob['lista']}, sort=[('n', 1)]):
+            fragmentos.extend(pagina['fragmentos'])
+        return fragmentos
+
+    async def guardar_blob_fragmentado(self, db, file_hash, fragmentos, manifiesto, file_size):
+        # Si el blob no llega a guardarse se borran sus páginas y se restan las referencias de sus fragmentos
+        lista = ObjectId()
+        try:
+            await self.guardar_manifiesto(db, lista, fragmentos)
+            await db['blobs'].insert_one({'_id': file_hash, 'lista': lista, 'manifiesto': manifiesto,
+                                          'tamaño': file_size, 'refs': 1})
+        except DuplicateKeyError:
+            # Otra subida del mismo contenido creó el blob a la vez: se usa el suyo
+            await db['blobs'].update_one({'_id': file_hash}, {'$inc': {'refs': 1}})
+            await db['manifiestos'].delete_many({'lista': lista})
+            await self.liberar_fragmentos(db, fragmentos)
+        except Exception:
+            await db['manifiestos'].delete_many({'lista': lista})
+            await self.liberar_fragmentos(db, fragmentos)
+            raise
+
+    async def save_file(self, file, filename, content_type=None):
+        # Almacén por contenido: los bytes se guardan una sola vez como blob (identificado por su SHA-256)
+        # y cada archivo lógico es una referencia a su blob; si el blob ya existe no se escribe nada en GridFS
+        try:
+            cliente = self.conect.connection_nosql_async()
+            db = cliente['mi_base_de_datos_file']
+            fs = AsyncGridFS(db)
+            await self.asegurar_indices(db)
+            manifiesto = None
+
+            if await self.nombre_en_uso(db, filename):
+                return {'message': 'El archivo ya existe', 'nombre': filename}
+
+            tamano_lectura = config('UPLOAD_CHUNK_SIZE', default=1024 * 1024, cast=int)
+            with metricas.medir('hash_subida'):
+                file_hash, file_size, muestra = await self.hash_subida(file, tamano_lectura)
+
+            # Se suma la referencia al blob existente de forma atómica
+            blob = await db['blobs'].find_one_and_update({'_id': file_hash}, {'$inc': {'refs': 1}})
+            duplicado = blob is not None
+            if duplicado:
+                manifiesto = blob.get('manifiesto')
+            elif config('FRAGMENTOS_ACTIVO', default=False, cast=bool):
+                # Troceado por contenido: solo se envían a la BD los fragmentos que no estaban guardados
+                await file.seek(0)
+                with metricas.medir('fragmentos_escritura'):
+                    fragmentos = await self.escribir_fragmentos(db, file, tamano_lectura)
+                manifiesto = fragmentador.hash_manifiesto(fragmentos)
+                await self.guardar_blob_fragmentado(db, file_hash, fragmentos, manifiesto, file_size)
+            else:
+                await file.seek(0)
+                codec = await run_in_threadpool(compresion.elegir_codec, muestra) # Compresión de prueba: fuera del event loop
+                with metricas.medir('gridfs_escritura'):
+                    gridfs_id = await self.escribir_gridfs(fs, file, content_type, file_hash, tamano_lectura, codec)
+                try:
+                    await db['blobs'].insert_one({'_id': file_hash, 'gridfs_id': gridfs_id, 'tamaño': file_size, 'refs': 1})
+                except DuplicateKeyError:
+                    # Otra subida del mismo contenido creó el blob a la vez: se usa el suyo
+                    await fs.delete(gridfs_id)
+                    await db['blobs'].update_one({'_id': file_hash}, {'$inc': {'refs': 1}})
+
+            referencia = await db['referencias'].insert_one({'nombre': filename, 'hash': file_hash, 'content_type': content_type,
+                                                             'tamaño': file_size, 'creado': datetime.datetime.now(datetime.timezone.utc)})
+
+            metricas.bytes_transferidos.incrementar(('subida',), file_size)
+            return {'message': 'Archivo guardado', 'file_id': referencia.inserted_id,
+                    'file_hash': file_hash, 'tamaño': file_size, 'duplicado': duplicado, 'manifiesto': manifiesto}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    async def encolar_evento(self, evento_id, file_hash, metadatos):
+        try:
+            cliente = self.conect.connection_nosql_async()
+            # Escritura confirmada en el journal: el evento sobrevive a una caída antes de sellarse
+            collection = cliente['mi_base_de_datos_blockchain'].get_collection('mempool', write_concern=WriteConcern(j=True))
+
+            await collection.insert_one({'_id': evento_id, 'file_hash': file_hash, 'metadatos': metadatos,
+                                         'estado': 'pendiente', 'creado': datetime.datetime.now(datetime.timezone.utc)})
+            return evento_id
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    async def open_file(self, file_id):
+        # Devuelve el archivo de GridFS sin leerlo, para consultar sus metadatos o leerlo por partes
+        try:
+            cliente = self.conect.connection_nosql_async()
+            db = cliente['mi_base_de_datos_file']
+            fs = AsyncGridFS(db)
+
+            # Referencia a un blob; los archivos anteriores al almacén por contenido se buscan directamente en GridFS
+            file_id = self.object_id(file_id)
+            referencia = await db['referencias'].find_one({'_id': file_id})
+            if referencia is not None:
+                blob = await db['blobs'].find_one({'_id': referencia['hash']})
+                if blob is None:
+                    return {'message': 'El archivo no existe'}
+                if 'fragmentos' in blob or 'lista' in blob:
+                    return ArchivoFragmentado(db['chunks'], blob, await self.cargar_manifiesto(db, blob), referencia)
+                file_id = blob['gridfs_id']
+
+            if not await fs.exists({'_id': file_id}):
+                return {'message': 'El archivo no existe'}
+
+            archivo = await fs.get(file_id)
+            if archivo.metadata and archivo.metadata.get('codec'):
+                archivo = compresion.ArchivoComprimido(archivo) # Se descomprime al leer
+            if referencia is not None:
+                archivo = ArchivoReferenciado(archivo, referencia)
+            return archivo
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    async def archivo_existe(self, file_id):
+        # Comprobación barata (por _id) de que el archivo no se borró, p. ej. desde otro worker
+        try:
+            cliente = self.conect.connection_nosql_async()
+            db = cliente['mi_base_de_datos_file']
+
+            file_id = self.object_id(file_id)
+            if await db['referencias'].find_one({'_id': file_id}, {'_id': 1}):
+                return True
+            return await db['fs.files'].find_one({'_id': file_id}, {'_id': 1}) is not None
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    async def buscar_archivos(self, nombres=None, prefijo=None, limite=None):
+        # Resuelve una lista de nombres o un prefijo a {nombre: file_id} con una consulta por colección,
+        # en lugar de file_exists + file_data por archivo; incluye los archivos anteriores al almacén por contenido
+        try:
+            cliente = self.conect.connection_nosql_async()
+            db = cliente['mi_base_de_datos_file']
+
+            limite = limite or config('DESCARGA_MAX_ARCHIVOS', default=1000, cast=int)
+            filtro = {'$in': list(nombres)} if nombres else {'$regex': '^' + re.escape(prefijo or '')}
+            encontrados = {}
+            async for referencia in db['referencias'].find({'nombre': filtro}, {'nombre': 1}, sort=[('nombre', 1)], limit=limite):
+                encontrados.setdefault(referencia['nombre'], referencia['_id'])
+
+            # Los archivos de GridFS que pertenecen a un blob se descartan: se llega a ellos por su referencia
+            antiguos = [documento async for documento in db['fs.files'].find({'filename': filtro}, {'filename': 1},
+                                                                              sort=[('filename', 1)], limit=limite)]
+            if antiguos:
+                de_blobs = {blob['gridfs_id'] async for blob in db['blobs'].find(
+                    {'gridfs_id': {'$in': [documento['_id'] for documento in antiguos]}}, {'gridfs_id': 1})}
+                for documento in antiguos:
+                    if documento['_id'] not in de_blobs:
+                        encontrados.setdefault(documento['filename'], documento['_id'])
+
+            return dict(sorted(encontrados.items())[:limite])
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+            return {}
+
+    async def metadatos_por_nombre(self, filename):
+        # Hash y fecha de un archivo a partir de su nombre, sin abrirlo: sirven de ETag y Last-Modified
+        try:
+            cliente = self.conect.connection_nosql_async()
+            db = cliente['mi_base_de_datos_file']
+
+            referencia = await db['referencias'].find_one({'nombre': filename}, {'hash': 1, 'creado': 1})
+            if referencia is not None:
+                return {'hash': referencia['hash'], 'modificado': referencia.get('creado')}
+
+            # Archivo anterior al almacén por contenido (el de un blob no cuenta: su referencia ya no existe)
+            documento = await db['fs.files'].find_one({'filename': filename}, {'metadata': 1, 'uploadDate': 1})
+            if documento is None or await db['blobs'].find_one({'gridfs_id': documento['_id']}, {'_id': 1}):
+                return None
+            return {'hash': (documento.get('metadata') or {}).get('sha256'), 'modificado': documento.get('uploadDate')}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e, levantar=False)
+            return None
+
+    async def iter_file(self, file_obj, inicio=0, fin=None):
+        # Recorre el archivo chunk a chunk entre inicio y fin (inclusive), sin cargarlo entero en memoria
+        fin = file_obj.length - 1 if fin is None else fin
+        await file_obj.seek(inicio)
+        pendiente = fin - inicio + 1
+
+        while pendiente > 0:
+            bloque = await file_obj.readchunk()
+            if not bloque:
+                break
+            bloque = bloque[:pendiente]
+            pendiente -= len(bloque)
+            metricas.bytes_transferidos.incrementar(('descarga',), len(bloque))
+            yield bloque
+
+    async def hash_file(self, file_obj):
+        # Los archivos subidos por streaming guardan su SHA-256 en los metadatos; los antiguos se recorren una vez
+        if file_obj.metadata and file_obj.metadata.get('sha256'):
+            return file_obj.metadata['sha256']
+
+        hash_file = hashlib.sha256()
+        async for bloque in self.iter_file(file_obj):
+            hash_file.update(bloque)
+        return hash_file.hexdigest()
+
+    async def delete_file(self, file_id):
+        try:
+            cliente = self.conect.connection_nosql_async()
+            db = cliente['mi_base_de_datos_file']
+            fs = AsyncGridFS(db)
+
+            file_id = self.object_id(file_id)
+            referencia = await db['referencias'].find_one_and_delete({'_id': file_id})
+            if referencia is not None:
+                # El blob solo se borra al quitar su última referencia; si otra subida lo vuelve a referenciar
+                # entre medias, la condición sobre 'refs' impide borrarlo
+                blob = await db['blobs'].find_one_and_update({'_id': referencia['hash']}, {'$inc': {'refs': -1}},
+                                                             return_document=ReturnDocument.AFTER)
+                if blob is not None and blob['refs'] <= 0:
+                    borrado = await db['blobs'].delete_one({'_id': referencia['hash'], 'refs': {'$lte': 0}})
+                    if borrado.deleted_count and ('fragmentos' in blob or 'lista' in blob):
+                        await self.liberar_fragmentos(db, await self.cargar_manifiesto(db, blob))
+                        if 'lista' in blob:
+                            await db['manifiestos'].delete_many({'lista': blob['lista']})
+                    elif borrado.deleted_count:
+                        await fs.delete(blob['gridfs_id'])
+                return {'message': 'El archivo fue eliminado con exito'}
+
+            if not await fs.exists({'_id': file_id}):
+                return {'message': 'El archivo no existe'}
+
+            await fs.delete(file_id)
+            return {'message': 'El archivo fue eliminado con exito'}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+            return {'message': f'Error al eliminar el archivo: {str(e)}'}
@@ -0,0 +1,259 @@
+import asyncio
+import datetime
+import hashlib
+from bson import ObjectId
+from decouple import config
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from error_handler import Errores
+from connection import Connection
+from database.nosql_async import NosqlAsync
+
+# Hash de cada sesión en este proceso: se avanza sobre la parte contigua del archivo a medida que llegan los chunks
+_estados = {}
+# Última vez que este proceso buscó sesiones abandonadas
+_ultima_limpieza = None
+
+
+class EstadoHash:
+    def __init__(self):
+        self.hash = hashlib.sha256()
+        self.siguiente = 0 # Primer chunk que aún no entra en el hash
+        self.lock = asyncio.Lock()
+
+
+class SesionesSubida:
+    # Subidas reanudables: el cliente crea una sesión, envía partes con su desplazamiento (en cualquier orden
+    # y en paralelo), consulta los rangos recibidos y finaliza. Cada parte se escribe directamente como chunks
+    # de GridFS del archivo de la sesión, así que al finalizar solo se crea el documento de fs.files
+    def __init__(self):
+        self.conect = Connection()
+        self.error_handle = Errores()
+        self.nosql_async = NosqlAsync()
+        self.chunk_size = config('SUBIDA_CHUNK_SIZE', default=255 * 1024, cast=int)
+        self.ttl = config('SUBIDA_SESION_TTL', default=86400, cast=int)
+        self.intervalo_limpieza = config('SUBIDA_LIMPIEZA_INTERVALO', default=300, cast=int)
+
+    def base_de_datos(self):
+        cliente = self.conect.connection_nosql_async()
+        return cliente['mi_base_de_datos_file']
+
+    def total_chunks(self, sesion):
+        return -(-sesion['tamaño'] // sesion['chunk_size'])
+
+    def estado(self, sesion_id):
+        # Tras un reinicio (o si la sesión la empezó otro worker) el hash vuelve a empezar y relee los chunks de la BD
+        return _estados.setdefault(str(sesion_id), EstadoHash())
+
+    async def crear_sesion(self, filename, tamano, content_type=None):
+        try:
+            db = self.base_de_datos()
+            await self.nosql_async.asegurar_indices(db)
+            await db['fs.chunks'].create_index([('files_id', 1), ('n', 1)], unique=True) # El mismo que crea GridFS
+            await self.limpiar_abandonadas(db)
+
+            if await self.nosql_async.nombre_en_uso(db, filename):
+                return {'message': 'El archivo ya existe', 'nombre': filename}
+
+            ahora = datetime.datetime.now(datetime.timezone.utc)
+            sesion = {'_id': ObjectId(), 'nombre': filename, 'content_type': content_type, 'tamaño': tamano,
+                      'chunk_size': self.chunk_size, 'gridfs_id': ObjectId(), 'creado': ahora, 'actualizado': ahora}
+            await db['sesiones_subida'].insert_one(sesion)
+
+            return {'message': 'Sesión creada', 'sesion': str(sesion['_id']), 'chunk_size': sesion['chunk_size']}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    async def limpiar_abandonadas(self, db):
+        # Sesiones sin partes nuevas durante SUBIDA_SESION_TTL segundos: se borran con sus chunks. Se revisa
+        # como mucho cada SUBIDA_LIMPIEZA_INTERVALO segundos por proceso, al crear una sesión
+        global _ultima_limpieza
+        ahora = datetime.datetime.now(datetime.timezone.utc)
+        if _ultima_limpieza is not None and (ahora - _ultima_limpieza).total_seconds() < self.intervalo_limpieza:
+            return
+        _ultima_limpieza = ahora
+
+        limite = ahora - datetime.timedelta(seconds=self.ttl)
+        async for sesion in db['sesiones_subida'].find({'actualizado': {'$lt': limite}}, {'_id': 1}):
+            # Solo un worker se queda con cada sesión caducada (y no si acaba de recibir una parte)
+            sesion = await db['sesiones_subida'].find_one_and_delete({'_id': sesion['_id'], 'actualizado': {'$lt': limite}})
+            if sesion is not None:
+                await db['fs.chunks'].delete_many({'files_id': sesion['gridfs_id']})
+                _estados.pop(str(sesion['_id']), None)
+
+        # Hashes de sesiones que otro worker finalizó, canceló o limpió
+        if _estados:
+            vivas = set()
+            async for sesion in db['sesiones_subida'].find({'_id': {'$in': [ObjectId(clave) for clave in _estados]}}, {'_id': 1}):
+                vivas.add(str(sesion['_id']))
+            for clave in [clave for clave in _estados if clave not in vivas]:
+                _estados.pop(clave, None)
+
+    async def guardar_parte(self, sesion_id, desplazamiento, partes):
+        # 'partes' es un iterable asíncrono de bytes (el cuerpo de la petición): se escribe por chunks completos
+        # sin acumular la parte entera. Reenviar una parte con los mismos bytes es idempotente; con bytes
+        # distintos se rechaza, porque el hash de la sesión puede incluir ya los anteriores
+        try:
+            db = self.base_de_datos()
+            # Cada parte recibida aleja la sesión de la limpieza de abandonadas
+            sesion = await db['sesiones_subida'].find_one_and_update({'_id': self.nosql_async.object_id(sesion_id)},
+                                                                     {'$set': {'actualizado': datetime.datetime.now(datetime.timezone.utc)}})
+            if sesion is None:
+                return {'message': 'La sesión no existe'}
+
+            chunk_size = sesion['chunk_size']
+            if desplazamiento < 0 or desplazamiento % chunk_size:
+                return {'message': f'El desplazamiento debe ser múltiplo de {chunk_size}'}
+
+            n = desplazamiento // chunk_size
+            pendiente = bytearray()
+            recibidos = 0
+            async for datos in partes:
+                pendiente += datos
+                recibidos += len(datos)
+                if desplazamiento + recibidos > sesion['tamaño']:
+                    return {'message': 'La parte supera el tamaño declarado del archivo'}
+
+                completos = len(pendiente) // chunk_size
+                if completos:
+                    chunks = [bytes(pendiente[i * chunk_size:(i + 1) * chunk_size]) for i in range(completos)]
+                    del pendiente[:completos * chunk_size]
+                    if not await self.escribir_chunks(db, sesion, n, chunks):
+                        return self.parte_distinta(n, chunk_size)
+                    n += completos
+
+            # Solo el último chunk del archivo puede ser incompleto
+            if pendiente:
+                if desplazamiento + recibidos != sesion['tamaño']:
+                    return {'message': f'La parte debe tener un tamaño múltiplo de {chunk_size} salvo al final del archivo'}
+                if not await self.escribir_chunks(db, sesion, n, [bytes(pendiente)]):
+                    return self.parte_distinta(n, chunk_size)
+
+            return {'message': 'Parte guardada', 'desplazamiento': desplazamiento, 'bytes': recibidos}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    def parte_distinta(self, n, chunk_size):
+        return {'message': 'La parte no coincide con los datos ya recibidos en esa posición', 'desplazamiento': n * chunk_size}
+
+    async def escribir_chunks(self, db, sesion, n, chunks):
+        # Un chunk ya guardado nunca se sobrescribe ($setOnInsert); los reenviados se comparan con lo guardado
+        resultado = await db['fs.chunks'].bulk_write([UpdateOne({'files_id': sesion['gridfs_id'], 'n': n + i},
+                                                                {'$setOnInsert': {'data': chunk}}, upsert=True)
+                                                      for i, chunk in enumerate(chunks)], ordered=False)
+        if len(resultado.upserted_ids) < len(chunks):
+            reenviados = [n + i for i in range(len(chunks)) if i not in resultado.upserted_ids]
+            async for documento in db['fs.chunks'].find({'files_id': sesion['gridfs_id'], 'n': {'$in': reenviados}}, {'n': 1, 'data': 1}):
+                if bytes(documento['data']) != chunks[documento['n'] - n]:
+                    return False
+
+        await self.avanzar_hash(db, sesion, dict(zip(range(n, n + len(chunks)), chunks)))
+        return True
+
+    async def avanzar_hash(self, db, sesion, recientes=None):
+        # Suma al hash los chunks contiguos ya recibidos: los que acaban de llegar desde memoria y los que
+        # llegaron antes fuera de orden desde la BD (cada uno se lee una sola vez)
+        estado = self.estado(sesion['_id'])
+        recientes = recientes or {}
+        async with estado.lock:
+            while estado.siguiente < self.total_chunks(sesion):
+                chunk = recientes.get(estado.siguiente)
+                if chunk is None:
+                    documento = await db['fs.chunks'].find_one({'files_id': sesion['gridfs_id'], 'n': estado.siguiente})
+                    if documento is None:
+                        break
+                    chunk = documento['data']
+                estado.hash.update(chunk)
+                estado.siguiente += 1
+            return estado
+
+    async def rangos_recibidos(self, sesion_id):
+        try:
+            db = self.base_de_datos()
+            sesion = await db['sesiones_subida'].find_one({'_id': self.nosql_async.object_id(sesion_id)})
+            if sesion is None:
+                return {'message': 'La sesión no existe'}
+
+            # Intervalos de bytes [inicio, fin] ya guardados, a partir de los números de chunk
+            rangos = []
+            async for documento in db['fs.chunks'].find({'files_id': sesion['gridfs_id']}, {'n': 1}, sort=[('n', 1)]):
+                inicio = documento['n'] * sesion['chunk_size']
+                fin = min(inicio + sesion['chunk_size'], sesion['tamaño']) - 1
+                if rangos and rangos[-1][1] == inicio - 1:
+                    rangos[-1][1] = fin
+                else:
+                    rangos.append([inicio, fin])
+
+            recibido = sum(fin - inicio + 1 for inicio, fin in rangos)
+            return {'sesion': str(sesion['_id']), 'nombre': sesion['nombre'], 'tamaño': sesion['tamaño'],
+                    'chunk_size': sesion['chunk_size'], 'recibido': recibido, 'rangos': rangos}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    async def finalizar(self, sesion_id):
+        # Con todos los chunks en la BD el hash ya está calculado: solo se crean el archivo, el blob y la referencia
+        try:
+            db = self.base_de_datos()
+            sesion = await db['sesiones_subida'].find_one({'_id': self.nosql_async.object_id(sesion_id)})
+            if sesion is None:
+                return {'message': 'La sesión no existe'}
+
+            estado = await self.avanzar_hash(db, sesion)
+            if estado.siguiente < self.total_chunks(sesion):
+                return {'message': 'Faltan partes del archivo', 'faltan_desde': estado.siguiente * sesion['chunk_size']}
+
+            if await db['referencias'].find_one({'nombre': sesion['nombre']}):
+                return {'message': 'El archivo ya existe', 'nombre': sesion['nombre']}
+
+            # Solo una petición puede finalizar la sesión
+            if await db['sesiones_subida'].find_one_and_delete({'_id': sesion['_id']}) is None:
+                return {'message': 'La sesión no existe'}
+            _estados.pop(str(sesion['_id']), None)
+
+            file_hash = estado.hash.hexdigest()
+            blob = await db['blobs'].find_one_and_update({'_id': file_hash}, {'$inc': {'refs': 1}})
+            duplicado = blob is not None
+            if duplicado:
+                # El contenido ya estaba guardado: los chunks de la sesión sobran
+                await db['fs.chunks'].delete_many({'files_id': sesion['gridfs_id']})
+            else:
+                await db['fs.files'].insert_one({'_id': sesion['gridfs_id'], 'length': sesion['tamaño'],
+                                                 'chunkSize': sesion['chunk_size'], 'uploadDate': datetime.datetime.now(datetime.timezone.utc),
+                                                 'filename': file_hash, 'contentType': sesion['content_type'],
+                                                 'metadata': {'sha256': file_hash}})
+                try:
+                    await db['blobs'].insert_one({'_id': file_hash, 'gridfs_id': sesion['gridfs_id'],
+                                                  'tamaño': sesion['tamaño'], 'refs': 1})
+                except DuplicateKeyError:
+                    # Otra subida del mismo contenido creó el blob a la vez: se usa el suyo
+                    await db['fs.files'].delete_one({'_id': sesion['gridfs_id']})
+                    await db['fs.chunks'].delete_many({'files_id': sesion['gridfs_id']})
+                    await db['blobs'].update_one({'_id': file_hash}, {'$inc': {'refs': 1}})
+
+            referencia = await db['referencias'].insert_one({'nombre': sesion['nombre'], 'hash': file_hash,
+                                                             'content_type': sesion['content_type'],
+                                                             'tamaño': sesion['tamaño'], 'creado': datetime.datetime.now(datetime.timezone.utc)})
+
+            return {'message': 'Archivo guardado', 'file_id': referencia.inserted_id, 'file_hash': file_hash,
+                    'tamaño': sesion['tamaño'], 'duplicado': duplicado, 'nombre': sesion['nombre'],
+                    'content_type': sesion['content_type']}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    async def cancelar(self, sesion_id):
+        try:
+            db = self.base_de_datos()
+            sesion = await db['sesiones_subida'].find_one_and_delete({'_id': self.nosql_async.object_id(sesion_id)})
+            if sesion is None:
+                return {'message': 'La sesión no existe'}
+
+            await db['fs.chunks'].delete_many({'files_id': sesion['gridfs_id']})
+            _estados.pop(str(sesion['_id']), None)
+            return {'message': 'Sesión cancelada'}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
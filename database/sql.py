@@ -10,76 +10,83 @@ class Sql:
 
     def save_hash_file(self, hash_block, hash_file, id_file, id_block, file_name):
         try:
-            # Establecer conexión con la BD
-            conn = self.conect.connection_sql()
-            cursor = conn.cursor()
+            # Tomamos una conexión del pool (se devuelve al salir del bloque with)
+            with self.conect.sesion_sql() as (conn, cursor):
+                # Llamamos al procedimiento que se encarga de guardar los datos
+                cursor.callproc('registro', [hash_block, hash_file, id_file, id_block, file_name])
 
-            # Llamamos al procedimiento que se encarga de guardar los datos
-            cursor.callproc('registro', [hash_block, hash_file, id_file, id_block, file_name])
+                # Confirmamos cambios
+                conn.commit()
 
-            # Confirmamos cambios
-            conn.commit()
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+
+    def save_hash_files(self, filas):
+        # Guarda las filas de un lote (hash_block, hash_file, id_file, id_block, file_name) en una sola
+        # transacción: una conexión y un único commit; si falla una fila no se guarda ninguna.
+        # mysql-connector solo agrupa en una sentencia los INSERT ... VALUES: con CALL registro
+        # executemany sigue enviando una llamada (un viaje al servidor) por fila. La tabla que escribe
+        # el procedimiento no forma parte de este repositorio, por eso no se sustituye por un INSERT
+        try:
+            with self.conect.sesion_sql() as (conn, cursor):
+                try:
+                    cursor.executemany('CALL registro(%s, %s, %s, %s, %s)', filas)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            return True
 
         except Exception as e:
             self.error_handle.manejar_error(e)
-        finally:
-            if 'cursor' in locals() and cursor:
-                cursor.close()
-            if 'conn' in locals() and conn:
-                conn.close()
 
     def ultimo_hash(self, previous_hash):
-        # Establecer conexión con la BD
-        conn = self.conect.connection_sql()
-        cursor = conn.cursor()
-
-        # Logica para verificar si el previous_hash existe
-        query = 'SELECT hash_exists(%s);' # Aquí invocamos la función
-        cursor.execute(query, (previous_hash,))
-        result = cursor.fetchone()
-        if result[0]:
-            return True
-        else:
-            return False
+        with self.conect.sesion_sql() as (conn, cursor):
+            # Logica para verificar si el previous_hash existe
+            query = 'SELECT hash_exists(%s);' # Aquí invocamos la función
+            cursor.execute(query, (previous_hash,))
+            result = cursor.fetchone()
+            if result[0]:
+                return True
+            else:
+                return False
+
+    def bloques_registrados(self, hashes):
+        # Hashes de bloque que ya tienen sus filas en SQL: una sola consulta con una columna por hash
+        hashes = list(dict.fromkeys(hashes))
+        if not hashes:
+            return set()
+        with self.conect.sesion_sql() as (conn, cursor):
+            cursor.execute('SELECT ' + ', '.join(['hash_exists(%s)'] * len(hashes)) + ';', tuple(hashes))
+            existe = cursor.fetchone()
+            return {hash_block for hash_block, registrado in zip(hashes, existe) if registrado}
 
     def file_exists(self, file_name):
-        # Establecer conexión con la BD
-        conn = self.conect.connection_sql()
-        cursor = conn.cursor()
-
-        # Logica para verificar si el archivo existe
-        query = 'SELECT file_exists(%s);'  # Aquí invocamos la función
-        cursor.execute(query, (file_name,))
-        result = cursor.fetchone()
-        if result[0]:
-            return True
-        else:
-            return False
+        with self.conect.sesion_sql() as (conn, cursor):
+            # Logica para verificar si el archivo existe
+            query = 'SELECT file_exists(%s);'  # Aquí invocamos la función
+            cursor.execute(query, (file_name,))
+            result = cursor.fetchone()
+            if result[0]:
+                return True
+            else:
+                return False
 
     def file_data(self, file_name):
         try:
-            # Establecer conexión con la BD
-            conn = self.conect.connection_sql()
-            cursor = conn.cursor()
+            with self.conect.sesion_sql() as (conn, cursor):
+                # Llamamos al procedimiento para extraer el id
+                query = 'CALL file_id(%s, @idfile, @message);'
+                cursor.execute(query, (file_name))
 
-            # Llamamos al procedimiento para extraer el id
-            query = 'CALL file_id(%s, @idfile, @message);'
-            cursor.execute(query, (file_name))
+                # Recuperando las variables de salida
+                cursor.execute('SELECT @idfile, @message;')
+                result = cursor.fetchone()
 
-            # Recuperando las variables de salida
-            cursor.execute('SELECT @idfile, @message;')
-            result = cursor.fetchone()
-
-            file_id = result[0]
-            message = result[1]
+                file_id = result[0]
+                message = result[1]
 
-            return file_id
+                return file_id
 
         except Exception as e:
             self.error_handle.manejar_error(e)
-
-        finally:
-            if 'cursor' in locals() and cursor:
-                cursor.close()
-            if 'conn' in locals() and conn:
-                conn.close()
\ No newline at end of file
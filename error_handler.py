@@ -6,15 +6,36 @@ from pymongo.errors import PyMongoError
 from cryptography.exceptions import InvalidKey
 import jwt
 from jwt.exceptions import DecodeError, ExpiredSignatureError, InvalidTokenError
+import metricas
 
 class Errores:
     def __init__(self):
         logging.basicConfig(level=logging.ERROR, filename='../errores.log')
 
+    def categoria(self, error):
+        # Misma clasificación que manejar_error, para contar los errores por tipo en /metrics
+        if 'Could not deserializa key data' in str(error) or isinstance(error, InvalidKey):
+            return 'clave'
+        if isinstance(error, ValueError):
+            return 'valor'
+        if isinstance(error, (FileNotFoundError, PermissionError)):
+            return 'archivo'
+        if isinstance(error, (jwt.ExpiredSignatureError, jwt.InvalidSignatureError, jwt.DecodeError)):
+            return 'token'
+        if isinstance(error, mysql.connector.Error):
+            return 'sql'
+        if isinstance(error, PyMongoError):
+            return 'nosql'
+        return 'general'
+
     def manejar_error(self, error, levantar=True):
         # Se registra el error con detalles completos
         logging.error(f'Error: {str(error)}')
 
+        # Las HTTPException vienen de un manejar_error anterior y ya se contaron
+        if not isinstance(error, HTTPException):
+            metricas.errores.incrementar((self.categoria(error),))
+
         # Manejo de los errores comunes
         msg = str(error)
         if 'Could not deserializa key data' in msg:
@@ -0,0 +1,160 @@
+import bisect
+import re
+import threading
+import time
+
+# Límites (segundos) de los histogramas de duración
+LIMITES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _etiquetas(nombres, valores, extra=''):
+    pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histograma:
+    # Registrar una observación es O(1) con un lock corto; el texto solo se genera al consultar /metrics
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.limites = limites
+        self._lock = threading.Lock()
+        self._series = {} # valores de las etiquetas -> [conteo por intervalo, suma]
+
+    def observar(self, valores, segundos):
+        posicion = bisect.bisect_left(self.limites, segundos)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * (len(self.limites) + 1), 0.0]
+            serie[0][posicion] += 1
+            serie[1] += segundos
+
+    def exponer(self):
+        with self._lock:
+            series = {valores: (list(conteos), suma) for valores, (conteos, suma) in self._series.items()}
+
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        for valores, (conteos, suma) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.limites + ('+Inf',), conteos):
+                acumulado += conteo
+                etiquetas = _etiquetas(self.etiquetas, valores, 'le="%s"' % limite)
+                lineas.append(f'{self.nombre}_bucket{etiquetas} {acumulado}')
+            lineas.append(f'{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {_numero(suma)}')
+            lineas.append(f'{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {acumulado}')
+        return lineas
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def incrementar(self, valores=(), cantidad=1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def exponer(self):
+        with self._lock:
+            valores = dict(self._valores)
+
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} counter']
+        for etiquetas, valor in sorted(valores.items()):
+            lineas.append(f'{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {_numero(valor)}')
+        return lineas
+
+
+class _Medicion:
+    __slots__ = ('etapa', 'inicio')
+
+    def __init__(self, etapa):
+        self.etapa = etapa
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, *excepcion):
+        etapas.observar((self.etapa,), time.perf_counter() - self.inicio)
+
+
+def medir(etapa):
+    # with medir('firma'): ... registra la duración de la etapa (también si lanza una excepción)
+    return _Medicion(etapa)
+
+
+class MedidorPeticiones:
+    # Middleware ASGI: duración de cada petición (incluido el envío por streaming) por ruta, método y código
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        inicio = time.perf_counter()
+        estado = {'codigo': 500}
+
+        async def enviar(mensaje):
+            if mensaje['type'] == 'http.response.start':
+                estado['codigo'] = mensaje['status']
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # La plantilla de la ruta (no la URL) para no crear una serie por archivo o sesión
+            ruta = getattr(scope.get('route'), 'path', 'desconocida')
+            peticiones.observar((ruta, scope['method'], str(estado['codigo'])), time.perf_counter() - inicio)
+
+
+def indicadores(fuentes):
+    # Gauges a partir de las estadísticas que ya exponen los pools y las cachés ({fuente: {clave: valor}})
+    lineas = []
+    for fuente, estadisticas in fuentes.items():
+        for clave, valor in _aplanar(estadisticas):
+            if isinstance(valor, bool):
+                valor = int(valor)
+            if not isinstance(valor, (int, float)):
+                continue
+            nombre = re.sub(r'[^a-zA-Z0-9_]', '_', f'blockvault_{fuente}_{clave}'.replace('ñ', 'n'))
+            lineas.extend([f'# TYPE {nombre} gauge', f'{nombre} {_numero(valor)}'])
+    return lineas
+
+
+def _aplanar(estadisticas, prefijo=''):
+    for clave, valor in (estadisticas or {}).items():
+        if isinstance(valor, dict):
+            yield from _aplanar(valor, f'{prefijo}{clave}_')
+        else:
+            yield f'{prefijo}{clave}', valor
+
+
+def exponer(fuentes=None):
+    lineas = []
+    for metrica in (etapas, peticiones, bloques, bytes_transferidos, errores):
+        lineas.extend(metrica.exponer())
+    lineas.extend(indicadores(fuentes or {}))
+    return '\n'.join(lineas) + '\n'
+
+
+# Métricas compartidas por el proceso
+etapas = Histograma('blockvault_etapa_segundos', 'Duración de cada etapa de subida, carga, borrado y sellado', ('etapa',))
+peticiones = Histograma('blockvault_peticion_segundos', 'Duración de las peticiones por ruta', ('ruta', 'metodo', 'codigo'))
+bloques = Contador('blockvault_bloques_total', 'Bloques anexados a la cadena')
+bytes_transferidos = Contador('blockvault_bytes_total', 'Bytes de archivos subidos y enviados', ('operacion',))
+errores = Contador('blockvault_errores_total', 'Errores registrados por categoría', ('categoria',))
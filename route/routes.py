@@ -1,8 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, Header, Request, File, UploadFile
+import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, File, UploadFile, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from services import archivos
+from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from services import archivos, empaquetador
 from error_handler import Errores
 from services.services import Services
+from connection import Connection
+from blockchain.cabeza_cadena import cabeza
+from blockchain.secuenciador import secuenciador
+from blockchain.mempool import mempool
+from blockchain.outbox import outbox
+from blockchain.verificador import Verificador
+from security.llavero import llavero
+from services.cache_tokens import cache_tokens
+from database.cache_archivos import cache_archivos
+import metricas
 
 router = APIRouter()
 archivo = archivos.Archivo()
@@ -11,7 +26,8 @@ service = Services()
 
 # Ruta para guardar el archivo
 @router.post('/uploadfile/')
-async def upload_file(file: UploadFile = File(...), authorization: str = Header(...)):
+async def upload_file(file: UploadFile = File(...), authorization: str = Header(...),
+                      confirmacion: str = Header('sellado', alias='X-Confirmacion')):
     try:
         if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
             error_handle.manejar_error(ValueError('El token no fue proporcionado o es inválido'))
@@ -29,9 +45,9 @@ async def upload_file(file: UploadFile = File(...), authorization: str = Header(
             error_handle.manejar_error(ValueError('El archivo no fue proporcionado o esta vacío'))
 
         filename = file.filename
-        await archivo.uploadfile(file, result)
+        resultado = await archivo.uploadfile(file, result, confirmacion)
 
-        return {'name': filename, 'token': token}
+        return {'name': filename, 'token': token, 'registro': resultado.get('registro')}
 
     except Exception as e:
         error_handle.manejar_error(e)
@@ -40,9 +56,141 @@ async def upload_file(file: UploadFile = File(...), authorization: str = Header(
 class RegisterRequest(BaseModel):
     filename: str # Se valida automáticamente que filename exista y sea una cadena
 
+# Ruta para guardar varios archivos en una sola petición: un solo bloque y una sola transacción SQL para todo el lote
+@router.post('/uploadfiles/')
+async def upload_files(files: List[UploadFile] = File(...), authorization: str = Header(...)):
+    try:
+        if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
+            error_handle.manejar_error(ValueError('El token no fue proporcionado o es inválido'))
+
+        token_parts = authorization.split(' ')
+        if len(token_parts) != 2:
+            error_handle.manejar_error(ValueError('El formato del token es incorrecto'))
+
+        token = token_parts[1] # Extrae el token después de 'Bearer'
+
+        result = service.verify_and_validate_token(token)
+
+        # Valida que se haya enviado al menos un archivo con nombre
+        files = [file for file in files if file.filename]
+        if not files:
+            error_handle.manejar_error(ValueError('No se proporcionó ningún archivo'))
+
+        resultado = await archivo.uploadfiles(files, result)
+
+        return {'token': token, **resultado}
+
+    except Exception as e:
+        error_handle.manejar_error(e)
+        return {'message': f'Error al guardar los archivos: {str(e)}'}
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    tamaño: int # Tamaño total del archivo en bytes
+    content_type: Optional[str] = None
+
+# Rutas de subida reanudable: crear la sesión, enviar partes (en cualquier orden), consultar lo recibido y finalizar
+@router.post('/uploadsession/')
+async def upload_session(request: UploadSessionRequest, authorization: str = Header(...)):
+    try:
+        if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
+            raise ValueError('El token no fue proporcionado o es inválido')
+
+        token_parts = authorization.split(' ')
+        if len(token_parts) != 2:
+            raise ValueError('El formato del token es incorrecto')
+
+        token = token_parts[1] # Extrae el token después de 'Bearer'
+        service.verify_and_validate_token(token)
+
+        if not request.filename or request.tamaño < 0:
+            raise ValueError('Se debe indicar el nombre y el tamaño del archivo')
+
+        return await archivo.sesiones.crear_sesion(request.filename, request.tamaño, request.content_type)
+
+    except Exception as e:
+        error_handle.manejar_error(e)
+        return {'message': f'Error al crear la sesión: {str(e)}'}
+
+@router.put('/uploadsession/{sesion_id}')
+async def upload_session_part(sesion_id: str, offset: int, request: Request, authorization: str = Header(...)):
+    try:
+        if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
+            raise ValueError('El token no fue proporcionado o es inválido')
+
+        token_parts = authorization.split(' ')
+        if len(token_parts) != 2:
+            raise ValueError('El formato del token es incorrecto')
+
+        token = token_parts[1] # Extrae el token después de 'Bearer'
+        service.verify_and_validate_token(token)
+
+        # El cuerpo se lee por streaming y se escribe en la BD chunk a chunk
+        return await archivo.sesiones.guardar_parte(sesion_id, offset, request.stream())
+
+    except Exception as e:
+        error_handle.manejar_error(e)
+        return {'message': f'Error al guardar la parte: {str(e)}'}
+
+@router.get('/uploadsession/{sesion_id}')
+async def upload_session_status(sesion_id: str, authorization: str = Header(...)):
+    try:
+        if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
+            raise ValueError('El token no fue proporcionado o es inválido')
+
+        token_parts = authorization.split(' ')
+        if len(token_parts) != 2:
+            raise ValueError('El formato del token es incorrecto')
+
+        token = token_parts[1] # Extrae el token después de 'Bearer'
+        service.verify_and_validate_token(token)
+        return await archivo.sesiones.rangos_recibidos(sesion_id)
+
+    except Exception as e:
+        error_handle.manejar_error(e)
+        return {'message': f'Error al consultar la sesión: {str(e)}'}
+
+@router.post('/uploadsession/{sesion_id}/finalize')
+async def upload_session_finalize(sesion_id: str, authorization: str = Header(...),
+                                  confirmacion: str = Header('sellado', alias='X-Confirmacion')):
+    try:
+        if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
+            raise ValueError('El token no fue proporcionado o es inválido')
+
+        token_parts = authorization.split(' ')
+        if len(token_parts) != 2:
+            raise ValueError('El formato del token es incorrecto')
+
+        token = token_parts[1] # Extrae el token después de 'Bearer'
+        result = service.verify_and_validate_token(token)
+        return await archivo.finalizar_subida(sesion_id, result, confirmacion)
+
+    except Exception as e:
+        error_handle.manejar_error(e)
+        return {'message': f'Error al finalizar la subida: {str(e)}'}
+
+@router.delete('/uploadsession/{sesion_id}')
+async def upload_session_cancel(sesion_id: str, authorization: str = Header(...)):
+    try:
+        if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
+            raise ValueError('El token no fue proporcionado o es inválido')
+
+        token_parts = authorization.split(' ')
+        if len(token_parts) != 2:
+            raise ValueError('El formato del token es incorrecto')
+
+        token = token_parts[1] # Extrae el token después de 'Bearer'
+        service.verify_and_validate_token(token)
+        return await archivo.sesiones.cancelar(sesion_id)
+
+    except Exception as e:
+        error_handle.manejar_error(e)
+        return {'message': f'Error al cancelar la sesión: {str(e)}'}
+
 # Ruta para eliminar el archivo
 @router.post('/deletefile/')
-def delete_file(request: RegisterRequest, authorization: str = Header(...)):
+async def delete_file(request: RegisterRequest, authorization: str = Header(...),
+                      confirmacion: str = Header('sellado', alias='X-Confirmacion')):
     try:
         if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
             raise  ValueError('El token no fue proporcionado o es inválido')
@@ -55,15 +203,66 @@ def delete_file(request: RegisterRequest, authorization: str = Header(...)):
 
         result = service.verify_and_validate_token(token)
 
-        archivo.deletefile(request.filename, result)
+        await archivo.deletefile(request.filename, result, confirmacion)
         return {'message': 'Archivo eliminado correctamente'}
     except Exception as e:
         error_handle.manejar_error(e)
         return {'message': f'Error al eliminar el archivo: {str(e)}'}
 
-# Ruta para cargar el archivo
-@router.post('/loadfile/')
-def load_file(request: RegisterRequest, authorization: str = Header(...)):
+def parsear_rango(cabecera, tamano):
+    # Interpreta una cabecera Range de un solo intervalo: devuelve (inicio, fin), None si se envía el archivo
+    # completo o False si el intervalo no se puede satisfacer
+    if not cabecera or not cabecera.startswith('bytes=') or ',' in cabecera:
+        return None
+
+    inicio, _, fin = cabecera[len('bytes='):].strip().partition('-')
+    if not (inicio or fin) or (inicio and not inicio.isdigit()) or (fin and not fin.isdigit()):
+        return None
+
+    if not inicio: # bytes=-N: los últimos N bytes
+        if int(fin) == 0 or tamano == 0:
+            return False
+        return max(tamano - int(fin), 0), tamano - 1
+
+    inicio = int(inicio)
+    fin = min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or fin < inicio:
+        return False
+    return inicio, fin
+
+def cabeceras_cache(metadatos):
+    # ETag (hash SHA-256 del contenido) y Last-Modified a partir de los metadatos guardados
+    cabeceras = {}
+    if metadatos and metadatos.get('hash'):
+        cabeceras['ETag'] = f'"{metadatos["hash"]}"'
+    if metadatos and metadatos.get('modificado'):
+        cabeceras['Last-Modified'] = format_datetime(metadatos['modificado'].replace(tzinfo=datetime.timezone.utc), usegmt=True)
+    return cabeceras
+
+def no_modificado(metadatos, if_none_match, if_modified_since):
+    # Petición condicional: If-None-Match tiene prioridad sobre If-Modified-Since (RFC 7232)
+    if not metadatos:
+        return False
+
+    if if_none_match:
+        if not metadatos.get('hash'):
+            return False
+        etiquetas = [etiqueta.strip() for etiqueta in if_none_match.split(',')]
+        return '*' in etiquetas or any(etiqueta.removeprefix('W/').strip('"') == metadatos['hash'] for etiqueta in etiquetas)
+
+    if if_modified_since and metadatos.get('modificado'):
+        try:
+            desde = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if desde.tzinfo is None:
+            desde = desde.replace(tzinfo=datetime.timezone.utc)
+        modificado = metadatos['modificado'].replace(tzinfo=datetime.timezone.utc, microsecond=0)
+        return modificado <= desde
+
+    return False
+
+async def servir_archivo(filename, authorization, cabecera_rango, confirmacion, if_none_match, if_modified_since, lectura):
     try:
         if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
             raise ValueError('El token no fue proporcionado o es inválido')
@@ -75,18 +274,184 @@ def load_file(request: RegisterRequest, authorization: str = Header(...)):
         token = token_parts[1] # Extrae el token después de 'Bearer'
         result = service.verify_and_validate_token(token)
 
-        file_data, file_name, content_type = archivo.load_file(request.file_name, result)
+        # Revalidación de una copia en caché del cliente: se responde solo con los metadatos, sin abrir el archivo.
+        # Con GET una copia vigente es un 304; en el POST If-Modified-Since no aplica y una etiqueta que
+        # coincide es una precondición fallida (412), como pide RFC 7232
+        metadatos = await archivo.nosql_async.metadatos_por_nombre(filename)
+        if no_modificado(metadatos, if_none_match, if_modified_since if lectura else None):
+            return Response(status_code=304 if lectura else 412, headers=cabeceras_cache(metadatos))
+
+        resultado = await archivo.load_file(filename, result, confirmacion)
 
-        if isinstance(file_data, dict): # Si es un error
-            return file_data
+        if isinstance(resultado, dict): # Si es un error
+            return resultado
+
+        file_data, content_type, file_name = resultado
 
         if file_data is None:
             return {'message': 'Error: El archivo no existe o no se puedo recuperar'}
 
-        # Devuelve el archivo con el tipo de contenido correcto
-        return  Response(file_data, media_type=content_type, headers={'Content-Disposition': f'attachment; filename={file_name}'})
+        tamano = file_data.length
+        headers = {'Content-Disposition': f'attachment; filename={file_name}', 'Accept-Ranges': 'bytes', **cabeceras_cache(metadatos)}
+
+        rango = parsear_rango(cabecera_rango, tamano)
+        if rango is False:
+            return Response(status_code=416, headers={'Content-Range': f'bytes */{tamano}'})
+
+        # Devuelve el archivo por streaming (completo o solo el intervalo pedido) con el tipo de contenido correcto
+        inicio, fin = rango or (0, tamano - 1)
+        headers['Content-Length'] = str(fin - inicio + 1 if tamano else 0)
+        if rango:
+            headers['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+
+        return StreamingResponse(archivo.nosql_async.iter_file(file_data, inicio, fin),
+                                 status_code=206 if rango else 200,
+                                 media_type=content_type,
+                                 headers=headers)
 
     except Exception as e:
         error_handle.manejar_error(e)
         return {'message': f'Error al cargar el archivo: {str(e)}'}
 
+# Ruta para cargar el archivo
+@router.post('/loadfile/')
+async def load_file(request: RegisterRequest, authorization: str = Header(...), cabecera_rango: str = Header(None, alias='Range'),
+                    confirmacion: str = Header('sellado', alias='X-Confirmacion'),
+                    if_none_match: str = Header(None, alias='If-None-Match'),
+                    if_modified_since: str = Header(None, alias='If-Modified-Since')):
+    return await servir_archivo(request.filename, authorization, cabecera_rango, confirmacion, if_none_match, if_modified_since, False)
+
+# Ruta de descarga con GET: la que pueden revalidar las cachés HTTP (304 Not Modified)
+@router.get('/loadfile/{filename:path}')
+async def download_file(filename: str, authorization: str = Header(...), cabecera_rango: str = Header(None, alias='Range'),
+                        confirmacion: str = Header('sellado', alias='X-Confirmacion'),
+                        if_none_match: str = Header(None, alias='If-None-Match'),
+                        if_modified_since: str = Header(None, alias='If-Modified-Since')):
+    return await servir_archivo(filename, authorization, cabecera_rango, confirmacion, if_none_match, if_modified_since, True)
+
+class LoadFilesRequest(BaseModel):
+    filenames: Optional[List[str]] = None
+    prefijo: Optional[str] = None # Alternativa a la lista: todos los archivos cuyo nombre empieza por el prefijo
+
+# Ruta para descargar varios archivos en un zip generado al vuelo
+@router.post('/loadfiles/')
+async def load_files(request: LoadFilesRequest, authorization: str = Header(...)):
+    try:
+        if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
+            raise ValueError('El token no fue proporcionado o es inválido')
+
+        token_parts = authorization.split(' ')
+        if len(token_parts) != 2:
+            raise ValueError('El formato del token es incorrecto')
+
+        token = token_parts[1] # Extrae el token después de 'Bearer'
+        result = service.verify_and_validate_token(token)
+
+        if not request.filenames and not request.prefijo:
+            raise ValueError('Se debe indicar filenames o prefijo')
+
+        resultado = await archivo.descargar_archivos(request.filenames, request.prefijo, result)
+
+        if isinstance(resultado, dict): # Si es un error
+            return resultado
+
+        archivos, hash_block, faltantes = resultado
+        headers = {'Content-Disposition': 'attachment; filename=archivos.zip', 'X-Bloque': hash_block}
+        if faltantes:
+            headers['X-Faltantes'] = str(len(faltantes))
+
+        return StreamingResponse(empaquetador.generar_zip(archivos, archivo.nosql_async.iter_file),
+                                 media_type='application/zip',
+                                 headers=headers)
+
+    except Exception as e:
+        error_handle.manejar_error(e)
+        return {'message': f'Error al cargar los archivos: {str(e)}'}
+
+class ProofRequest(BaseModel):
+    file_hash: Optional[str] = None
+    file_id: Optional[str] = None
+    index: Optional[int] = None # Bloque concreto; por defecto el más reciente que contiene el archivo
+
+# Ruta para obtener la prueba de inclusión de Merkle de un archivo
+@router.post('/proof/')
+async def proof(request: ProofRequest, authorization: str = Header(...)):
+    try:
+        if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
+            raise ValueError('El token no fue proporcionado o es inválido')
+
+        token_parts = authorization.split(' ')
+        if len(token_parts) != 2:
+            raise ValueError('El formato del token es incorrecto')
+
+        token = token_parts[1] # Extrae el token después de 'Bearer'
+        service.verify_and_validate_token(token)
+
+        if not request.file_hash and not request.file_id:
+            raise ValueError('Se debe indicar file_hash o file_id')
+
+        return await run_in_threadpool(archivo.blockchain.prueba_inclusion, request.file_hash, request.file_id, request.index)
+
+    except Exception as e:
+        error_handle.manejar_error(e)
+        return {'message': f'Error al obtener la prueba: {str(e)}'}
+
+class VerifyChainRequest(BaseModel):
+    desde: Optional[int] = None # Índice a partir del cual se verifica (0 = cadena completa, por defecto el último checkpoint)
+
+# Ruta para verificar la cadena completa: hashes, enlaces, raíces de Merkle y firmas
+@router.post('/verifychain/')
+async def verify_chain(request: VerifyChainRequest, authorization: str = Header(...)):
+    try:
+        if not isinstance(authorization, str) or not authorization.startswith('Bearer '):
+            raise ValueError('El token no fue proporcionado o es inválido')
+
+        token_parts = authorization.split(' ')
+        if len(token_parts) != 2:
+            raise ValueError('El formato del token es incorrecto')
+
+        token = token_parts[1] # Extrae el token después de 'Bearer'
+        result = service.verify_and_validate_token(token)
+
+        # Con la clave privada del servidor en el token se firma un checkpoint al terminar
+        return await run_in_threadpool(Verificador().verificar, request.desde, None, result.get('clave_privada'))
+
+    except Exception as e:
+        error_handle.manejar_error(e)
+        return {'message': f'Error al verificar la cadena: {str(e)}'}
+
+# Ruta para consultar el estado de los pools de conexiones
+@router.get('/poolstats/')
+def pool_stats():
+    conexion = Connection()
+    return {'nosql': conexion.estadisticas_nosql(),
+            'nosql_async': conexion.estadisticas_nosql_async(),
+            'sql': conexion.estadisticas_sql()}
+
+# Ruta para consultar la cabeza de la cadena en memoria, la contención al anexar bloques y las cachés de claves, tokens y archivos
+@router.get('/chainstats/')
+def chain_stats():
+    return {'cabeza': cabeza.estadisticas(),
+            'secuenciador': secuenciador.estadisticas(),
+            'mempool': mempool.estadisticas(),
+            'outbox': outbox.estadisticas(),
+            'llavero': llavero.estadisticas(),
+            'tokens': cache_tokens.estadisticas(),
+            'archivos': cache_archivos.estadisticas()}
+
+# Ruta con las métricas en formato de texto de Prometheus: duración por etapa y por ruta, contadores
+# de bloques, bytes y errores, y el estado de los pools y las cachés
+@router.get('/metrics')
+def metrics():
+    conexion = Connection()
+    fuentes = {'sql': conexion.estadisticas_sql(),
+               'nosql': conexion.estadisticas_nosql(),
+               'nosql_async': conexion.estadisticas_nosql_async(),
+               'cabeza': cabeza.estadisticas(),
+               'secuenciador': secuenciador.estadisticas(),
+               'mempool': mempool.estadisticas(),
+               'outbox': outbox.estadisticas(),
+               'llavero': llavero.estadisticas(),
+               'tokens': cache_tokens.estadisticas(),
+               'archivos': cache_archivos.estadisticas()}
+    return Response(content=metricas.exponer(fuentes), media_type='text/plain; version=0.0.4; charset=utf-8')
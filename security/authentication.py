@@ -1,9 +1,58 @@
 import json
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.exceptions import InvalidSignature
 from error_handler import Errores
+from security.llavero import llavero
+
+
+class FirmanteRSA:
+    # Esquema original: RSA-PSS para el proof y PKCS1v15 para el bloque
+    nombre = 'rsa'
+
+    def pss(self):
+        return padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH)
+
+    def firmar_proof(self, private_key_obj, datos):
+        return private_key_obj.sign(datos, self.pss(), hashes.SHA256())
+
+    def firmar_bloque(self, private_key_obj, datos):
+        return private_key_obj.sign(datos, padding.PKCS1v15(), hashes.SHA256())
+
+    def verificar_proof(self, public_key_obj, firma, datos):
+        public_key_obj.verify(firma, datos, self.pss(), hashes.SHA256())
+
+    def verificar_bloque(self, public_key_obj, firma, datos):
+        public_key_obj.verify(firma, datos, padding.PKCS1v15(), hashes.SHA256())
+
+
+class FirmanteEd25519:
+    # Firmas de 64 bytes, mucho más rápidas de generar que las RSA; el mismo esquema para proof y bloque
+    nombre = 'ed25519'
+
+    def firmar_proof(self, private_key_obj, datos):
+        return private_key_obj.sign(datos)
+
+    def firmar_bloque(self, private_key_obj, datos):
+        return private_key_obj.sign(datos)
+
+    def verificar_proof(self, public_key_obj, firma, datos):
+        public_key_obj.verify(firma, datos)
+
+    def verificar_bloque(self, public_key_obj, firma, datos):
+        public_key_obj.verify(firma, datos)
+
+
+FIRMANTES = {'rsa': FirmanteRSA(), 'ed25519': FirmanteEd25519()}
+
+
+def firmante_de(clave):
+    # El esquema se elige por el tipo de la clave (privada o pública) ya cargada
+    if isinstance(clave, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return FIRMANTES['ed25519']
+    return FIRMANTES['rsa']
+
 
 class Authentication:
     def __init__(self, error_handle = None):
@@ -11,15 +60,8 @@ class Authentication:
 
     def get_public_key(self, private_key):
         try:
-            # Carga la clave privada desde una cadena PEM
-            private_key_obj = serialization.load_pem_private_key(private_key.encode(), password=None)
-
-            # Obtener la clave pública
-            public_key = private_key_obj.public_key()
-            # Convertir la clave pública a formato PEM
-            public_pem = public_key.public_bytes(encoding=serialization.Encoding.PEM,
-                                                 format=serialization.PublicFormat.SubjectPublicKeyInfo)
-            return public_pem.decode()
+            # Clave pública en formato PEM derivada de la clave privada (se calcula una vez por clave)
+            return llavero.publica_de(private_key)
         except Exception as e:
             self.error_handle.manejar_error(e)
             return None
@@ -28,37 +70,63 @@ class Authentication:
     # En entornos productivos, se recomienda obtenerla desde un vault seguro o base de datos cifrada.
     def get_server_public_key(self):
         try:
-            with open('../server_public_key.pem', 'r') as file:
-                return file.read()
+            return llavero.clave_servidor() # Se lee del archivo solo la primera vez
         except Exception as e:
             self.error_handle.manejar_error(e)
             return None
 
     def sign_block(self, block, private_key):
         block_string = json.dumps(block, sort_keys=True).encode()
-        signature = private_key.sign(
-            block_string,
-            padding.PKCS1v15(),
-            hashes.SHA256()
-        )
+        private_key_obj = llavero.privada(private_key)
+        signature = firmante_de(private_key_obj).firmar_bloque(private_key_obj, block_string)
         return signature
 
+    def sign_bytes(self, datos, private_key):
+        # Firma directamente los bytes de un bloque ya serializado (codificación binaria)
+        private_key_obj = llavero.privada(private_key)
+        return firmante_de(private_key_obj).firmar_bloque(private_key_obj, datos)
+
     def sign_proof(self, previous_poof, private_key):
         try:
-            # Carga la clave privada
-            privet_key_obj = serialization.load_pem_private_key(private_key.encode(), password=None)
-
-            # Firma los datos usando SHA256
-            signature = privet_key_obj.sign(
-                previous_poof.encode(),
-                padding.PSS(
-                    mgf=padding.MGF1(hashes.SHA256()),
-                    salt_length=padding.PSS.MAX_LENGTH
-                ),
-                hashes.SHA256()
-            )
+            # Carga la clave privada (desde el llavero si ya se usó)
+            privet_key_obj = llavero.privada(private_key)
+
+            # Firma los datos con el esquema de la clave (RSA-PSS o Ed25519)
+            signature = firmante_de(privet_key_obj).firmar_proof(privet_key_obj, previous_poof.encode())
             return signature.hex()
         except Exception as e:
             self.error_handle.manejar_error(e)
             return None
 
+    def algoritmo(self, private_key):
+        # Esquema de firma de la clave: se guarda en cada bloque para verificar cadenas mixtas
+        return firmante_de(llavero.privada(private_key)).nombre
+
+    def verify_block(self, block, public_key):
+        # Comprueba la firma del bloque (hecha sobre el bloque completo sin el campo 'signature', o sobre
+        # su cuerpo binario) con el algoritmo registrado en el bloque; los bloques sin 'algoritmo' son RSA
+        try:
+            signature = block['signature']
+            if isinstance(signature, str):
+                signature = bytes.fromhex(signature)
+
+            if 'cuerpo' in block:
+                datos = bytes(block['cuerpo'])
+            else:
+                cuerpo = {clave: valor for clave, valor in block.items() if clave != 'signature'}
+                datos = json.dumps(cuerpo, sort_keys=True).encode()
+            public_key_obj = llavero.publica(public_key)
+            FIRMANTES[block.get('algoritmo', 'rsa')].verificar_bloque(public_key_obj, signature, datos)
+            return True
+        except (InvalidSignature, KeyError, TypeError, ValueError):
+            return False
+
+    def verify_proof(self, previous_poof, signature, public_key, algoritmo=None):
+        # Comprueba una firma hecha con sign_proof; sin algoritmo se deduce del tipo de clave
+        try:
+            public_key_obj = llavero.publica(public_key)
+            firmante = FIRMANTES[algoritmo] if algoritmo else firmante_de(public_key_obj)
+            firmante.verificar_proof(public_key_obj, bytes.fromhex(signature), previous_poof.encode())
+            return True
+        except (InvalidSignature, KeyError, TypeError, ValueError):
+            return False
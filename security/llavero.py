@@ -0,0 +1,118 @@
+import collections
+import hashlib
+import os
+import threading
+import time
+from cryptography.hazmat.primitives import serialization
+from decouple import config
+
+
+class Llavero:
+    # Guarda las claves ya deserializadas (indexadas por la huella de su PEM) y la clave pública del servidor
+    # para no volver a parsear claves RSA ni leer el archivo de la clave en cada bloque
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.max_claves = config('LLAVERO_MAX_CLAVES', default=32, cast=int)
+        self.ruta_servidor = config('SERVER_PUBLIC_KEY_PATH', default='../server_public_key.pem')
+        self._privadas = collections.OrderedDict() # huella -> (clave privada, PEM de su clave pública)
+        self._publicas = collections.OrderedDict() # huella -> clave pública
+        self.revision = config('LLAVERO_REVISION_S', default=2, cast=float) # Cada cuánto se mira si el archivo cambió
+        self._servidor = None
+        self._mtime_servidor = None
+        self._revisado = 0.0
+        self.aciertos = 0
+        self.fallos = 0
+        self.recargas = 0
+
+    def huella(self, pem):
+        return hashlib.sha256(pem.encode()).hexdigest()
+
+    def _buscar(self, cache, huella):
+        with self._lock:
+            entrada = cache.get(huella)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            cache.move_to_end(huella)
+            self.aciertos += 1
+            return entrada
+
+    def _guardar(self, cache, huella, entrada):
+        # Cache acotada: se descarta la clave usada hace más tiempo
+        with self._lock:
+            cache[huella] = entrada
+            cache.move_to_end(huella)
+            while len(cache) > self.max_claves:
+                cache.popitem(last=False)
+
+    def _privada(self, private_pem):
+        huella = self.huella(private_pem)
+        entrada = self._buscar(self._privadas, huella)
+        if entrada is None:
+            # Si el PEM no es válido la excepción llega al llamador y no se guarda nada
+            private_key_obj = serialization.load_pem_private_key(private_pem.encode(), password=None)
+            public_pem = private_key_obj.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                                                   format=serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+            entrada = (private_key_obj, public_pem)
+            self._guardar(self._privadas, huella, entrada)
+        return entrada
+
+    def privada(self, private_key):
+        # Acepta el PEM o una clave ya cargada
+        if not isinstance(private_key, str):
+            return private_key
+        return self._privada(private_key)[0]
+
+    def publica_de(self, private_pem):
+        # PEM de la clave pública derivada de una clave privada
+        return self._privada(private_pem)[1]
+
+    def publica(self, public_pem):
+        huella = self.huella(public_pem)
+        public_key_obj = self._buscar(self._publicas, huella)
+        if public_key_obj is None:
+            public_key_obj = serialization.load_pem_public_key(public_pem.encode())
+            self._guardar(self._publicas, huella, public_key_obj)
+        return public_key_obj
+
+    def clave_servidor(self):
+        # Se lee del archivo solo cuando cambia: como mucho cada LLAVERO_REVISION_S segundos se compara la
+        # fecha de modificación, así una clave rotada en disco se usa sin reiniciar el servidor
+        servidor = self._servidor
+        ahora = time.monotonic()
+        if servidor is not None and ahora - self._revisado < self.revision:
+            return servidor
+
+        mtime = os.stat(self.ruta_servidor).st_mtime_ns
+        self._revisado = ahora
+        if servidor is None or mtime != self._mtime_servidor:
+            with open(self.ruta_servidor, 'r') as file:
+                servidor = file.read()
+            with self._lock:
+                if self._servidor is not None:
+                    self.recargas += 1
+                self._servidor = servidor
+                self._mtime_servidor = mtime
+        return servidor
+
+    def recargar(self):
+        # Olvida todas las claves: la del servidor se vuelve a leer en el próximo uso
+        with self._lock:
+            self._privadas.clear()
+            self._publicas.clear()
+            self._servidor = None
+            self._mtime_servidor = None
+            self.recargas += 1
+
+    def estadisticas(self):
+        with self._lock:
+            return {'claves_privadas': len(self._privadas),
+                    'claves_publicas': len(self._publicas),
+                    'servidor_cargada': self._servidor is not None,
+                    'aciertos': self.aciertos,
+                    'fallos': self.fallos,
+                    'recargas': self.recargas}
+
+
+# Llavero compartido por el proceso
+llavero = Llavero()
@@ -1,89 +1,267 @@
+import asyncio
 import mimetypes
 import config
 import os
 from pathlib import Path
+from bson import ObjectId
+from starlette.concurrency import run_in_threadpool
 from error_handler import Errores
-from database import nosql, sql
-from security.hashing import Hashing
+from database import nosql_async
+from database.sesiones_subida import SesionesSubida
+from database.cache_archivos import ArchivoEnMemoria, cache_archivos
 from blockchain.blockchain import Blockchain
+from blockchain.mempool import mempool
+import metricas
 
 
 class Archivo:
     def __init__(self):
         self.error_handle = Errores()
-        self.nosql_bd = nosql.Nosql()
-        self.sql_bd = sql.Sql()
+        self.nosql_async = nosql_async.NosqlAsync()
         self.blockchain = Blockchain()
-        self.hash = Hashing()
+        self.mempool = mempool
+        self.cache_archivos = cache_archivos
+        self.sesiones = SesionesSubida()
 
-    async def uploadfile(self, file_encrypt, token_decode):
+    async def registrar_evento(self, file_hash, metadatos, token_decode, confirmacion='sellado'):
+        with metricas.medir('registro_evento'):
+            return await self._registrar_evento(file_hash, metadatos, token_decode, confirmacion)
+
+    async def _registrar_evento(self, file_hash, metadatos, token_decode, confirmacion):
+        # Sin mempool cada operación crea su propio bloque (firma y BD SQL son bloqueantes, van al threadpool)
+        if not self.mempool.activo:
+            return await run_in_threadpool(self.blockchain.create_block, file_hash, metadatos, token_decode['clave_privada'])
+
+        # Con mempool el evento se guarda en la cola y se sella junto a otros en un solo bloque;
+        # el cliente decide si esperar solo a la cola ('cola') o al bloque ('sellado')
+        # La clave se valida antes de encolar: una clave que no es la del servidor no entra en la cola
+        if not await run_in_threadpool(self.mempool.autorizar, token_decode['clave_privada']):
+            return {'message': 'Error: Clave privada incorrecta para validación'}
+
+        evento_id = ObjectId()
+        loop = asyncio.get_running_loop() if confirmacion == 'sellado' else None
+        espera = self.mempool.nuevo_evento(evento_id, loop)
         try:
-            # Obteniendo el nombre del archivo
-            filename = file_encrypt.filename or 'archivo_desconocido'
+            await self.nosql_async.encolar_evento(evento_id, file_hash, metadatos)
+        except Exception:
+            self.mempool.descartar(evento_id)
+            raise
+        self.mempool.encolado()
+
+        if espera is None:
+            return {'message': 'Evento en cola', 'evento': str(evento_id)}
+
+        try:
+            hash_block = await asyncio.wait_for(espera, self.mempool.espera_max)
+        except asyncio.TimeoutError:
+            self.mempool.descartar(evento_id)
+            return {'message': 'Evento en cola, todavía sin sellar', 'evento': str(evento_id)}
+
+        return {'message': 'Registro agregado con suceso', 'block': hash_block}
+
+    async def guardar_archivo(self, file_encrypt):
+        # Obteniendo el nombre del archivo
+        filename = file_encrypt.filename or 'archivo_desconocido'
+
+        # Obteniendo la extencion del archivo
+        file_extension = filename.split('.')[-1] if '.' in filename else 'desconocido'
+
+        # Guardar en la base de datos NoSQL leyendo por bloques: una primera pasada calcula el hash y el tamaño
+        # (y decide si el contenido ya existe) y solo si hace falta una segunda escribe los bytes
+        result = await self.nosql_async.save_file(file_encrypt, filename, file_encrypt.content_type)
+        if 'file_id' not in result:
+            return filename, result, None
+
+        # Extraer metadatos del archivo cifrado
+        metadatos = {
+            'nombre': filename,
+            'tamaño': result['tamaño'],
+            'tipo': file_encrypt.content_type or 'desconocido',
+            'extension': file_extension,
+            'file_id': str(result['file_id'])
+        }
+        if result.get('manifiesto'):
+            metadatos['manifiesto'] = result['manifiesto'] # Hash del manifiesto de fragmentos: queda sellado en el bloque
+
+        return filename, result, {'file_hash': result['file_hash'], 'metadatos': metadatos}
+
+    async def buscar_id(self, file_name):
+        # El nombre se resuelve en la BD NoSQL (referencias y archivos anteriores al almacén por contenido):
+        # un archivo recién subido ya está ahí aunque su fila SQL siga pendiente en el outbox o MySQL no responda
+        with metricas.medir('nosql_consulta'):
+            encontrados = await self.nosql_async.buscar_archivos([file_name])
+        file_id = encontrados.get(file_name)
+        return str(file_id) if file_id is not None else None
 
-            # Leer el contenido del archivo (esto lo consume completamente)
-            contents = await file_encrypt.read()
+    async def abrir_archivo(self, file_id):
+        # Los archivos pequeños se sirven desde la caché en memoria; los grandes se siguen leyendo por streaming.
+        # La caché es de cada worker y el borrado solo la invalida en el worker que lo hizo: antes de servir
+        # una entrada se comprueba que el archivo sigue existiendo
+        en_cache = self.cache_archivos.obtener(file_id)
+        if en_cache is not None:
+            if await self.nosql_async.archivo_existe(file_id):
+                return en_cache
+            self.cache_archivos.invalidar(file_id)
 
-            # Obteniendo el tamaño del archivo
-            file_size = len(contents)
+        with metricas.medir('gridfs_apertura'):
+            file_data = await self.nosql_async.open_file(file_id)
+        if file_data is None or isinstance(file_data, dict):
+            return file_data
 
-            # Obteniendo la extencion del archivo
-            file_extension = filename.split('.')[-1] if '.' in filename else 'desconocido'
+        if not self.cache_archivos.admite(file_data.length):
+            self.cache_archivos.omitido()
+            return file_data
+
+        contenido = await file_data.read()
+        metadata = dict(file_data.metadata or {})
+        metadata['sha256'] = await self.nosql_async.hash_file(file_data)
+        self.cache_archivos.guardar(file_id, metadata['sha256'], contenido, file_data.content_type, metadata)
+        return ArchivoEnMemoria(contenido, file_data.content_type, metadata)
+
+    async def uploadfile(self, file_encrypt, token_decode, confirmacion='sellado'):
+        try:
+            filename, result, entrada = await self.guardar_archivo(file_encrypt)
+            if entrada is None:
+                return result
+
+            # Crear un bloque en la blockchain
+            registro = await self.registrar_evento(entrada['file_hash'], entrada['metadatos'], token_decode, confirmacion)
+
+            return {'message': 'Archivo subido con exito', 'nombre': filename, 'registro': registro}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+            return {'message': f'Error: No se pudo guardar el archivo {str(e)}'}
+
+    async def uploadfiles(self, files, token_decode):
+        try:
+            # Cada parte se guarda por streaming una detrás de otra; un fallo solo afecta a su archivo
+            archivos = []
+            entradas = []
+            for file_encrypt in files:
+                try:
+                    filename, result, entrada = await self.guardar_archivo(file_encrypt)
+                except Exception as e:
+                    self.error_handle.manejar_error(e, levantar=False)
+                    archivos.append({'nombre': file_encrypt.filename, 'message': f'Error: No se pudo guardar el archivo {str(e)}'})
+                    continue
 
-            # Hash del archivo
-            hashing_file = self.hash.hashing(contents)
+                if entrada is None:
+                    archivos.append({'nombre': filename, 'message': result.get('message')})
+                    continue
 
-            # Guardar en la base de datos NoSQL
-            result = self.nosql_bd.save_file(contents, filename)
+                entradas.append(entrada)
+                archivos.append({'nombre': filename, 'message': 'Archivo subido con exito', 'file_id': entrada['metadatos']['file_id'],
+                                 'file_hash': entrada['file_hash'], 'duplicado': result.get('duplicado', False)})
 
-            # Extraer metadatos del archivo cifrado
+            if not entradas:
+                return {'message': 'Error: No se guardó ningún archivo', 'archivos': archivos}
+
+            # Todo el lote queda en un solo bloque (una firma) y sus filas SQL en una sola transacción
+            registro = await run_in_threadpool(self.blockchain.create_batch_block, entradas, token_decode['clave_privada'])
+
+            return {'message': 'Archivos subidos con exito', 'guardados': len(entradas),
+                    'archivos': archivos, 'registro': registro}
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+            return {'message': f'Error: No se pudieron guardar los archivos {str(e)}'}
+
+    async def descargar_archivos(self, nombres, prefijo, token_decode):
+        try:
+            # Un solo viaje a la BD para resolver todos los nombres (o el prefijo)
+            encontrados = await self.nosql_async.buscar_archivos(nombres, prefijo)
+            faltantes = [nombre for nombre in nombres or [] if nombre not in encontrados]
+
+            # Se abren sin leerlos: el contenido se lee después, al construir el zip
+            archivos = []
+            entradas = []
+            for nombre, file_id in encontrados.items():
+                file_data = await self.nosql_async.open_file(file_id)
+                if file_data is None or isinstance(file_data, dict):
+                    faltantes.append(nombre)
+                    continue
+
+                archivos.append((nombre, file_data))
+                entradas.append({'file_hash': await self.nosql_async.hash_file(file_data),
+                                 'metadatos': {'nombre': nombre,
+                                               'tamaño': file_data.length,
+                                               'tipo': file_data.content_type,
+                                               'extension': nombre.split('.')[-1],
+                                               'file_id': str(file_id)}})
+
+            if not archivos:
+                return {'message': 'Error: No se encontró ningún archivo', 'faltantes': faltantes}
+
+            # Un solo bloque de auditoría para toda la descarga
+            registro = await run_in_threadpool(self.blockchain.create_batch_block, entradas, token_decode['clave_privada'])
+            if 'block' not in registro:
+                return registro
+
+            return archivos, registro['block'], faltantes
+
+        except Exception as e:
+            self.error_handle.manejar_error(e)
+            return {'message': f'Error al cargar los archivos: {str(e)}'}
+
+    async def finalizar_subida(self, sesion_id, token_decode, confirmacion='sellado'):
+        try:
+            # El hash se fue calculando al recibir las partes: no se vuelve a leer el archivo
+            result = await self.sesiones.finalizar(sesion_id)
+            if 'file_id' not in result:
+                return result
+
+            filename = result['nombre']
             metadatos = {
                 'nombre': filename,
-                'tamaño': file_size,
-                'tipo': file_encrypt.content_type or 'desconocido',
-                'extension': file_extension,
+                'tamaño': result['tamaño'],
+                'tipo': result['content_type'] or 'desconocido',
+                'extension': filename.split('.')[-1] if '.' in filename else 'desconocido',
                 'file_id': str(result['file_id'])
             }
 
             # Crear un bloque en la blockchain
-            self.blockchain.create_block(hashing_file, metadatos, token_decode['clave_privada'])
+            registro = await self.registrar_evento(result['file_hash'], metadatos, token_decode, confirmacion)
 
-            return {'message': 'Archivo subido con exito', 'nombre': filename}
+            return {'message': 'Archivo subido con exito', 'nombre': filename, 'file_hash': result['file_hash'],
+                    'duplicado': result['duplicado'], 'registro': registro}
 
         except Exception as e:
             self.error_handle.manejar_error(e)
-            return {'message': f'Error: No se pudo guardar el archivo {str(e)}'}
+            return {'message': f'Error: No se pudo finalizar la subida {str(e)}'}
 
-    def deletefile(self, file_name, token_decode):
+    async def deletefile(self, file_name, token_decode, confirmacion='sellado'):
         try:
-            if not self.sql_bd.file_exists(file_name):
+            # Obtener el ID del archivo a partir de su nombre
+            file_id = await self.buscar_id(file_name)
+            if file_id is None:
                 return {'message': 'Error: Archivo no existe'}
 
-            # Obtener el ID del archivo desde SQL
-            file_id = self.sql_bd.file_data(file_name)
-
             # Obtener el archivo desde la base de datos NoSQL (Gridfs)
-            file_data = self.nosql_bd.get_file(file_id)
+            with metricas.medir('gridfs_apertura'):
+                file_data = await self.nosql_async.open_file(file_id)
 
-            if file_data is None:
+            if file_data is None or isinstance(file_data, dict):
                 return {'message': 'Error: No se pudo recuperar el archivo desde la BD'}
 
-            # Calculando el hash del archivo
-            hashing_file = self.hash.hashing(file_data.read())  # Lee el contenido binario del archivo
+            # Hash del archivo (guardado en sus metadatos al subirlo)
+            hashing_file = await self.nosql_async.hash_file(file_data)
 
             metadatos = {
                 'nombre': file_name,
-                'tamaño': os.fstat(file_data.fileno()).st_size,
+                'tamaño': file_data.length,
                 'tipo': file_data.content_type,
-                'extension': filename.split('.')[-1],
+                'extension': file_name.split('.')[-1],
                 'file_id': file_id
             }
 
             # Registrar en el blockchain la operacion de eliminacion
-            self.blockchain.create_block(hashing_file, metadatos, token_decode['clave_privada'])
+            await self.registrar_evento(hashing_file, metadatos, token_decode, confirmacion)
 
-            # Eliminando el archivo de la BD NoSQL
-            self.nosql_bd.delete_file(file_id)
+            # Eliminando el archivo de la BD NoSQL y de la caché de lecturas
+            with metricas.medir('gridfs_borrado'):
+                await self.nosql_async.delete_file(file_id)
+            self.cache_archivos.invalidar(file_id)
 
             return {'message': 'Archivo eliminado con exito', 'nombre': file_name}
 
@@ -91,23 +269,21 @@ class Archivo:
             self.error_handle.manejar_error(e)
             return{'message': f'Error: El archivo no se pudo eliminar {str(e)}'}
 
-    def load_file(self, file_name, token_decode):
+    async def load_file(self, file_name, token_decode, confirmacion='sellado'):
         try:
-            # Verificar si el archivo existe en la base de datos SQL
-            if not self.sql_bd.file_exists(file_name):
+            # Obtener el ID del archivo a partir de su nombre
+            file_id = await self.buscar_id(file_name)
+            if file_id is None:
                 return {'message': 'Error: Archivo no existe'}
 
-            # Obtener el ID del archivo desde SQL
-            file_id = self.sql_bd.file_data(file_name)
-
-            # Obtener el archivo desde la base de datos NoSQL (Gridfs)
-            file_data = self.nosql_bd.get_file(file_id)
+            # Obtener el archivo desde la caché o desde la base de datos NoSQL (Gridfs)
+            file_data = await self.abrir_archivo(file_id)
 
-            if file_data is None:
+            if file_data is None or isinstance(file_data, dict):
                 return {'message': 'Error: No se puede recuperar el archivo desde la BD'}
 
-            # Calculando el hash del archivo
-            hashing_file = self.hash.hashing(file_data.read()) # Lee el contenido binario del archivo
+            # Hash del archivo (guardado en sus metadatos al subirlo)
+            hashing_file = await self.nosql_async.hash_file(file_data)
 
             # Extraer metadatos del archvio
             metadatos = {
@@ -119,10 +295,10 @@ class Archivo:
             }
 
             # Registrar en el blockchain la operacion de carga
-            self.blockchain.create_block(hashing_file, metadatos, token_decode['clave_privada'])
+            await self.registrar_evento(hashing_file, metadatos, token_decode, confirmacion)
 
-            # Devolver el archivo y su tipo de contenido
-            return file_data.read(), file_data.content_type, file_name
+            # Devolver el archivo abierto (se envía por streaming desde la ruta) y su tipo de contenido
+            return file_data, file_data.content_type, file_name
 
         except Exception as e:
             self.error_handle.manejar_error(e)
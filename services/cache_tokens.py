@@ -0,0 +1,60 @@
+import collections
+import hashlib
+import threading
+import time
+from decouple import config
+
+
+class CacheTokens:
+    # Tokens ya verificados, indexados por el SHA-256 del token: una petición repetida no vuelve a
+    # verificar la firma HS256. Cada entrada caduca con el 'exp' del token (o a los TOKEN_CACHE_TTL segundos)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.max_tokens = config('TOKEN_CACHE_MAX', default=10000, cast=int)
+        self.ttl = config('TOKEN_CACHE_TTL', default=300, cast=int)
+        self._tokens = collections.OrderedDict() # huella -> (caducidad, payload)
+        self.aciertos = 0
+        self.fallos = 0
+
+    def huella(self, token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def obtener(self, huella):
+        with self._lock:
+            entrada = self._tokens.get(huella)
+            if entrada is None or entrada[0] <= time.time():
+                if entrada is not None:
+                    del self._tokens[huella] # Token caducado
+                self.fallos += 1
+                return None
+            self._tokens.move_to_end(huella)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, huella, payload):
+        caducidad = time.time() + self.ttl
+        if isinstance(payload.get('exp'), (int, float)):
+            caducidad = min(caducidad, payload['exp'])
+
+        with self._lock:
+            self._tokens[huella] = (caducidad, payload)
+            self._tokens.move_to_end(huella)
+            while len(self._tokens) > self.max_tokens:
+                self._tokens.popitem(last=False)
+
+    def vaciar(self):
+        # Tras cambiar SECRET_KEY los tokens guardados dejan de ser válidos
+        with self._lock:
+            self._tokens.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {'tokens': len(self._tokens),
+                    'aciertos': self.aciertos,
+                    'fallos': self.fallos,
+                    'tasa_acierto': self.aciertos / consultas if consultas else 0.0}
+
+
+# Caché compartida por el proceso
+cache_tokens = CacheTokens()
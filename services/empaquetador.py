@@ -0,0 +1,51 @@
+import datetime
+import zipfile
+from decouple import config
+
+
+class SalidaZip:
+    # Destino de escritura sin seek ni tell: zipfile escribe las entradas con descriptor de datos
+    # (tamaño y CRC detrás del contenido) y lo escrito se recoge y se envía en cada paso
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+async def generar_zip(archivos, iter_file):
+    # Construye el zip mientras se envía: cada archivo se lee chunk a chunk de la BD y en memoria
+    # solo queda el chunk en curso. 'archivos' es una lista de (nombre, archivo abierto)
+    compresion = zipfile.ZIP_DEFLATED if config('ZIP_COMPRIMIR', default=False, cast=bool) else zipfile.ZIP_STORED
+    salida = SalidaZip()
+
+    with zipfile.ZipFile(salida, 'w', compression=compresion) as zip_file:
+        for nombre, file_obj in archivos:
+            entrada = zipfile.ZipInfo(nombre, date_time=datetime.datetime.now().timetuple()[:6])
+            entrada.compress_type = compresion
+            entrada.file_size = file_obj.length # Decide si la entrada necesita ZIP64
+
+            with zip_file.open(entrada, 'w') as destino:
+                async for bloque in iter_file(file_obj):
+                    destino.write(bloque)
+                    datos = salida.vaciar()
+                    if datos:
+                        yield datos
+
+            datos = salida.vaciar()
+            if datos:
+                yield datos
+
+    # Directorio central
+    datos = salida.vaciar()
+    if datos:
+        yield datos
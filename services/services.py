@@ -2,16 +2,33 @@ import datetime
 import jwt
 from decouple import config
 from error_handler import Errores
+from security.llavero import llavero
+from services.cache_tokens import cache_tokens
 
 class Services:
     def __init__(self):
         self.error_handle = Errores()
+        self.cache_tokens = cache_tokens
 
     def verify_and_validate_token(self, token):
         try:
+            # Token ya verificado y sin caducar: basta con una consulta a la caché
+            huella = self.cache_tokens.huella(token)
+            decode = self.cache_tokens.obtener(huella)
+            if decode is not None:
+                return decode
+
             # Decodificar el token
             decode = jwt.decode(token, config('SECRET_KEY'), algorithms=['HS256'])
 
+            # La clave privada del token se deja cargada en el llavero para la creación de bloques
+            if isinstance(decode.get('clave_privada'), str):
+                try:
+                    llavero.privada(decode['clave_privada'])
+                except Exception:
+                    pass # Clave inválida: el error se informa al usarla, como antes
+
+            self.cache_tokens.guardar(huella, decode)
             return decode
 
         except (jwt.ExpiredSignatureError, jwt.InvalidSignatureError, jwt.DecodeError) as e:
@@ -1,6 +1,6 @@
 import unittest
 import json
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, ed25519
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.serialization import load_pem_public_key
@@ -8,6 +8,7 @@ from unittest.mock import MagicMock
 
 # Importando la funcion sing_block desde security\authentication.py
 from security.authentication import Authentication
+from security.llavero import llavero
 
 class TestAuthentication(unittest.TestCase):
 
@@ -34,6 +35,10 @@ class TestAuthentication(unittest.TestCase):
 
         cls.previous_proof = 'dato para firmar'
 
+    def setUp(self):
+        # Cada prueba parte del llavero vacío (la clave del servidor se vuelve a leer del archivo)
+        llavero.recargar()
+
     def test_get_public_key_valid(self):
         auth = Authentication()
         resultado = auth.get_public_key(self.private_key_pem_valid)
@@ -141,3 +146,58 @@ class TestAuthentication(unittest.TestCase):
 
         # El manejador de errores debió ser llamado
         mock_error_handle.manejar_error.assert_called_once()
+
+    def test_verify_block(self):
+        auth = Authentication()
+        public_pem = auth.get_public_key(self.private_key_pem_valid)
+
+        block = {'index': 1, 'data': 'Test block'}
+        block['signature'] = Authentication.sign_block(self, block, self.private_key)
+
+        # Firma en bytes (como se guarda en la BD) o en hexadecimal (como se devuelve en la API)
+        self.assertTrue(auth.verify_block(block, public_pem))
+        self.assertTrue(auth.verify_block(dict(block, signature=block['signature'].hex()), public_pem))
+
+        # Cualquier cambio en el bloque invalida la firma
+        self.assertFalse(auth.verify_block(dict(block, data='Otro bloque'), public_pem))
+
+    def test_verify_proof(self):
+        auth = Authentication()
+        public_pem = auth.get_public_key(self.private_key_pem_valid)
+
+        signature = auth.sign_proof(self.previous_proof, self.private_key_pem_valid)
+
+        self.assertTrue(auth.verify_proof(self.previous_proof, signature, public_pem))
+        self.assertFalse(auth.verify_proof('otro dato', signature, public_pem))
+        self.assertFalse(auth.verify_proof(self.previous_proof, 'no-es-hex', public_pem))
+
+    def test_sign_block_pem(self):
+        # sign_block acepta también la clave privada en PEM, como la recibe create_block
+        block = {'index': 1, 'data': 'Test block'}
+        signature = Authentication().sign_block(block, self.private_key_pem_valid)
+
+        self.public_key.verify(signature, json.dumps(block, sort_keys=True).encode(), padding.PKCS1v15(), hashes.SHA256())
+
+    def test_ed25519(self):
+        auth = Authentication()
+        private_pem = ed25519.Ed25519PrivateKey.generate().private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        ).decode()
+        public_pem = auth.get_public_key(private_pem)
+        self.assertEqual(auth.algoritmo(private_pem), 'ed25519')
+        self.assertEqual(auth.algoritmo(self.private_key_pem_valid), 'rsa')
+
+        # Proof y bloque se firman y verifican con Ed25519 (firmas de 64 bytes)
+        signature = auth.sign_proof(self.previous_proof, private_pem)
+        self.assertEqual(len(bytes.fromhex(signature)), 64)
+        self.assertTrue(auth.verify_proof(self.previous_proof, signature, public_pem))
+
+        block = {'index': 1, 'data': 'Test block', 'algoritmo': 'ed25519'}
+        block['signature'] = auth.sign_block(block, private_pem)
+        self.assertTrue(auth.verify_block(block, public_pem))
+
+        # El algoritmo registrado en el bloque tiene que corresponder a la clave
+        self.assertFalse(auth.verify_block(dict(block, algoritmo='rsa'), public_pem))
+        self.assertFalse(auth.verify_proof(self.previous_proof, signature, public_pem, 'rsa'))
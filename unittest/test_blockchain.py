@@ -1,6 +1,13 @@
 import unittest
+import hashlib
 from unittest.mock import MagicMock, patch
 from blockchain.blockchain import Blockchain
+from blockchain import merkle, codificacion
+from blockchain.cabeza_cadena import CabezaCadena
+from blockchain.secuenciador import Secuenciador
+from security.authentication import Authentication
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
 
 class TestBlockchain(unittest.TestCase):
 
@@ -14,6 +21,12 @@ class TestBlockchain(unittest.TestCase):
         self.blockchain.error_handle.manejar_error = MagicMock(
             side_effect=lambda e, levantar=True: {'status': 400, 'detail': str(e)}
         )
+        # Cada prueba empieza con la cabeza de la cadena sin cargar y sin bloques en la BD
+        self.blockchain.cabeza = CabezaCadena()
+        self.blockchain.secuenciador = Secuenciador()
+        self.blockchain.db_nosql.ultimo_bloque.return_value = None
+        self.blockchain.outbox = MagicMock(activo=False)
+        self.blockchain.outbox.bloque_pendiente.return_value = False
 
     def test_save_block_error(self):
 
@@ -49,24 +62,201 @@ class TestBlockchain(unittest.TestCase):
 
         result = self.blockchain.create_block('test_file_hash', {'file_id': 1, 'nombre': 'test_file'}, 'private_key')
 
+        # El bloque lleva objetos del mock de autenticación que no se pueden serializar: se captura la excepción
         self.blockchain.error_handle.manejar_error.assert_called_once()
-        self.assertEqual(result, {'message': "Error al agregar el bloque: 'validator'"})
+        self.assertTrue(result['message'].startswith('Error al agregar el bloque: '))
 
-    def test_get_last_index_error(self):
+    def test_cargar_cabeza_ultimo_bloque(self):
+        self.blockchain.db_nosql.ultimo_bloque.return_value = {'index': 7, 'hash': 'hash7', 'proof': 'proof7'}
 
-        self.blockchain.db_nosql.get_last_index.return_value = None
+        result = self.blockchain.cargar_cabeza()
 
-        self.blockchain.authentication.get_public_key.return_value = 'server_pub_key'
-        self.blockchain.authentication.get_server_public_key.return_value = 'server_pub_key'
-        self.blockchain.authentication.sign_proof.return_value = 'sign_proof'
-        self.blockchain.proof_of_authority('previous_proof', 'private_key')
+        # Con bloques en la cadena no se consulta el registro génesis
+        self.assertEqual(result, {'index': 7, 'hash': 'hash7', 'proof': 'proof7'})
+        self.blockchain.db_nosql.ultimo_registro.assert_not_called()
+
+    def test_create_block_cabeza_en_memoria(self):
+        self.blockchain.cabeza.actualizar(4, 'hash4', 'proof4')
+        self.blockchain.authentication.sign_proof = MagicMock(return_value='signed_proof_signature')
+        self.blockchain.authentication.sign_block = MagicMock(return_value='block_signature')
+        self.blockchain.db_nosql.save_block.return_value = 'block_id'
+
+        with patch.object(self.blockchain, 'proof_of_authority', return_value={'proof': 'sign_proof', 'validator': 'server_pub_key'}):
+            result = self.blockchain.create_block('filehash', {'file_id': 1, 'nombre': 'testfile.txt'}, 'private_key')
+
+        # Con la cabeza cargada no hay consultas de lectura a las BD
+        self.assertIn('Registro agregado con suceso', result['message'])
+        self.blockchain.db_nosql.ultimo_bloque.assert_not_called()
+        self.blockchain.db_nosql.ultimo_registro.assert_not_called()
+        self.blockchain.db_sql.ultimo_hash.assert_not_called()
+
+        save_block = self.blockchain.db_nosql.save_block.call_args[0][0]
+        self.assertEqual(save_block['index'], 5)
+        self.assertEqual(save_block['previous_hash'], 'hash4')
+
+        # El bloque guardado pasa a ser la nueva cabeza
+        self.assertEqual(self.blockchain.cabeza.obtener(), {'index': 5, 'hash': result['block'], 'proof': 'sign_proof'})
+
+    def test_create_block_outbox(self):
+        self.blockchain.outbox.activo = True
+        self.blockchain.cabeza.actualizar(4, 'hash4', 'proof4')
+        self.blockchain.authentication.sign_proof = MagicMock(return_value='signed_proof_signature')
+        self.blockchain.authentication.sign_block = MagicMock(return_value='block_signature')
+        self.blockchain.db_nosql.save_block.return_value = 'block_id'
+
+        with patch.object(self.blockchain, 'proof_of_authority', return_value={'proof': 'sign_proof', 'validator': 'server_pub_key'}):
+            result = self.blockchain.create_block('filehash', {'file_id': 1, 'nombre': 'testfile.txt'}, 'private_key')
+
+        # Una sola escritura en la petición: el bloque queda pendiente para el outbox y no se toca SQL
+        self.assertIn('Registro agregado con suceso', result['message'])
+        self.assertTrue(self.blockchain.db_nosql.save_block.call_args.kwargs['pendiente_sql'])
+        self.blockchain.db_sql.save_hash_file.assert_not_called()
+        self.blockchain.db_sql.save_hash_files.assert_not_called()
+        self.blockchain.outbox.encolado.assert_called_once()
+
+    def test_cabeza_pendiente_en_outbox(self):
+        self.blockchain.db_nosql.ultimo_bloque.return_value = {'index': 7, 'hash': 'hash7', 'proof': 'proof7'}
+        self.blockchain.db_sql.ultimo_hash.return_value = False
+        self.blockchain.outbox.bloque_pendiente.return_value = True
+
+        self.blockchain.iniciar_cabeza()
+
+        # El último bloque aún no está en SQL pero sigue en el outbox: no se considera comprometido
+        self.assertEqual(self.blockchain.cabeza.obtener(), {'index': 7, 'hash': 'hash7', 'proof': 'proof7'})
+        self.blockchain.outbox.bloque_pendiente.assert_called_once_with('hash7')
+
+    def test_save_block_error_invalida_cabeza(self):
+        self.blockchain.cabeza.actualizar(4, 'hash4', 'proof4')
+        self.blockchain.hash = MagicMock(return_value='block_hash')
+        self.blockchain.db_nosql.save_block.return_value = None
+
+        with patch.object(self.blockchain, 'proof_of_authority', return_value={'proof': 'sign_proof', 'validator': 'server_pub_key'}):
+            self.blockchain.create_block('filehash', {'file_id': 1, 'nombre': 'testfile.txt'}, 'private_key')
+
+        # Si no se pudo guardar el bloque se revalida contra la BD en el siguiente
+        self.assertIsNone(self.blockchain.cabeza.obtener())
+
+    @patch('blockchain.secuenciador.time.sleep')
+    def test_create_block_conflicto_reintenta(self, sleep_mock):
+        self.blockchain.cabeza.actualizar(4, 'hash4', 'proof4')
+        self.blockchain.authentication.sign_proof = MagicMock(return_value='signed_proof_signature')
+        self.blockchain.authentication.sign_block = MagicMock(return_value='block_signature')
+        self.blockchain.db_sql.ultimo_hash.return_value = True
+
+        # Otro worker anexó el bloque 5 antes: la primera inserción es rechazada por los índices únicos
+        self.blockchain.db_nosql.save_block.side_effect = [False, 'block_id']
+        self.blockchain.db_nosql.ultimo_bloque.return_value = {'index': 5, 'hash': 'hash5', 'proof': 'proof5'}
+
+        with patch.object(self.blockchain, 'proof_of_authority', return_value={'proof': 'sign_proof', 'validator': 'server_pub_key'}):
+            result = self.blockchain.create_block('filehash', {'file_id': 1, 'nombre': 'testfile.txt'}, 'private_key')
+
+        self.assertIn('Registro agregado con suceso', result['message'])
+
+        # El bloque se reconstruyó sobre la nueva cabeza leída de la BD
+        save_block = self.blockchain.db_nosql.save_block.call_args[0][0]
+        self.assertEqual(save_block['index'], 6)
+        self.assertEqual(save_block['previous_hash'], 'hash5')
+        self.blockchain.db_sql.save_hash_file.assert_called_once()
+
+        estadisticas = self.blockchain.secuenciador.estadisticas()
+        self.assertEqual(estadisticas['anexados'], 1)
+        self.assertEqual(estadisticas['conflictos'], 1)
+
+    @patch('blockchain.secuenciador.time.sleep')
+    def test_create_block_conflicto_sin_fila_sql(self, sleep_mock):
+        self.blockchain.cabeza.actualizar(4, 'hash4', 'proof4')
+        self.blockchain.authentication.sign_proof = MagicMock(return_value='signed_proof_signature')
+        self.blockchain.authentication.sign_block = MagicMock(return_value='block_signature')
+
+        # El worker ganador aún no escribió la fila SQL del bloque 5: la cabeza recargada de la BD NoSQL es fiable
+        self.blockchain.db_sql.ultimo_hash.return_value = False
+        self.blockchain.db_nosql.save_block.side_effect = [False, 'block_id']
+        self.blockchain.db_nosql.ultimo_bloque.return_value = {'index': 5, 'hash': 'hash5', 'proof': 'proof5'}
 
+        with patch.object(self.blockchain, 'proof_of_authority', return_value={'proof': 'sign_proof', 'validator': 'server_pub_key'}):
+            result = self.blockchain.create_block('filehash', {'file_id': 1, 'nombre': 'testfile.txt'}, 'private_key')
+
+        self.assertIn('Registro agregado con suceso', result['message'])
+        self.assertEqual(self.blockchain.db_nosql.save_block.call_args[0][0]['previous_hash'], 'hash5')
+        self.blockchain.db_sql.ultimo_hash.assert_not_called()
+
+    @patch('blockchain.secuenciador.time.sleep')
+    def test_create_block_conflictos_agotados(self, sleep_mock):
+        self.blockchain.hash = MagicMock(return_value='block_hash')
         self.blockchain.db_sql.ultimo_hash.return_value = True
+        self.blockchain.db_nosql.save_block.return_value = False
 
-        result = self.blockchain.create_block('test_file_hash', {'file_id': 1, 'nombre': 'test_file'}, 'private_key')
+        with patch.object(self.blockchain, 'proof_of_authority', return_value={'proof': 'sign_proof', 'validator': 'server_pub_key'}):
+            result = self.blockchain.create_block('filehash', {'file_id': 1, 'nombre': 'testfile.txt'}, 'private_key')
 
-        self.blockchain.error_handle.manejar_error.assert_called_once()
-        self.assertEqual(result, {'detail': 'No se pudo obtener el índice del último bloque', 'status': 400})
+        self.assertIn('demasiados conflictos', result['detail'])
+        self.assertEqual(self.blockchain.db_nosql.save_block.call_count, self.blockchain.secuenciador.max_intentos)
+        self.assertEqual(self.blockchain.secuenciador.estadisticas()['agotados'], 1)
+        self.blockchain.db_sql.save_hash_file.assert_not_called()
+
+    def test_create_batch_block(self):
+        self.blockchain.cabeza.actualizar(4, 'hash4', 'proof4')
+        self.blockchain.authentication.sign_proof = MagicMock(return_value='signed_proof_signature')
+        self.blockchain.authentication.sign_block = MagicMock(return_value='block_signature')
+        self.blockchain.db_nosql.save_block.return_value = 'block_id'
+        entradas = [{'file_hash': f'hash{i}', 'metadatos': {'file_id': i, 'nombre': f'archivo{i}'}} for i in range(3)]
+
+        with patch.object(self.blockchain, 'proof_of_authority', return_value={'proof': 'sign_proof', 'validator': 'server_pub_key'}):
+            result = self.blockchain.create_batch_block(entradas, 'private_key')
+
+        # Un solo bloque firmado una vez cuyo 'data' es la raíz de Merkle de las entradas
+        self.assertIn('Registro agregado con suceso', result['message'])
+        self.blockchain.authentication.sign_block.assert_called_once()
+        block, entradas_guardadas = self.blockchain.db_nosql.save_block.call_args[0]
+        self.assertEqual(block['data'], block['merkle_root'])
+        self.assertEqual(block['merkle_root'], merkle.raiz([merkle.hoja(entrada) for entrada in entradas]))
+        self.assertEqual(block['metadatos'], {'entradas': 3})
+        self.assertEqual(entradas_guardadas, entradas)
+
+        # Una fila SQL por archivo del lote, todas en una sola llamada (una transacción)
+        self.blockchain.db_sql.save_hash_file.assert_not_called()
+        filas = self.blockchain.db_sql.save_hash_files.call_args[0][0]
+        self.assertEqual(len(filas), 3)
+        self.assertEqual(filas[2], (result['block'], 'hash2', 2, 'block_id', 'archivo2'))
+
+    def test_prueba_inclusion(self):
+        entradas = [{'file_hash': f'hash{i}', 'metadatos': {'file_id': str(i), 'nombre': f'archivo{i}'}} for i in range(5)]
+        raiz = merkle.raiz([merkle.hoja(entrada) for entrada in entradas])
+        self.blockchain.db_nosql.bloque_con_entrada.return_value = {
+            'block': {'index': 3, 'data': raiz, 'merkle_root': raiz, 'signature': b'firma'}, 'entradas': entradas}
+
+        result = self.blockchain.prueba_inclusion(file_id='3')
+
+        # La prueba permite recalcular la raíz firmada sin descargar el resto de entradas
+        self.assertEqual(result['entrada'], entradas[3])
+        self.assertTrue(merkle.verificar(result['hoja'], result['prueba'], result['block']['merkle_root']))
+        self.assertEqual(result['block']['signature'], b'firma'.hex())
+
+    def test_prueba_inclusion_raiz_del_lote(self):
+        entradas = [{'file_hash': f'hash{i}', 'metadatos': {'file_id': str(i), 'nombre': f'archivo{i}'}} for i in range(2)]
+        raiz = merkle.raiz([merkle.hoja(entrada) for entrada in entradas])
+        self.blockchain.db_nosql.bloque_con_entrada.return_value = {
+            'file_hash': raiz, 'block': {'index': 3, 'data': raiz, 'merkle_root': raiz}, 'entradas': entradas}
+
+        # Buscar por la raíz del lote encuentra el bloque pero ninguna entrada: es un "no encontrado", no un error
+        result = self.blockchain.prueba_inclusion(file_hash=raiz)
+        self.assertEqual(result['message'], 'No hay ningún bloque con ese archivo')
+
+    def test_prueba_inclusion_no_existe(self):
+        self.blockchain.db_nosql.bloque_con_entrada.return_value = None
+        result = self.blockchain.prueba_inclusion(file_hash='hash')
+        self.assertEqual(result['message'], 'No hay ningún bloque con ese archivo')
+
+    def test_cabeza_avanzar_conflicto(self):
+        cabeza = CabezaCadena()
+        cabeza.actualizar(1, 'hash1', 'proof1')
+
+        self.assertTrue(cabeza.avanzar('hash1', 2, 'hash2', 'proof2'))
+
+        # Otro bloque construido sobre hash1 llega tarde: la cabeza se invalida
+        self.assertFalse(cabeza.avanzar('hash1', 2, 'hash2b', 'proof2b'))
+        self.assertIsNone(cabeza.obtener())
+        self.assertEqual(cabeza.estadisticas()['conflictos'], 1)
 
     def test_get_previous_hash_success(self):
         self.blockchain.db_nosql.ultimo_registro.return_value = 'sbc123'
@@ -110,7 +300,60 @@ class TestBlockchain(unittest.TestCase):
         self.blockchain.authentication.sign_proof.return_value = 'sign_proof'
         result = self.blockchain.proof_of_authority('previous_proof', 'private_key')
         self.assertEqual(result['proof'], 'sign_proof')
-        self.assertEqual(result['validador'], 'server_pub_key')
+        self.assertEqual(result['validator'], 'server_pub_key')
+
+    def test_create_block_binario(self):
+        self.blockchain.codificacion = codificacion.BINARIO
+        self.blockchain.cabeza.actualizar(4, 'a' * 64, 'proof4')
+        self.blockchain.authentication.sign_proof = MagicMock(return_value='ab' * 32)
+        self.blockchain.authentication.sign_bytes = MagicMock(return_value=b'firma')
+        self.blockchain.db_nosql.save_block.return_value = 'block_id'
+
+        poa = {'proof': 'cd' * 32, 'validator': 'server_pub_key'}
+        with patch.object(self.blockchain, 'proof_of_authority', return_value=poa):
+            result = self.blockchain.create_block('b' * 64, {'file_id': 1, 'nombre': 'testfile.txt'}, 'private_key')
+
+        # Se serializa una vez: el hash y la firma se calculan sobre los mismos bytes que se guardan
+        guardado = self.blockchain.db_nosql.save_block.call_args.args[0]
+        cuerpo = guardado['cuerpo']
+        self.assertEqual(guardado['hash'], hashlib.sha256(cuerpo).hexdigest())
+        self.blockchain.authentication.sign_bytes.assert_called_once_with(cuerpo, 'private_key')
+        self.blockchain.authentication.sign_block.assert_not_called()
+        self.assertEqual(codificacion.decodificar(cuerpo)['previous_hash'], 'a' * 64)
+        self.assertEqual(result['block'], guardado['hash'])
+
+    def test_create_block_registra_algoritmo(self):
+        self.blockchain.cabeza.actualizar(4, 'hash4', 'proof4')
+        self.blockchain.authentication.sign_proof = MagicMock(return_value='signed_proof_signature')
+        self.blockchain.authentication.sign_block = MagicMock(return_value='block_signature')
+        self.blockchain.db_nosql.save_block.return_value = 'block_id'
+
+        poa = {'proof': 'sign_proof', 'validator': 'server_pub_key', 'algoritmo': 'ed25519'}
+        with patch.object(self.blockchain, 'proof_of_authority', return_value=poa):
+            self.blockchain.create_block('filehash', {'file_id': 1, 'nombre': 'testfile.txt'}, 'private_key')
+
+        # El esquema de firma queda en el bloque y forma parte de su hash
+        block = self.blockchain.db_nosql.save_block.call_args.args[0]
+        self.assertEqual(block['algoritmo'], 'ed25519')
+
+    def test_create_block_prueba_autoridad_real(self):
+        # Sin mockear la PoA ni las firmas: el bloque se construye con lo que devuelve proof_of_authority
+        private_pem = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+            encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()).decode()
+        self.blockchain.authentication = Authentication()
+        public_pem = self.blockchain.authentication.get_public_key(private_pem)
+        self.blockchain.authentication.get_server_public_key = MagicMock(return_value=public_pem)
+        self.blockchain.cabeza.actualizar(4, 'hash4', 'proof4')
+        self.blockchain.db_nosql.save_block.return_value = 'block_id'
+
+        result = self.blockchain.create_block('filehash', {'file_id': 1, 'nombre': 'testfile.txt'}, private_pem)
+
+        self.assertIn('Registro agregado con suceso', result['message'])
+        block = self.blockchain.db_nosql.save_block.call_args[0][0]
+        self.assertEqual(block['validator'], public_pem)
+        self.assertTrue(self.blockchain.authentication.verify_proof('hash4', block['proof'], public_pem))
+        self.assertTrue(self.blockchain.authentication.verify_block(block, public_pem))
 
     def test_proof_of_authority_invalid_key(self):
         self.blockchain.authentication.get_public_key.return_value = 'wrong_pub_key'
@@ -163,8 +406,11 @@ class TestBlockchain(unittest.TestCase):
             # Verificar que el bloque tenga las claves correctas
             expected_keys = [
                 'index', 'timestamp', 'data', 'previous_hash', 'metadatos',
-                'proof', 'validator', 'proof_signature', 'hash', 'signature'
+                'proof', 'validator', 'proof_signature', 'hash', 'signature', 'merkle_root'
             ]
 
             for key in expected_keys:
                 self.assertIn(key, save_block)
+
+            # Un bloque individual también lleva su única entrada y la raíz de Merkle que la cubre
+            self.assertEqual(save_block['merkle_root'], merkle.hoja({'file_hash': file_hash, 'metadatos': metadatos}))
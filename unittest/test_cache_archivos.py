@@ -0,0 +1,69 @@
+import unittest
+from database.cache_archivos import CacheArchivos, ArchivoEnMemoria
+from database.nosql_async import NosqlAsync
+
+
+class TestCacheArchivos(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = CacheArchivos()
+        self.cache.max_bytes = 100
+        self.cache.max_archivo = 60
+
+    def test_acierto_y_fallo(self):
+        self.assertIsNone(self.cache.obtener('id1'))
+        self.cache.guardar('id1', 'hash1', b'a' * 10, 'text/plain', {'sha256': 'hash1'})
+
+        archivo = self.cache.obtener('id1')
+
+        self.assertEqual(archivo.length, 10)
+        self.assertEqual(archivo.content_type, 'text/plain')
+        estadisticas = self.cache.estadisticas()
+        self.assertEqual((estadisticas['aciertos'], estadisticas['fallos'], estadisticas['bytes_ahorrados']), (1, 1, 10))
+
+    def test_expulsion_por_bytes(self):
+        self.cache.guardar('id1', 'hash1', b'a' * 40, None, {})
+        self.cache.guardar('id2', 'hash2', b'b' * 40, None, {})
+        self.cache.obtener('id1') # id1 pasa a ser el más reciente
+        self.cache.guardar('id3', 'hash3', b'c' * 40, None, {})
+
+        # Se expulsa el menos usado hasta caber en el presupuesto
+        self.assertIsNone(self.cache.obtener('id2'))
+        self.assertIsNotNone(self.cache.obtener('id1'))
+        self.assertEqual(self.cache.estadisticas()['bytes'], 80)
+        self.assertEqual(self.cache.estadisticas()['expulsiones'], 1)
+
+    def test_archivo_grande_no_se_guarda(self):
+        self.assertFalse(self.cache.admite(61))
+        self.cache.guardar('id1', 'hash1', b'a' * 61, None, {})
+
+        self.assertIsNone(self.cache.obtener('id1'))
+        self.assertEqual(self.cache.estadisticas()['bytes'], 0)
+
+    def test_contenido_compartido_e_invalidacion(self):
+        self.cache.guardar('id1', 'hash1', b'a' * 30, None, {})
+        self.cache.guardar('id2', 'hash1', b'a' * 30, None, {})
+
+        # Dos archivos con el mismo contenido ocupan una sola entrada
+        self.assertEqual(self.cache.estadisticas()['bytes'], 30)
+
+        self.cache.invalidar('id1')
+        self.assertIsNone(self.cache.obtener('id1'))
+        self.assertIsNotNone(self.cache.obtener('id2'))
+
+        # Con la última referencia borrada se libera el contenido
+        self.cache.invalidar('id2')
+        self.assertEqual(self.cache.estadisticas()['bytes'], 0)
+        self.assertEqual(self.cache.estadisticas()['contenidos'], 0)
+
+
+class TestArchivoEnMemoria(unittest.IsolatedAsyncioTestCase):
+
+    async def test_lectura_por_rango(self):
+        contenido = bytes(range(200))
+        archivo = ArchivoEnMemoria(contenido, 'application/octet-stream', {'sha256': 'hash'}, tamano_chunk=16)
+
+        partes = [parte async for parte in NosqlAsync().iter_file(archivo, 10, 99)]
+
+        self.assertEqual(b''.join(partes), contenido[10:100])
+        self.assertEqual(await NosqlAsync().hash_file(archivo), 'hash')
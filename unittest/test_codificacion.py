@@ -0,0 +1,61 @@
+import unittest
+import hashlib
+import json
+from blockchain import codificacion
+
+
+class TestCodificacion(unittest.TestCase):
+
+    def setUp(self):
+        self.block = {'index': 12,
+                      'timestamp': '2024-05-01 10:20:30.123456',
+                      'data': hashlib.sha256(b'archivo').hexdigest(),
+                      'previous_hash': hashlib.sha256(b'anterior').hexdigest(),
+                      'metadatos': {'file_id': 'abc', 'nombre': 'informe_año.pdf', 'operacion': 'upload'},
+                      'proof': 'ab' * 256,
+                      'validator': '-----BEGIN PUBLIC KEY-----\nMIIB\n-----END PUBLIC KEY-----\n',
+                      'merkle_root': hashlib.sha256(b'hoja').hexdigest(),
+                      'algoritmo': 'rsa',
+                      'proof_signature': 'cd' * 256}
+
+    def test_ida_y_vuelta(self):
+        cuerpo = codificacion.codificar(self.block)
+
+        self.assertTrue(cuerpo.startswith(codificacion.CABECERA))
+        self.assertEqual(codificacion.decodificar(cuerpo), self.block)
+
+    def test_bytes_deterministas(self):
+        # El orden de las claves del dict (y de los metadatos) no cambia los bytes
+        desordenado = dict(reversed(list(self.block.items())))
+        desordenado['metadatos'] = dict(reversed(list(self.block['metadatos'].items())))
+
+        self.assertEqual(codificacion.codificar(desordenado), codificacion.codificar(self.block))
+
+    def test_hash_no_hexadecimal(self):
+        # El previous_hash del registro génesis no tiene por qué ser un SHA-256 en hexadecimal
+        self.block['previous_hash'] = 'genesis'
+        self.block['timestamp'] = '2024-05-01 10:20:30' # str(datetime) sin microsegundos
+
+        self.assertEqual(codificacion.decodificar(codificacion.codificar(self.block)), self.block)
+
+    def test_mas_compacto_que_json(self):
+        cuerpo = codificacion.codificar(self.block)
+        self.assertLess(len(cuerpo), len(json.dumps(self.block, sort_keys=True)))
+
+    def test_compactar_y_expandir(self):
+        cuerpo = codificacion.codificar(self.block)
+        completo = dict(self.block, hash=hashlib.sha256(cuerpo).hexdigest(), signature=b'firma')
+
+        guardado = codificacion.compactar(completo, cuerpo)
+        self.assertEqual(guardado['codificacion'], codificacion.BINARIO)
+        self.assertNotIn('proof', guardado)
+
+        expandido = codificacion.expandir(guardado)
+        self.assertEqual(expandido, dict(completo, codificacion=codificacion.BINARIO, cuerpo=cuerpo))
+
+        # Los bloques en JSON se devuelven tal cual
+        self.assertIs(codificacion.expandir(self.block), self.block)
+
+    def test_cabecera_desconocida(self):
+        with self.assertRaises(ValueError):
+            codificacion.decodificar(b'XXXX')
@@ -0,0 +1,63 @@
+import unittest
+import os
+from unittest.mock import MagicMock, patch
+from database import compresion
+from database.compresion import ArchivoComprimido
+from database.nosql_async import NosqlAsync
+
+
+def configuracion(activa=True, codec='zlib'):
+    valores = {'COMPRESION_ACTIVA': activa, 'COMPRESION_CODEC': codec, 'COMPRESION_RATIO_MAX': 0.8}
+    return lambda clave, default=None, cast=None: valores.get(clave, default)
+
+
+class TestCompresion(unittest.IsolatedAsyncioTestCase):
+
+    def test_codecs_ida_y_vuelta(self):
+        datos = b'registro de auditoria ' * 500
+        for codec in compresion.CODECS:
+            comprimido = compresion.comprimir(codec, datos)
+            self.assertLess(len(comprimido), len(datos))
+            self.assertEqual(compresion.descomprimir(codec, comprimido), datos)
+
+    def test_elegir_codec(self):
+        with patch('database.compresion.config', side_effect=configuracion()):
+            self.assertEqual(compresion.elegir_codec(b'texto repetido ' * 1000), 'zlib')
+            # Contenido cifrado (aleatorio): no compensa comprimir
+            self.assertIsNone(compresion.elegir_codec(os.urandom(64 * 1024)))
+
+        with patch('database.compresion.config', side_effect=configuracion(codec='lzma')):
+            self.assertEqual(compresion.elegir_codec(b'texto repetido ' * 1000), 'lzma')
+
+        with patch('database.compresion.config', side_effect=configuracion(activa=False)):
+            self.assertIsNone(compresion.elegir_codec(b'texto repetido ' * 1000))
+
+    async def test_archivo_comprimido_rango(self):
+        contenido = bytes(range(256)) * 40
+        marco = 1000
+        marcos = [compresion.comprimir('zlib', contenido[i:i + marco]) for i in range(0, len(contenido), marco)]
+        guardado = b''.join(marcos)
+
+        # GridOut simulado sobre los bytes comprimidos
+        posicion = {'valor': 0}
+
+        async def seek(pos):
+            posicion['valor'] = pos
+
+        async def read(tamano):
+            inicio = posicion['valor']
+            posicion['valor'] += tamano
+            return guardado[inicio:inicio + tamano]
+
+        grid_out = MagicMock(seek=seek, read=read, content_type='text/plain', filename='log.txt',
+                             metadata={'sha256': 'hash', 'codec': 'zlib', 'marco': marco,
+                                       'marcos': [len(comprimido) for comprimido in marcos], 'tamaño': len(contenido)})
+        archivo = ArchivoComprimido(grid_out)
+
+        # El tamaño y los intervalos son los del contenido original
+        self.assertEqual(archivo.length, len(contenido))
+        bloques = [bloque async for bloque in NosqlAsync().iter_file(archivo, 2500, 5200)]
+        self.assertEqual(b''.join(bloques), contenido[2500:5201])
+
+        await archivo.seek(0)
+        self.assertEqual(await archivo.read(), contenido)
@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import connection
+from connection import Connection, EstadisticasPool
+
+
+class TestConnection(unittest.TestCase):
+
+    def setUp(self):
+        # Cada prueba empieza sin cliente compartido
+        connection._cliente_nosql = None
+        self.conexion = Connection()
+        self.conexion.error_handle = MagicMock()
+
+    def tearDown(self):
+        connection._cliente_nosql = None
+
+    @patch('connection.config', side_effect=lambda clave, default=None, cast=None: default if default is not None else '27017')
+    @patch('connection.MongoClient')
+    def test_connection_nosql_reutiliza_cliente(self, mongo_mock, config_mock):
+        primero = self.conexion.connection_nosql()
+        segundo = Connection().connection_nosql()
+
+        # El cliente se crea una sola vez y se comparte entre instancias
+        mongo_mock.assert_called_once()
+        self.assertIs(primero, segundo)
+        self.assertEqual(mongo_mock.call_args.kwargs['maxPoolSize'], 50)
+
+    @patch('connection.config', side_effect=lambda clave, default=None, cast=None: default if default is not None else '27017')
+    @patch('connection.MongoClient')
+    def test_cerrar_nosql(self, mongo_mock, config_mock):
+        cliente = self.conexion.iniciar_nosql()
+        self.conexion.cerrar_nosql()
+
+        cliente.close.assert_called_once()
+        self.assertIsNone(connection._cliente_nosql)
+
+    def test_sesion_sql_devuelve_conexion_con_error(self):
+        conn_mock = MagicMock()
+        self.conexion.connection_sql = MagicMock(return_value=conn_mock)
+        semaforo = self.conexion.semaforo_sql()
+
+        with self.assertRaises(RuntimeError):
+            with self.conexion.sesion_sql() as (conn, cursor):
+                raise RuntimeError('fallo en la consulta')
+
+        # El cursor se cierra, la conexión vuelve al pool y el permiso se libera
+        conn_mock.cursor.return_value.close.assert_called_once()
+        conn_mock.close.assert_called_once()
+        self.assertTrue(semaforo.acquire(blocking=False))
+        semaforo.release()
+        self.assertEqual(self.conexion.estadisticas_sql()['prestadas'], 0)
+
+    def test_cerrar_sql_desconecta_el_pool(self):
+        conexiones = [MagicMock(), MagicMock()]
+        pool = MagicMock(pool_size=3)
+        pool.get_connection.side_effect = conexiones + [connection.mysql.connector.errors.PoolError('pool exhausted')]
+        connection._pool_sql = pool
+        semaforo = self.conexion.semaforo_sql()
+
+        self.conexion.cerrar_sql()
+
+        # Cada conexión del pool se desconecta (no se devuelve) y los permisos quedan libres
+        for conn in conexiones:
+            conn.disconnect.assert_called_once()
+            conn.close.assert_not_called()
+        self.assertIsNone(connection._pool_sql)
+        self.assertTrue(semaforo.acquire(blocking=False))
+        semaforo.release()
+
+    def test_estadisticas_pool(self):
+        estadisticas = EstadisticasPool()
+
+        # Simulamos dos préstamos, una devolución y un fallo
+        estadisticas.connection_check_out_started(MagicMock())
+        estadisticas.connection_checked_out(MagicMock(duration=0.002))
+        estadisticas.connection_check_out_started(MagicMock())
+        estadisticas.connection_checked_out(MagicMock(duration=0.004))
+        estadisticas.connection_checked_in(MagicMock())
+        estadisticas.connection_check_out_started(MagicMock())
+        estadisticas.connection_check_out_failed(MagicMock())
+
+        resumen = estadisticas.resumen()
+        self.assertEqual(resumen['prestadas'], 1)
+        self.assertEqual(resumen['esperando'], 0)
+        self.assertEqual(resumen['prestamos'], 2)
+        self.assertEqual(resumen['fallos'], 1)
+        self.assertAlmostEqual(resumen['espera_media_ms'], 3.0)
+        self.assertAlmostEqual(resumen['espera_max_ms'], 4.0)
@@ -50,6 +50,35 @@ class TestDatabase(unittest.TestCase):
         self.cursor_mock.callproc.assert_called_once_with('registro', ['hash_block', 'hash_file', 1, 2, 'file_name'])
         self.conecction_mock.commit.assert_called_once()
 
+    def test_save_hash_files(self):
+        filas = [('hash_block', f'hash_file{i}', i, 2, f'file{i}') for i in range(3)]
+
+        self.sql.save_hash_files(filas)
+
+        # Todas las filas en una sola llamada y un único commit
+        self.cursor_mock.executemany.assert_called_once_with('CALL registro(%s, %s, %s, %s, %s)', filas)
+        self.cursor_mock.callproc.assert_not_called()
+        self.conecction_mock.commit.assert_called_once()
+
+    def test_save_hash_files_rollback(self):
+        self.cursor_mock.executemany.side_effect = Exception('Database error')
+
+        self.sql.save_hash_files([('hash_block', 'hash_file', 1, 2, 'file')])
+
+        # Si falla una fila se deshace el lote completo
+        self.conecction_mock.rollback.assert_called_once()
+        self.conecction_mock.commit.assert_not_called()
+        self.sql.error_handle.manejar_error.assert_called_once()
+
+    def test_bloques_registrados(self):
+        self.cursor_mock.fetchone.return_value = (1, 0)
+
+        result = self.sql.bloques_registrados(['hash1', 'hash2', 'hash1'])
+
+        # Un solo viaje al servidor para todo el lote
+        self.assertEqual(result, {'hash1'})
+        self.cursor_mock.execute.assert_called_once_with('SELECT hash_exists(%s), hash_exists(%s);', ('hash1', 'hash2'))
+
     def test_ultimo_hash_exists(self):
         # Mockear el cursor y simular el comportamiento de 'fetchone'
         self.cursor_mock.callproc.return_value = (1, ) # Simular que la función 'hash_exists' devuelve 1 (True)
@@ -61,6 +90,16 @@ class TestDatabase(unittest.TestCase):
         self.assertTrue(result)
         self.cursor_mock.execute.assert_called_once_with('SELECT hash_exists(%s);', ('previous_hash',))
 
+    def test_ultimo_hash_devuelve_conexion(self):
+        self.cursor_mock.fetchone.return_value = (0, )
+
+        result = self.sql.ultimo_hash('previous_hash')
+
+        # La conexión vuelve al pool y el cursor se cierra aunque no se haga commit
+        self.assertFalse(result)
+        self.cursor_mock.close.assert_called_once()
+        self.conecction_mock.close.assert_called_once()
+
     def test_file_exists(self):
         # Mokear el cursor y simular que 'fetchone' devuelve (1, )
         self.cursor_mock.fetchone.return_value = (1, ) # Simular que el archivo existe
@@ -137,15 +176,68 @@ class TestDatabase(unittest.TestCase):
         self.collection_mock.insert_one.assert_called_once_with({ 'name': self.mock_block['index'], 'file_hash': self.mock_block['data'],
                                                              'block': self.mock_block, 'enable': True })
 
+    def test_iterar_bloques(self):
+        documentos = [{'block': {'index': 3}}, {'block': {'index': 4}}]
+        self.collection_mock.find.return_value.sort.return_value.batch_size.return_value = iter(documentos)
+
+        result = list(self.nosql.iterar_bloques(2, 500))
+
+        # Recorre la cadena en orden de índice a partir del indicado, por lotes del cursor
+        self.assertEqual(result, documentos)
+        self.collection_mock.find.assert_called_once_with({'name': {'$gt': 2}}, {'block': 1, 'entradas': 1})
+        self.collection_mock.find.return_value.sort.assert_called_once_with('name', 1)
+        self.collection_mock.find.return_value.sort.return_value.batch_size.assert_called_once_with(500)
+
+    def test_reclamar_eventos(self):
+        reclamados = [{'_id': 1, 'estado': 'sellando'}]
+        self.collection_mock.find.return_value.sort.return_value.limit.return_value = [{'_id': 1}, {'_id': 2}]
+        self.collection_mock.find.return_value.sort.side_effect = [self.collection_mock.find.return_value.sort.return_value,
+                                                                   reclamados]
+
+        result = self.nosql.reclamar_eventos(10, 'worker_a', 60)
+
+        # Solo se devuelven los eventos que este worker consiguió marcar (el otro lo reclamó otro worker)
+        self.assertEqual(result, reclamados)
+        filtro, cambios = self.collection_mock.update_many.call_args[0]
+        self.assertEqual(filtro['_id'], {'$in': [1, 2]})
+        self.assertIn({'estado': 'pendiente'}, filtro['$or'])
+        self.assertEqual(cambios['$set']['estado'], 'sellando')
+        self.assertEqual(cambios['$set']['propietario'], 'worker_a')
+        self.assertEqual(self.collection_mock.find.call_args[0][0], {'lote': cambios['$set']['lote']})
+
+    def test_reclamar_pendientes_sql(self):
+        reclamados = [{'_id': 1, 'block': {'hash': 'hash1'}}]
+        self.collection_mock.find.return_value.sort.return_value.limit.return_value = [{'_id': 1}, {'_id': 2}]
+        self.collection_mock.find.return_value.sort.side_effect = [self.collection_mock.find.return_value.sort.return_value,
+                                                                   reclamados]
+
+        result = self.nosql.reclamar_pendientes_sql(500, 'worker_a', 60)
+
+        # Solo se devuelven los bloques que este worker consiguió reservar
+        self.assertEqual(result, reclamados)
+        filtro, cambios = self.collection_mock.update_many.call_args[0]
+        self.assertEqual(filtro['_id'], {'$in': [1, 2]})
+        self.assertEqual(filtro['pendiente_sql'], {'$exists': True})
+        self.assertIn({'outbox_concesion': {'$exists': False}}, filtro['$or'])
+        self.assertEqual(cambios['$set']['outbox_propietario'], 'worker_a')
+        self.assertEqual(self.collection_mock.find.call_args[0][0], {'outbox_lote': cambios['$set']['outbox_lote']})
+
+    def test_marcar_registrados_sql_solo_propios(self):
+        self.assertTrue(self.nosql.marcar_registrados_sql([1, 2], 'worker_a'))
+
+        filtro, cambios = self.collection_mock.update_many.call_args[0]
+        self.assertEqual(filtro, {'_id': {'$in': [1, 2]}, 'outbox_propietario': 'worker_a'})
+        self.assertIn('pendiente_sql', cambios['$unset'])
+
     def test_get_last_index_success(self):
 
         # Verificamos que find_one devuelve un bloque válido, retorna el índice correcto
-        self.collection_mock.find_one.return_value = {'index': 1}
+        self.collection_mock.find_one.return_value = {'name': 1, 'block': {'index': 1}}
 
         resutl = self.nosql.get_last_index()
 
         self.collection_mock.find_one.assert_called_once()
-        self.collection_mock.find_one.assert_called_once_with({}, sort=[('index', -1)])
+        self.collection_mock.find_one.assert_called_once_with({}, {'name': 1}, sort=[('name', -1)])
         self.assertEqual(resutl, (1))
 
     def test_get_last_index_none(self):
@@ -0,0 +1,37 @@
+import io
+import unittest
+import zipfile
+from unittest.mock import MagicMock
+from services.empaquetador import generar_zip
+
+
+class TestEmpaquetador(unittest.IsolatedAsyncioTestCase):
+
+    def archivo(self, contenido, chunk_size):
+        return MagicMock(length=len(contenido), chunks=[contenido[i:i + chunk_size] for i in range(0, len(contenido), chunk_size)])
+
+    async def iter_file(self, file_obj):
+        for chunk in file_obj.chunks:
+            yield chunk
+
+    async def test_generar_zip(self):
+        archivos = [('a.txt', self.archivo(b'hola mundo' * 100, 64)), ('b.bin', self.archivo(bytes(range(256)), 50)),
+                    ('vacio.txt', self.archivo(b'', 10))]
+
+        partes = [parte async for parte in generar_zip(archivos, self.iter_file)]
+
+        # Se envía por partes y el resultado es un zip válido con el contenido original
+        self.assertGreater(len(partes), len(archivos))
+        with zipfile.ZipFile(io.BytesIO(b''.join(partes))) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.namelist(), ['a.txt', 'b.bin', 'vacio.txt'])
+            self.assertEqual(zip_file.read('a.txt'), b'hola mundo' * 100)
+            self.assertEqual(zip_file.read('b.bin'), bytes(range(256)))
+            self.assertEqual(zip_file.read('vacio.txt'), b'')
+
+    async def test_partes_acotadas(self):
+        contenido = bytes(1000) * 64
+        partes = [parte async for parte in generar_zip([('grande.bin', self.archivo(contenido, 1000))], self.iter_file)]
+
+        # Ninguna parte acumula más que un chunk y las cabeceras
+        self.assertLess(max(len(parte) for parte in partes), 1200)
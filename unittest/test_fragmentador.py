@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+import hashlib
+import random
+from database.fragmentador import Fragmentador, cerrar_pool, hash_manifiesto
+
+
+class TestFragmentador(unittest.TestCase):
+
+    def setUp(self):
+        aleatorio = random.Random(7)
+        self.datos = bytes(aleatorio.getrandbits(8) for _ in range(400 * 1024))
+
+    def trocear(self, datos, tamano_lectura):
+        fragmentador = Fragmentador(2 * 1024, 8 * 1024, 32 * 1024)
+        fragmentos = []
+        for inicio in range(0, len(datos), tamano_lectura):
+            fragmentos += fragmentador.agregar(datos[inicio:inicio + tamano_lectura])
+        return fragmentos + fragmentador.terminar()
+
+    def test_reconstruye_y_respeta_limites(self):
+        fragmentos = self.trocear(self.datos, 10000)
+
+        self.assertEqual(b''.join(fragmentos), self.datos)
+        self.assertTrue(all(2 * 1024 <= len(fragmento) <= 32 * 1024 for fragmento in fragmentos[:-1]))
+
+    def test_tamano_medio(self):
+        # Con datos aleatorios el tamaño medio de los fragmentos se acerca a 'medio' (8 KB), no a minimo + potencia de dos
+        fragmentos = self.trocear(self.datos, 64 * 1024)[:-1]
+        media = sum(len(fragmento) for fragmento in fragmentos) / len(fragmentos)
+        self.assertTrue(6.5 * 1024 <= media <= 9.5 * 1024, media)
+
+    def test_cortes_independientes_de_la_lectura(self):
+        # Los cortes dependen del contenido, no del tamaño de los bloques recibidos
+        self.assertEqual(self.trocear(self.datos, 1000), self.trocear(self.datos, 64 * 1024))
+
+    def test_version_con_insercion(self):
+        # Insertar unos bytes en medio solo cambia los fragmentos cercanos
+        version = self.datos[:200 * 1024] + b'cambio en la version 2' + self.datos[200 * 1024:]
+        originales = {hashlib.sha256(fragmento).hexdigest() for fragmento in self.trocear(self.datos, 4096)}
+        nuevos = [fragmento for fragmento in self.trocear(version, 4096)
+                  if hashlib.sha256(fragmento).hexdigest() not in originales]
+
+        self.assertLessEqual(sum(len(fragmento) for fragmento in nuevos), 3 * 32 * 1024)
+
+    def test_cortes_en_proceso(self):
+        # Los mismos fragmentos buscando los cortes en el pool de procesos
+        async def trocear():
+            fragmentador = Fragmentador(2 * 1024, 8 * 1024, 32 * 1024)
+            fragmentos = []
+            for inicio in range(0, len(self.datos), 100 * 1024):
+                fragmentos += await fragmentador.agregar_en_proceso(self.datos[inicio:inicio + 100 * 1024])
+            return fragmentos + fragmentador.terminar()
+
+        try:
+            self.assertEqual(asyncio.run(trocear()), self.trocear(self.datos, 100 * 1024))
+        finally:
+            cerrar_pool()
+
+    def test_hash_manifiesto(self):
+        manifiesto = [['a' * 64, 10], ['b' * 64, 20]]
+        self.assertEqual(hash_manifiesto(manifiesto), hash_manifiesto([list(entrada) for entrada in manifiesto]))
+        self.assertNotEqual(hash_manifiesto(manifiesto), hash_manifiesto(manifiesto[::-1]))
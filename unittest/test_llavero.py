@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+from unittest.mock import patch
+from security.llavero import Llavero
+
+
+class TestLlavero(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.private_pem = private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                    format=serialization.PrivateFormat.PKCS8,
+                                                    encryption_algorithm=serialization.NoEncryption()).decode()
+        cls.public_pem = private_key.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                                               format=serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+
+    def setUp(self):
+        self.llavero = Llavero()
+
+    def test_privada_se_parsea_una_vez(self):
+        with patch('security.llavero.serialization.load_pem_private_key',
+                   wraps=serialization.load_pem_private_key) as load_mock:
+            primera = self.llavero.privada(self.private_pem)
+            segunda = self.llavero.privada(self.private_pem)
+            public_pem = self.llavero.publica_de(self.private_pem)
+
+        # La clave y su pública derivada salen de la caché después de la primera vez
+        load_mock.assert_called_once()
+        self.assertIs(primera, segunda)
+        self.assertEqual(public_pem, self.public_pem)
+        self.assertEqual(self.llavero.estadisticas()['aciertos'], 2)
+
+    def test_privada_objeto(self):
+        clave = self.llavero.privada(self.private_pem)
+        self.assertIs(self.llavero.privada(clave), clave)
+
+    def test_privada_invalida_no_se_guarda(self):
+        with self.assertRaises(ValueError):
+            self.llavero.privada('clave inválida')
+        self.assertEqual(self.llavero.estadisticas()['claves_privadas'], 0)
+
+    def test_limite_de_claves(self):
+        self.llavero.max_claves = 1
+        otra = rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key().public_bytes(
+            encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+
+        self.llavero.publica(self.public_pem)
+        self.llavero.publica(otra)
+
+        # Solo queda la clave usada más recientemente
+        self.assertEqual(self.llavero.estadisticas()['claves_publicas'], 1)
+        self.assertIn(self.llavero.huella(otra), self.llavero._publicas)
+
+    def test_clave_servidor_y_recarga(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'server_public_key.pem')
+            with open(ruta, 'w') as file:
+                file.write('clave 1')
+            self.llavero.ruta_servidor = ruta
+
+            self.assertEqual(self.llavero.clave_servidor(), 'clave 1')
+
+            # Dentro del intervalo de revisión se usa la cacheada sin mirar el archivo
+            with open(ruta, 'w') as file:
+                file.write('clave 2')
+            self.assertEqual(self.llavero.clave_servidor(), 'clave 1')
+
+            self.llavero.recargar()
+            self.assertEqual(self.llavero.clave_servidor(), 'clave 2')
+            self.assertEqual(self.llavero.estadisticas()['recargas'], 1)
+
+    def test_clave_servidor_rotada_sin_reiniciar(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'server_public_key.pem')
+            with open(ruta, 'w') as file:
+                file.write('clave 1')
+            os.utime(ruta, ns=(1_000_000_000, 1_000_000_000))
+            self.llavero.ruta_servidor = ruta
+            self.llavero.revision = 0
+
+            self.assertEqual(self.llavero.clave_servidor(), 'clave 1')
+
+            # La clave se rota en disco: el siguiente uso detecta la nueva fecha y la vuelve a leer
+            with open(ruta, 'w') as file:
+                file.write('clave 2')
+            os.utime(ruta, ns=(2_000_000_000, 2_000_000_000))
+
+            self.assertEqual(self.llavero.clave_servidor(), 'clave 2')
+            self.assertEqual(self.llavero.estadisticas()['recargas'], 1)
+
+            # Sin cambios en el archivo no se vuelve a leer
+            with patch('builtins.open', side_effect=AssertionError('no debería leerse')):
+                self.assertEqual(self.llavero.clave_servidor(), 'clave 2')
@@ -0,0 +1,153 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock, mock_open, patch
+from blockchain.mempool import Mempool
+from security.authentication import Authentication
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+
+
+class TestMempool(unittest.TestCase):
+
+    def setUp(self):
+        self.mempool = Mempool()
+        self.mempool.activo = True
+        self.mempool.tamano_lote = 2
+        self.mempool.db_nosql = MagicMock()
+        self.mempool.blockchain = MagicMock()
+        self.mempool.blockchain.authentication.get_public_key.side_effect = lambda clave: f'publica_de_{clave}'
+        self.mempool.blockchain.authentication.get_server_public_key.return_value = 'publica_de_clave_privada'
+        self.mempool.error_handle = MagicMock()
+
+    def eventos(self, *ids):
+        return [{'_id': i, 'file_hash': f'hash{i}', 'metadatos': {'nombre': f'archivo{i}', 'file_id': str(i)}} for i in ids]
+
+    def test_sellar_por_lotes(self):
+        self.mempool.autorizar('clave_privada')
+        self.mempool.db_nosql.reclamar_eventos.side_effect = [self.eventos(1, 2), self.eventos(3), []]
+        self.mempool.blockchain.create_batch_block.side_effect = [{'block': 'bloque_a'}, {'block': 'bloque_b'}]
+
+        self.mempool.sellar()
+
+        # Dos bloques: uno con el lote completo y otro con el evento restante
+        self.assertEqual(self.mempool.blockchain.create_batch_block.call_count, 2)
+        entradas, clave = self.mempool.blockchain.create_batch_block.call_args_list[0][0]
+        self.assertEqual([entrada['evento_id'] for entrada in entradas], ['1', '2'])
+        self.assertEqual(clave, 'clave_privada')
+        self.mempool.db_nosql.marcar_sellados.assert_any_call([1, 2], 'bloque_a')
+        self.mempool.db_nosql.marcar_sellados.assert_any_call([3], 'bloque_b')
+        self.assertEqual(self.mempool.estadisticas()['eventos_sellados'], 3)
+
+    def test_sellar_error_deja_pendientes(self):
+        self.mempool.autorizar('clave_privada')
+        self.mempool.db_nosql.reclamar_eventos.return_value = self.eventos(1)
+        self.mempool.blockchain.create_batch_block.return_value = {'status': 500, 'detail': 'error'}
+
+        self.mempool.sellar()
+
+        self.mempool.db_nosql.marcar_sellados.assert_not_called()
+        self.mempool.db_nosql.liberar_eventos.assert_called_once_with([1], self.mempool.propietario)
+        self.assertEqual(self.mempool.lotes, 0)
+
+    def test_clave_que_no_es_del_servidor(self):
+        self.mempool.autorizar('clave_privada')
+
+        # Otra clave se rechaza y no sustituye a la del servidor para firmar los lotes
+        self.assertFalse(self.mempool.autorizar('otra_clave'))
+        self.assertEqual(self.mempool._clave, 'clave_privada')
+
+        self.mempool.db_nosql.reclamar_eventos.side_effect = [self.eventos(1), []]
+        self.mempool.blockchain.create_batch_block.return_value = {'block': 'bloque_a'}
+        self.mempool.sellar()
+        self.assertEqual(self.mempool.blockchain.create_batch_block.call_args[0][1], 'clave_privada')
+
+    def test_clave_ajena_real(self):
+        # Con claves RSA reales: solo la que corresponde a la clave pública del servidor queda autorizada
+        servidor, ajena = [rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+            encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()).decode() for _ in range(2)]
+        authentication = Authentication()
+        authentication.get_server_public_key = MagicMock(return_value=authentication.get_public_key(servidor))
+        self.mempool.blockchain.authentication = authentication
+
+        self.assertFalse(self.mempool.autorizar(ajena))
+        self.assertIsNone(self.mempool._clave)
+        self.assertTrue(self.mempool.autorizar(servidor))
+        self.assertEqual(self.mempool._clave, servidor)
+
+    def test_iniciar_con_clave_ajena(self):
+        self.mempool.ruta_clave = 'clave_servidor.pem'
+        self.mempool.db_nosql.eventos_pendientes.return_value = []
+        self.mempool.ciclo = MagicMock()
+
+        with patch('builtins.open', mock_open(read_data='otra_clave')):
+            self.mempool.iniciar()
+        self.mempool.detener()
+
+        self.assertIsNone(self.mempool._clave)
+        self.mempool.error_handle.manejar_error.assert_called_once()
+
+    def test_sellar_sin_clave(self):
+        # Hasta que llegue un evento no hay clave del servidor con la que firmar
+        self.mempool.sellar()
+        self.mempool.db_nosql.reclamar_eventos.assert_not_called()
+
+    def test_sellar_reclama_eventos(self):
+        self.mempool.autorizar('clave_privada')
+        self.mempool.db_nosql.reclamar_eventos.side_effect = [self.eventos(1), []]
+        self.mempool.blockchain.create_batch_block.return_value = {'block': 'bloque_a'}
+
+        self.mempool.sellar()
+
+        # Los eventos se reclaman a nombre de este worker con su concesión
+        self.mempool.db_nosql.reclamar_eventos.assert_called_with(2, self.mempool.propietario, self.mempool.concesion)
+        self.mempool.db_nosql.eventos_pendientes.assert_not_called()
+
+    def test_sellar_evento_reclamado_ya_en_bloque(self):
+        self.mempool.autorizar('clave_privada')
+        eventos = self.eventos(1, 2)
+        eventos[0]['intentos'] = 2 # El worker que lo reclamó antes cayó tras guardar el bloque
+        self.mempool.db_nosql.reclamar_eventos.side_effect = [eventos, []]
+        self.mempool.db_nosql.eventos_en_bloques.return_value = {'1': 'bloque_a'}
+        self.mempool.blockchain.create_batch_block.return_value = {'block': 'bloque_b'}
+
+        self.mempool.sellar()
+
+        self.mempool.db_nosql.eventos_en_bloques.assert_called_once_with([1])
+        self.mempool.db_nosql.marcar_sellados.assert_any_call([1], 'bloque_a')
+        entradas, _ = self.mempool.blockchain.create_batch_block.call_args[0]
+        self.assertEqual([entrada['evento_id'] for entrada in entradas], ['2'])
+
+    def test_iniciar_con_clave_configurada(self):
+        self.mempool.ruta_clave = 'clave_servidor.pem'
+        self.mempool.db_nosql.eventos_pendientes.return_value = []
+        self.mempool.ciclo = MagicMock()
+
+        with patch('builtins.open', mock_open(read_data='clave_privada')):
+            self.mempool.iniciar()
+        self.mempool.detener()
+
+        # Los eventos recuperados se pueden sellar sin esperar a que una petición aporte la clave
+        self.assertEqual(self.mempool._clave, 'clave_privada')
+
+    def test_espera_resuelta_al_sellar(self):
+        async def prueba():
+            self.mempool.autorizar('clave_privada')
+            future = self.mempool.nuevo_evento(1, asyncio.get_running_loop())
+            self.mempool.db_nosql.reclamar_eventos.side_effect = [self.eventos(1), []]
+            self.mempool.blockchain.create_batch_block.return_value = {'block': 'bloque_a'}
+
+            await asyncio.get_running_loop().run_in_executor(None, self.mempool.sellar)
+            return await asyncio.wait_for(future, 1)
+
+        self.assertEqual(asyncio.run(prueba()), 'bloque_a')
+        self.assertEqual(self.mempool.estadisticas()['esperando'], 0)
+
+    def test_recuperar_eventos_ya_sellados(self):
+        self.mempool.db_nosql.eventos_pendientes.return_value = self.eventos(1, 2)
+        self.mempool.db_nosql.eventos_en_bloques.return_value = {'1': 'bloque_a'}
+
+        self.mempool.recuperar()
+
+        self.mempool.db_nosql.marcar_sellados.assert_called_once_with([1], 'bloque_a')
+        self.assertEqual(self.mempool.estadisticas()['pendientes'], 1)
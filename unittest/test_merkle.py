@@ -0,0 +1,48 @@
+import unittest
+import hashlib
+from blockchain import merkle
+
+
+class TestMerkle(unittest.TestCase):
+
+    def setUp(self):
+        self.entradas = [{'file_hash': f'hash{i}', 'metadatos': {'nombre': f'archivo{i}.enc', 'file_id': str(i)}}
+                         for i in range(5)]
+        self.hojas = [merkle.hoja(entrada) for entrada in self.entradas]
+
+    def test_hoja_depende_de_los_metadatos(self):
+        modificada = dict(self.entradas[0], metadatos={'nombre': 'otro.enc', 'file_id': '0'})
+        self.assertNotEqual(merkle.hoja(modificada), self.hojas[0])
+
+    def test_raiz_una_hoja(self):
+        self.assertEqual(merkle.raiz(self.hojas[:1]), self.hojas[0])
+        self.assertIsNone(merkle.raiz([]))
+
+    def test_raiz_impar(self):
+        # Con cinco hojas la última sube sin combinarse hasta el nivel superior
+        h = self.hojas
+        esperado = merkle.nodo(merkle.nodo(merkle.nodo(h[0], h[1]), merkle.nodo(h[2], h[3])), h[4])
+        self.assertEqual(merkle.raiz(h), esperado)
+
+    def test_nodo_con_prefijo(self):
+        izquierda, derecha = self.hojas[0], self.hojas[1]
+        esperado = hashlib.sha256(b'\x01' + bytes.fromhex(izquierda) + bytes.fromhex(derecha)).hexdigest()
+        self.assertEqual(merkle.nodo(izquierda, derecha), esperado)
+
+    def test_raiz_cambia_con_el_orden(self):
+        self.assertNotEqual(merkle.raiz(self.hojas), merkle.raiz(list(reversed(self.hojas))))
+
+    def test_prueba_todas_las_hojas(self):
+        # La prueba de cada hoja recalcula la raíz, también con un número impar de hojas
+        for cantidad in (1, 2, 5, 8, 13):
+            hojas = self.hojas[:cantidad] if cantidad <= 5 else [merkle.hoja({'file_hash': str(i), 'metadatos': {}}) for i in range(cantidad)]
+            raiz = merkle.raiz(hojas)
+            for posicion, hoja in enumerate(hojas):
+                camino = merkle.prueba(hojas, posicion)
+                self.assertTrue(merkle.verificar(hoja, camino, raiz))
+                self.assertLessEqual(len(camino), cantidad.bit_length())
+
+    def test_prueba_hoja_incorrecta(self):
+        raiz = merkle.raiz(self.hojas)
+        camino = merkle.prueba(self.hojas, 2)
+        self.assertFalse(merkle.verificar(self.hojas[3], camino, raiz))
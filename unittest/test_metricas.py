@@ -0,0 +1,87 @@
+import unittest
+import mysql.connector
+from types import SimpleNamespace
+import metricas
+from error_handler import Errores
+
+
+class TestMetricas(unittest.TestCase):
+
+    def test_histograma(self):
+        histograma = metricas.Histograma('prueba_segundos', 'Ayuda', ('etapa',), limites=(0.1, 1))
+        histograma.observar(('firma',), 0.05)
+        histograma.observar(('firma',), 0.1)
+        histograma.observar(('firma',), 5)
+
+        lineas = histograma.exponer()
+
+        # Los intervalos son acumulados y el último (+Inf) coincide con el total
+        self.assertIn('# TYPE prueba_segundos histogram', lineas)
+        self.assertIn('prueba_segundos_bucket{etapa="firma",le="0.1"} 2', lineas)
+        self.assertIn('prueba_segundos_bucket{etapa="firma",le="1"} 2', lineas)
+        self.assertIn('prueba_segundos_bucket{etapa="firma",le="+Inf"} 3', lineas)
+        self.assertIn('prueba_segundos_count{etapa="firma"} 3', lineas)
+        self.assertIn('prueba_segundos_sum{etapa="firma"} 5.15', lineas)
+
+    def test_contador_escapa_etiquetas(self):
+        contador = metricas.Contador('prueba_total', 'Ayuda', ('ruta',))
+        contador.incrementar(('/a"b',), 2)
+        contador.incrementar()
+
+        lineas = contador.exponer()
+
+        self.assertIn('prueba_total 1', lineas)
+        self.assertIn('prueba_total{ruta="/a\\"b"} 2', lineas)
+
+    def test_medir(self):
+        antes = metricas.etapas._series.get(('prueba',), [[0], 0.0])[0][:]
+        with self.assertRaises(ValueError):
+            with metricas.medir('prueba'):
+                raise ValueError('fallo')
+
+        # La duración se registra también cuando la etapa falla
+        self.assertEqual(sum(metricas.etapas._series[('prueba',)][0]), sum(antes) + 1)
+
+    def test_errores_por_categoria(self):
+        errores = Errores()
+        antes = dict(metricas.errores._valores)
+
+        errores.manejar_error(ValueError('valor'), levantar=False)
+        errores.manejar_error(mysql.connector.Error('sql'), levantar=False)
+        with self.assertRaises(Exception) as contexto:
+            errores.manejar_error(Exception('general'))
+
+        # La HTTPException relanzada por la ruta no se vuelve a contar
+        errores.manejar_error(contexto.exception, levantar=False)
+        for categoria in ('valor', 'sql', 'general'):
+            self.assertEqual(metricas.errores._valores[(categoria,)], antes.get((categoria,), 0) + 1)
+
+    def test_indicadores(self):
+        lineas = metricas.indicadores({'archivos': {'bytes': 10, 'tasa_acierto': 0.5, 'activo': True, 'nombre': 'x',
+                                                    'hilos': {'tamaño': 3}}})
+
+        self.assertIn('blockvault_archivos_bytes 10', lineas)
+        self.assertIn('blockvault_archivos_tasa_acierto 0.5', lineas)
+        self.assertIn('blockvault_archivos_activo 1', lineas)
+        self.assertIn('blockvault_archivos_hilos_tamano 3', lineas)
+        self.assertFalse(any('nombre' in linea for linea in lineas))
+
+
+class TestMedidorPeticiones(unittest.IsolatedAsyncioTestCase):
+
+    async def test_peticion_por_plantilla_de_ruta(self):
+        async def aplicacion(scope, receive, send):
+            scope['route'] = SimpleNamespace(path='/uploadsession/{sesion_id}')
+            await send({'type': 'http.response.start', 'status': 404})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        enviados = []
+
+        async def send(mensaje):
+            enviados.append(mensaje)
+
+        medidor = metricas.MedidorPeticiones(aplicacion)
+        await medidor({'type': 'http', 'method': 'PUT'}, None, send)
+
+        self.assertEqual(len(enviados), 2)
+        self.assertIn(('/uploadsession/{sesion_id}', 'PUT', '404'), metricas.peticiones._series)
@@ -0,0 +1,466 @@
+import datetime
+import threading
+import unittest
+import hashlib
+from unittest.mock import AsyncMock, MagicMock, patch
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from database.nosql_async import NosqlAsync, ArchivoFragmentado
+from database import fragmentador
+
+
+class CursorAsync:
+    # Cursor asíncrono simulado sobre una lista de documentos
+    def __init__(self, documentos):
+        self.documentos = iter(documentos)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.documentos)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class TestNosqlAsync(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.nosql = NosqlAsync()
+        self.nosql.error_handle = MagicMock()
+        self.nosql.conect.connection_nosql_async = MagicMock()
+
+        # GridFS asíncrono simulado: todos sus métodos son corrutinas
+        self.fs_mock = AsyncMock()
+        self.gridfs_patch = patch('database.nosql_async.AsyncGridFS', return_value=self.fs_mock)
+        self.gridfs_patch.start()
+
+        # Colecciones del almacén por contenido: sin referencias ni blobs salvo que la prueba los defina
+        self.colecciones = {'referencias': AsyncMock(), 'blobs': AsyncMock(), 'chunks': AsyncMock(), 'fs.files': MagicMock(),
+                            'manifiestos': AsyncMock()}
+        self.colecciones['fs.files'].find = MagicMock(side_effect=lambda *args, **kwargs: CursorAsync([]))
+        self.colecciones['referencias'].find_one.return_value = None
+        self.colecciones['referencias'].find_one_and_delete.return_value = None
+        self.colecciones['blobs'].find_one_and_update.return_value = None
+        db_mock = MagicMock()
+        db_mock.__getitem__.side_effect = lambda nombre: self.colecciones[nombre]
+        self.nosql.conect.connection_nosql_async.return_value.__getitem__.return_value = db_mock
+
+    def tearDown(self):
+        self.gridfs_patch.stop()
+
+    def archivo_subido(self, contenido, tamano_lectura):
+        # Simula un UploadFile (en disco local) que entrega el contenido por bloques y se puede rebobinar
+        posicion = {'valor': 0}
+
+        async def read(tamano):
+            inicio = posicion['valor']
+            posicion['valor'] = min(inicio + tamano, len(contenido))
+            return contenido[inicio:posicion['valor']]
+
+        async def seek(pos):
+            posicion['valor'] = pos
+
+        return MagicMock(read=AsyncMock(side_effect=read), seek=AsyncMock(side_effect=seek))
+
+    @patch('database.nosql_async.config', side_effect=lambda clave, default=None, cast=None: 4 if clave == 'UPLOAD_CHUNK_SIZE' else default)
+    async def test_save_file(self, config_mock):
+        contenido = b'contenido de prueba para el hash'
+        grid_in = MagicMock(_id='mock_gridfs_id', closed=False, write=AsyncMock(), set=AsyncMock(), close=AsyncMock())
+        self.fs_mock.exists.return_value = False
+        self.fs_mock.new_file = MagicMock(return_value=grid_in)
+        self.colecciones['referencias'].insert_one.return_value = MagicMock(inserted_id='mock_file_id')
+
+        result = await self.nosql.save_file(self.archivo_subido(contenido, 4), 'filename.txt', 'text/plain')
+
+        # El archivo GridFS del blob se nombra por el hash, no por el nombre de quien lo subió primero
+        esperado = hashlib.sha256(contenido).hexdigest()
+        self.fs_mock.new_file.assert_called_once_with(filename=esperado, content_type='text/plain')
+
+        # Cada bloque leído se escribe tal cual en GridFS, sin juntar el archivo en memoria
+        escrito = b''.join(llamada.args[0] for llamada in grid_in.write.await_args_list)
+        self.assertEqual(escrito, contenido)
+        self.assertEqual(grid_in.write.await_count, 8)
+
+        esperado = hashlib.sha256(contenido).hexdigest()
+        grid_in.set.assert_awaited_once_with('metadata', {'sha256': esperado})
+        grid_in.close.assert_awaited_once()
+
+        # El blob se guarda con su hash como identificador y el archivo lógico lo referencia
+        self.colecciones['blobs'].insert_one.assert_awaited_once_with(
+            {'_id': esperado, 'gridfs_id': 'mock_gridfs_id', 'tamaño': len(contenido), 'refs': 1})
+        referencia = self.colecciones['referencias'].insert_one.await_args.args[0]
+        self.assertEqual((referencia['nombre'], referencia['hash']), ('filename.txt', esperado))
+        self.assertEqual(result['file_id'], 'mock_file_id')
+        self.assertEqual(result['file_hash'], esperado)
+        self.assertEqual(result['tamaño'], len(contenido))
+        self.assertFalse(result['duplicado'])
+
+    async def test_save_file_comprimido(self):
+        contenido = b'linea de log repetida\n' * 300
+        grid_in = MagicMock(_id='gridfs_id', closed=False, write=AsyncMock(), set=AsyncMock(), close=AsyncMock())
+        self.fs_mock.exists.return_value = False
+        self.fs_mock.new_file = MagicMock(return_value=grid_in)
+        self.colecciones['referencias'].insert_one.return_value = MagicMock(inserted_id='referencia')
+
+        valores = {'UPLOAD_CHUNK_SIZE': 1000, 'COMPRESION_MARCO': 2048}
+        hilos = []
+        elegir = lambda muestra: hilos.append(threading.current_thread()) or 'zlib'
+        with patch('database.nosql_async.config', side_effect=lambda clave, default=None, cast=None: valores.get(clave, default)), \
+             patch('database.nosql_async.compresion.elegir_codec', side_effect=elegir):
+            result = await self.nosql.save_file(self.archivo_subido(contenido, 1000), 'app.log', 'text/plain')
+
+        # La compresión de prueba de la muestra no se hace en el hilo del event loop
+        self.assertEqual(len(hilos), 1)
+        self.assertIsNot(hilos[0], threading.current_thread())
+
+        # Se escribe comprimido por marcos, pero el hash registrado es el del contenido original
+        escrito = b''.join(llamada.args[0] for llamada in grid_in.write.await_args_list)
+        metadata = grid_in.set.await_args.args[1]
+        self.assertLess(len(escrito), len(contenido))
+        self.assertEqual((metadata['codec'], metadata['marco'], metadata['tamaño']), ('zlib', 2048, len(contenido)))
+        self.assertEqual(sum(metadata['marcos']), len(escrito))
+        self.assertEqual(metadata['sha256'], hashlib.sha256(contenido).hexdigest())
+        self.assertEqual(result['file_hash'], hashlib.sha256(contenido).hexdigest())
+
+    async def test_save_file_duplicado(self):
+        contenido = b'mismo contenido con otro nombre'
+        self.fs_mock.exists.return_value = False
+        self.fs_mock.new_file = MagicMock()
+        self.colecciones['blobs'].find_one_and_update.return_value = {'_id': 'hash', 'refs': 1}
+        self.colecciones['referencias'].insert_one.return_value = MagicMock(inserted_id='otra_referencia')
+
+        result = await self.nosql.save_file(self.archivo_subido(contenido, 8), 'copia.txt')
+
+        # Con el blob ya guardado solo se suma una referencia: nada se escribe en GridFS
+        esperado = hashlib.sha256(contenido).hexdigest()
+        self.colecciones['blobs'].find_one_and_update.assert_awaited_once_with({'_id': esperado}, {'$inc': {'refs': 1}})
+        self.fs_mock.new_file.assert_not_called()
+        self.colecciones['blobs'].insert_one.assert_not_awaited()
+        self.assertEqual(result['file_id'], 'otra_referencia')
+        self.assertTrue(result['duplicado'])
+
+    async def test_save_file_carrera_blob(self):
+        grid_in = MagicMock(_id='gridfs_sobrante', closed=False, write=AsyncMock(), set=AsyncMock(), close=AsyncMock())
+        self.fs_mock.exists.return_value = False
+        self.fs_mock.new_file = MagicMock(return_value=grid_in)
+        self.colecciones['blobs'].insert_one.side_effect = DuplicateKeyError('duplicado')
+        self.colecciones['referencias'].insert_one.return_value = MagicMock(inserted_id='referencia')
+
+        await self.nosql.save_file(self.archivo_subido(b'datos', 1024), 'filename.txt')
+
+        # Otra subida creó el blob a la vez: se borra la copia escrita y se referencia el blob existente
+        self.fs_mock.delete.assert_awaited_once_with('gridfs_sobrante')
+        self.colecciones['blobs'].update_one.assert_awaited_once()
+
+    async def test_save_file_error_aborta(self):
+        grid_in = MagicMock(closed=False, write=AsyncMock(side_effect=Exception('Database error')), abort=AsyncMock())
+        self.fs_mock.exists.return_value = False
+        self.fs_mock.new_file = MagicMock(return_value=grid_in)
+
+        await self.nosql.save_file(self.archivo_subido(b'datos', 1024), 'filename.txt')
+
+        # Los chunks escritos a medias se eliminan
+        grid_in.abort.assert_awaited_once()
+        self.nosql.error_handle.manejar_error.assert_called_once()
+        self.colecciones['blobs'].insert_one.assert_not_awaited()
+
+    async def test_save_file_existe(self):
+        self.colecciones['referencias'].find_one.return_value = {'nombre': 'filename.txt'}
+        self.fs_mock.new_file = MagicMock()
+
+        result = await self.nosql.save_file(MagicMock(), 'filename.txt')
+
+        self.fs_mock.new_file.assert_not_called()
+        self.assertEqual(result['message'], 'El archivo ya existe')
+
+    async def test_save_file_nombre_de_blob_borrado(self):
+        # a.txt se subió primero y se borró; su blob sigue vivo por b.txt y su archivo GridFS conserva el nombre
+        blob_gridfs = ObjectId()
+        self.colecciones['fs.files'].find = MagicMock(return_value=CursorAsync([{'_id': blob_gridfs}]))
+        self.colecciones['blobs'].find_one.return_value = {'_id': 'hash'}
+        self.colecciones['blobs'].find_one_and_update.return_value = {'_id': 'hash', 'refs': 1}
+        self.colecciones['referencias'].insert_one.return_value = MagicMock(inserted_id='referencia')
+
+        result = await self.nosql.save_file(self.archivo_subido(b'datos', 1024), 'a.txt')
+
+        self.assertEqual(result['message'], 'Archivo guardado')
+        self.colecciones['blobs'].find_one.assert_awaited_once_with({'gridfs_id': blob_gridfs}, {'_id': 1})
+
+    async def test_save_file_nombre_antiguo(self):
+        # Un archivo anterior al almacén por contenido (sin blob) sí ocupa el nombre
+        self.colecciones['fs.files'].find = MagicMock(return_value=CursorAsync([{'_id': ObjectId()}]))
+        self.colecciones['blobs'].find_one.return_value = None
+        self.fs_mock.new_file = MagicMock()
+
+        result = await self.nosql.save_file(MagicMock(), 'antiguo.txt')
+
+        self.assertEqual(result['message'], 'El archivo ya existe')
+        self.fs_mock.new_file.assert_not_called()
+
+    async def test_open_file_referencia(self):
+        file_id = ObjectId()
+        self.colecciones['referencias'].find_one.return_value = {'_id': file_id, 'hash': 'hash_blob', 'nombre': 'informe.pdf',
+                                                                 'content_type': 'application/pdf'}
+        self.colecciones['blobs'].find_one.return_value = {'_id': 'hash_blob', 'gridfs_id': 'gridfs_id'}
+        self.fs_mock.exists.return_value = True
+        # El archivo GridFS del blob lo creó otra subida del mismo contenido con otro tipo
+        grid_out = MagicMock(metadata={'sha256': 'hash_blob'}, content_type='application/octet-stream', length=4,
+                             readchunk=AsyncMock(return_value=b'datos'))
+        self.fs_mock.get.return_value = grid_out
+
+        result = await self.nosql.open_file(str(file_id))
+
+        # La referencia lleva al archivo GridFS del blob, pero el tipo y el nombre son los de la referencia
+        self.colecciones['referencias'].find_one.assert_awaited_once_with({'_id': file_id})
+        self.fs_mock.get.assert_awaited_once_with('gridfs_id')
+        self.assertEqual((result.content_type, result.filename), ('application/pdf', 'informe.pdf'))
+        self.assertEqual((result.length, result.metadata), (4, {'sha256': 'hash_blob'}))
+        self.assertEqual(await result.readchunk(), b'datos')
+
+    async def test_archivo_existe(self):
+        file_id = ObjectId()
+        self.colecciones['fs.files'] = AsyncMock()
+        self.colecciones['referencias'].find_one.return_value = None
+        self.colecciones['fs.files'].find_one.return_value = None
+
+        # Borrado (por ejemplo desde otro worker): ni referencia ni archivo anterior al almacén por contenido
+        self.assertFalse(await self.nosql.archivo_existe(str(file_id)))
+        self.colecciones['referencias'].find_one.assert_awaited_once_with({'_id': file_id}, {'_id': 1})
+
+        self.colecciones['referencias'].find_one.return_value = {'_id': file_id}
+        self.assertTrue(await self.nosql.archivo_existe(str(file_id)))
+
+    async def test_open_file_convierte_id(self):
+        file_id = str(ObjectId())
+        self.colecciones['referencias'].find_one.return_value = None
+        self.fs_mock.exists.return_value = True
+        grid_out = MagicMock(metadata=None)
+        self.fs_mock.get.return_value = grid_out
+
+        result = await self.nosql.open_file(file_id)
+
+        # El id que llega desde SQL como cadena se consulta como ObjectId
+        self.fs_mock.exists.assert_awaited_once_with({'_id': ObjectId(file_id)})
+        self.assertIs(result, grid_out)
+
+    async def test_open_file_no_existe(self):
+        self.colecciones['referencias'].find_one.return_value = None
+        self.fs_mock.exists.return_value = False
+
+        result = await self.nosql.open_file('file_id')
+
+        self.assertEqual(result['message'], 'El archivo no existe')
+        self.fs_mock.get.assert_not_awaited()
+
+    def archivo_gridfs(self, contenido, chunk_size, metadata=None):
+        # Simula un AsyncGridOut que entrega el contenido por chunks a partir de la posición actual
+        file_obj = MagicMock(length=len(contenido), metadata=metadata)
+        posicion = {'valor': 0}
+
+        async def seek(pos):
+            posicion['valor'] = pos
+
+        async def readchunk():
+            inicio = posicion['valor']
+            fin = min((inicio // chunk_size + 1) * chunk_size, len(contenido))
+            posicion['valor'] = fin
+            return contenido[inicio:fin]
+
+        file_obj.seek = seek
+        file_obj.readchunk = readchunk
+        return file_obj
+
+    async def test_iter_file_rango(self):
+        contenido = bytes(range(100))
+        file_obj = self.archivo_gridfs(contenido, 16)
+
+        bloques = [bloque async for bloque in self.nosql.iter_file(file_obj, 10, 40)]
+
+        # Se respetan los límites del intervalo y ningún bloque supera el tamaño de chunk
+        self.assertEqual(b''.join(bloques), contenido[10:41])
+        self.assertTrue(all(len(bloque) <= 16 for bloque in bloques))
+
+    async def test_hash_file(self):
+        contenido = b'contenido antiguo sin metadatos'
+
+        # Con el hash en los metadatos no se lee el archivo
+        self.assertEqual(await self.nosql.hash_file(MagicMock(metadata={'sha256': 'abc'})), 'abc')
+
+        resultado = await self.nosql.hash_file(self.archivo_gridfs(contenido, 8))
+        self.assertEqual(resultado, hashlib.sha256(contenido).hexdigest())
+
+    async def test_save_file_fragmentos(self):
+        contenido = bytes(range(256)) * 200
+        self.fs_mock.exists.return_value = False
+        self.fs_mock.new_file = MagicMock()
+        self.colecciones['referencias'].insert_one.return_value = MagicMock(inserted_id='referencia')
+        self.colecciones['chunks'].bulk_write.return_value = MagicMock(upserted_ids={})
+        fragmentos = [contenido[:20000], contenido[20000:]]
+        existente = hashlib.sha256(fragmentos[0]).hexdigest()
+        self.colecciones['chunks'].find = MagicMock(return_value=CursorAsync([{'_id': existente}]))
+
+        troceador = MagicMock(agregar_en_proceso=AsyncMock(return_value=fragmentos), terminar=MagicMock(return_value=[]))
+        activo = lambda clave, default=None, cast=None: True if clave == 'FRAGMENTOS_ACTIVO' else default
+        with patch('database.nosql_async.config', side_effect=activo), \
+             patch('database.nosql_async.fragmentador.Fragmentador', return_value=troceador):
+            result = await self.nosql.save_file(self.archivo_subido(contenido, len(contenido)), 'version2.bin')
+
+        # Nada va a GridFS y el contenido solo viaja para el fragmento que no estaba guardado
+        self.fs_mock.new_file.assert_not_called()
+        operaciones = self.colecciones['chunks'].bulk_write.await_args.args[0]
+        self.assertNotIn('$setOnInsert', operaciones[0]._doc)
+        self.assertEqual(operaciones[1]._doc['$setOnInsert']['datos'], fragmentos[1])
+
+        # El manifiesto se guarda en páginas aparte y el blob solo apunta a ellas
+        blob = self.colecciones['blobs'].insert_one.await_args.args[0]
+        manifiesto = [[hashlib.sha256(fragmento).hexdigest(), len(fragmento)] for fragmento in fragmentos]
+        paginas = self.colecciones['manifiestos'].insert_many.await_args.args[0]
+        self.assertEqual(paginas, [{'lista': blob['lista'], 'n': 0, 'fragmentos': manifiesto}])
+        self.assertNotIn('fragmentos', blob)
+        self.assertEqual(result['manifiesto'], fragmentador.hash_manifiesto(manifiesto))
+
+    async def test_save_file_fragmentos_error_libera(self):
+        contenido = bytes(range(256)) * 200
+        self.colecciones['referencias'].insert_one.return_value = MagicMock(inserted_id='referencia')
+        self.colecciones['chunks'].bulk_write.return_value = MagicMock(upserted_ids={})
+        self.colecciones['chunks'].find = MagicMock(side_effect=lambda *args, **kwargs: CursorAsync([]))
+        self.colecciones['blobs'].insert_one.side_effect = Exception('Database error')
+        fragmentos = [contenido[:20000], contenido[20000:]]
+
+        troceador = MagicMock(agregar_en_proceso=AsyncMock(return_value=fragmentos), terminar=MagicMock(return_value=[]))
+        activo = lambda clave, default=None, cast=None: True if clave == 'FRAGMENTOS_ACTIVO' else default
+        with patch('database.nosql_async.config', side_effect=activo), \
+             patch('database.nosql_async.fragmentador.Fragmentador', return_value=troceador):
+            await self.nosql.save_file(self.archivo_subido(contenido, len(contenido)), 'version2.bin')
+
+        # El blob no se guardó: se borran sus páginas y se restan las referencias sumadas a los fragmentos
+        lista = self.colecciones['manifiestos'].insert_many.await_args.args[0][0]['lista']
+        self.colecciones['manifiestos'].delete_many.assert_awaited_once_with({'lista': lista})
+        liberadas = self.colecciones['chunks'].bulk_write.await_args.args[0]
+        self.assertEqual([operacion._doc for operacion in liberadas], [{'$inc': {'refs': -1}}, {'$inc': {'refs': -1}}])
+        self.colecciones['referencias'].insert_one.assert_not_awaited()
+
+    async def test_escribir_fragmentos_error_libera(self):
+        fragmentos = [b'a' * 100, b'b' * 100]
+        self.colecciones['chunks'].bulk_write.return_value = MagicMock(upserted_ids={})
+        self.colecciones['chunks'].find = MagicMock(side_effect=lambda *args, **kwargs: CursorAsync([]))
+        archivo = MagicMock(read=AsyncMock(side_effect=[b'datos', Exception('Conexión cortada')]))
+
+        troceador = MagicMock(agregar_en_proceso=AsyncMock(return_value=fragmentos))
+        with patch('database.nosql_async.fragmentador.Fragmentador', return_value=troceador):
+            with self.assertRaises(Exception):
+                await self.nosql.escribir_fragmentos(self.colecciones, archivo, 1024)
+
+        # Los fragmentos del primer bloque ya tenían su referencia sumada: se restan
+        liberadas = self.colecciones['chunks'].bulk_write.await_args.args[0]
+        self.assertEqual([operacion._doc for operacion in liberadas], [{'$inc': {'refs': -1}}, {'$inc': {'refs': -1}}])
+
+    async def test_archivo_fragmentado_rango(self):
+        partes = [b'a' * 10, b'b' * 7, b'c' * 12]
+        manifiesto = [[hashlib.sha256(parte).hexdigest(), len(parte)] for parte in partes]
+        documentos = [{'_id': hash_parte, 'datos': parte} for (hash_parte, _), parte in zip(manifiesto, partes)]
+        coleccion = MagicMock()
+        coleccion.find = MagicMock(side_effect=lambda filtro: CursorAsync([documento for documento in documentos
+                                                                          if documento['_id'] in filtro['_id']['$in']]))
+        blob = {'_id': 'hash', 'fragmentos': manifiesto, 'manifiesto': 'hash_manifiesto', 'tamaño': 29}
+        archivo = ArchivoFragmentado(coleccion, blob, manifiesto, {'nombre': 'archivo.bin', 'content_type': 'application/octet-stream'})
+
+        # Se lee como un archivo de GridFS: por intervalos y reensamblando los fragmentos en orden
+        bloques = [bloque async for bloque in self.nosql.iter_file(archivo, 8, 20)]
+        self.assertEqual(b''.join(bloques), b''.join(partes)[8:21])
+
+        await archivo.seek(0)
+        self.assertEqual(await archivo.read(), b''.join(partes))
+        self.assertEqual(await self.nosql.hash_file(archivo), 'hash')
+
+    async def test_buscar_archivos(self):
+        ref_id = ObjectId()
+        antiguo_id = ObjectId()
+        de_blob_id = ObjectId()
+        self.colecciones['referencias'].find = MagicMock(return_value=CursorAsync([{'_id': ref_id, 'nombre': 'nuevo.txt'}]))
+        self.colecciones['fs.files'] = MagicMock()
+        self.colecciones['fs.files'].find = MagicMock(return_value=CursorAsync([{'_id': antiguo_id, 'filename': 'antiguo.txt'},
+                                                                               {'_id': de_blob_id, 'filename': 'nuevo.txt'}]))
+        self.colecciones['blobs'].find = MagicMock(return_value=CursorAsync([{'gridfs_id': de_blob_id}]))
+
+        result = await self.nosql.buscar_archivos(['nuevo.txt', 'antiguo.txt', 'otro.txt'])
+
+        # Una consulta por colección; el archivo GridFS de un blob no sustituye a su referencia
+        self.assertEqual(result, {'antiguo.txt': antiguo_id, 'nuevo.txt': ref_id})
+        filtro = self.colecciones['referencias'].find.call_args[0][0]
+        self.assertEqual(filtro, {'nombre': {'$in': ['nuevo.txt', 'antiguo.txt', 'otro.txt']}})
+
+    async def test_buscar_archivos_prefijo(self):
+        self.colecciones['referencias'].find = MagicMock(return_value=CursorAsync([]))
+        self.colecciones['fs.files'] = MagicMock()
+        self.colecciones['fs.files'].find = MagicMock(return_value=CursorAsync([]))
+
+        result = await self.nosql.buscar_archivos(prefijo='informes/2024.')
+
+        self.assertEqual(result, {})
+        filtro = self.colecciones['referencias'].find.call_args[0][0]
+        self.assertEqual(filtro, {'nombre': {'$regex': r'^informes/2024\.'}})
+
+    async def test_metadatos_por_nombre(self):
+        creado = datetime.datetime(2024, 5, 1)
+        self.colecciones['referencias'].find_one.return_value = {'_id': ObjectId(), 'hash': 'abc', 'creado': creado}
+
+        result = await self.nosql.metadatos_por_nombre('archivo.txt')
+
+        # Solo se consulta la referencia: GridFS no se toca
+        self.assertEqual(result, {'hash': 'abc', 'modificado': creado})
+        self.fs_mock.get.assert_not_called()
+
+    async def test_metadatos_por_nombre_archivo_de_blob(self):
+        self.colecciones['fs.files'] = AsyncMock()
+        self.colecciones['fs.files'].find_one.return_value = {'_id': ObjectId(), 'uploadDate': datetime.datetime(2024, 5, 1)}
+        self.colecciones['blobs'].find_one.return_value = {'_id': 'hash'}
+
+        # El archivo GridFS de un blob sin referencia con ese nombre no es un archivo existente
+        self.assertIsNone(await self.nosql.metadatos_por_nombre('borrado.txt'))
+
+    async def test_delete_file_ultima_referencia_fragmentos(self):
+        self.colecciones['referencias'].find_one_and_delete.return_value = {'hash': 'hash_blob'}
+        self.colecciones['blobs'].find_one_and_update.return_value = {'_id': 'hash_blob', 'refs': 0,
+                                                                      'fragmentos': [['f1', 5], ['f2', 5], ['f1', 5]]}
+        self.colecciones['blobs'].delete_one.return_value = MagicMock(deleted_count=1)
+
+        await self.nosql.delete_file('file_id')
+
+        # Se restan las referencias de cada fragmento (las repetidas, tantas veces como aparecen)
+        operaciones = self.colecciones['chunks'].bulk_write.await_args.args[0]
+        self.assertEqual([operacion._doc for operacion in operaciones], [{'$inc': {'refs': -2}}, {'$inc': {'refs': -1}}])
+        self.colecciones['chunks'].delete_many.assert_awaited_once_with({'_id': {'$in': ['f1', 'f2']}, 'refs': {'$lte': 0}})
+        self.fs_mock.delete.assert_not_awaited()
+
+    async def test_delete_file_ultima_referencia(self):
+        self.colecciones['referencias'].find_one_and_delete.return_value = {'hash': 'hash_blob'}
+        self.colecciones['blobs'].find_one_and_update.return_value = {'_id': 'hash_blob', 'gridfs_id': 'gridfs_id', 'refs': 0}
+        self.colecciones['blobs'].delete_one.return_value = MagicMock(deleted_count=1)
+
+        result = await self.nosql.delete_file('file_id')
+
+        self.colecciones['blobs'].delete_one.assert_awaited_once_with({'_id': 'hash_blob', 'refs': {'$lte': 0}})
+        self.fs_mock.delete.assert_awaited_once_with('gridfs_id')
+        self.assertEqual(result['message'], 'El archivo fue eliminado con exito')
+
+    async def test_delete_file_quedan_referencias(self):
+        self.colecciones['referencias'].find_one_and_delete.return_value = {'hash': 'hash_blob'}
+        self.colecciones['blobs'].find_one_and_update.return_value = {'_id': 'hash_blob', 'gridfs_id': 'gridfs_id', 'refs': 1}
+
+        await self.nosql.delete_file('file_id')
+
+        # Otro archivo lógico sigue usando el blob
+        self.colecciones['blobs'].delete_one.assert_not_awaited()
+        self.fs_mock.delete.assert_not_awaited()
+
+    async def test_delete_file_exception(self):
+        self.fs_mock.exists.side_effect = Exception('Database error')
+
+        result = await self.nosql.delete_file('file_id')
+
+        self.nosql.error_handle.manejar_error.assert_called_once()
+        self.fs_mock.delete.assert_not_awaited()
+        self.assertEqual(result['message'], 'Error al eliminar el archivo: Database error')
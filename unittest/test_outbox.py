@@ -0,0 +1,87 @@
+import datetime
+import unittest
+from unittest.mock import MagicMock
+from blockchain.outbox import OutboxSql
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.outbox = OutboxSql()
+        self.outbox.activo = True
+        self.outbox.tamano_lote = 2
+        self.outbox.db_nosql = MagicMock()
+        self.outbox.db_sql = MagicMock()
+        self.outbox.error_handle = MagicMock()
+        self.outbox.db_sql.bloques_registrados.return_value = set()
+        self.outbox.db_nosql.marcar_registrados_sql.return_value = True
+
+    def bloques(self, *indices):
+        return [{'_id': f'id{i}', 'block': {'hash': f'hash{i}'},
+                 'entradas': [{'file_hash': f'file{i}', 'metadatos': {'file_id': str(i), 'nombre': f'archivo{i}'}}]}
+                for i in indices]
+
+    def test_drenar_por_lotes(self):
+        self.outbox.db_nosql.reclamar_pendientes_sql.side_effect = [self.bloques(1, 2), self.bloques(3), []]
+
+        self.outbox.drenar()
+
+        # Una transacción por lote con las filas de todos sus bloques
+        self.assertEqual(self.outbox.db_sql.save_hash_files.call_count, 2)
+        filas = self.outbox.db_sql.save_hash_files.call_args_list[0][0][0]
+        self.assertEqual(filas, [('hash1', 'file1', '1', 'id1', 'archivo1'), ('hash2', 'file2', '2', 'id2', 'archivo2')])
+        self.outbox.db_nosql.marcar_registrados_sql.assert_any_call(['id1', 'id2'], self.outbox.propietario)
+        self.outbox.db_nosql.marcar_registrados_sql.assert_any_call(['id3'], self.outbox.propietario)
+        self.assertEqual((self.outbox.lotes, self.outbox.filas), (2, 3))
+
+    def test_drenar_idempotente(self):
+        # El bloque 1 ya se registró en SQL antes de una caída: solo se marca
+        self.outbox.db_nosql.reclamar_pendientes_sql.return_value = self.bloques(1)
+        self.outbox.db_sql.bloques_registrados.return_value = {'hash1'}
+
+        self.outbox.drenar()
+
+        self.outbox.db_sql.save_hash_files.assert_not_called()
+        self.outbox.db_nosql.marcar_registrados_sql.assert_called_once_with(['id1'], self.outbox.propietario)
+        self.assertEqual(self.outbox.repetidos, 1)
+
+    def test_drenar_error_sql_no_marca(self):
+        self.outbox.db_nosql.reclamar_pendientes_sql.return_value = self.bloques(1, 2)
+        self.outbox.db_sql.save_hash_files.side_effect = Exception('MySQL caído')
+
+        self.outbox.drenar()
+
+        # Los bloques siguen pendientes y se sueltan para el siguiente ciclo (de este worker o de otro)
+        self.outbox.db_nosql.marcar_registrados_sql.assert_not_called()
+        self.outbox.db_nosql.liberar_pendientes_sql.assert_called_once_with(['id1', 'id2'], self.outbox.propietario)
+        self.assertEqual(self.outbox.errores, 1)
+        self.outbox.error_handle.manejar_error.assert_called_once()
+
+    def test_drenar_reclama_lote(self):
+        self.outbox.db_nosql.reclamar_pendientes_sql.return_value = []
+
+        self.outbox.drenar()
+
+        # Cada lote se reclama a nombre de este worker con su concesión
+        self.outbox.db_nosql.reclamar_pendientes_sql.assert_called_once_with(2, self.outbox.propietario, self.outbox.concesion)
+        self.outbox.db_sql.save_hash_files.assert_not_called()
+
+    def test_estadisticas_retraso(self):
+        # Fecha en UTC sin zona, como la devuelve la BD
+        antiguo = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(seconds=30)
+        self.outbox.db_nosql.retraso_sql.return_value = (3, antiguo)
+
+        estadisticas = self.outbox.estadisticas()
+
+        self.assertEqual(estadisticas['pendientes'], 3)
+        self.assertGreaterEqual(estadisticas['retraso_segundos'], 30)
+
+    def test_detener_drena_pendientes(self):
+        self.outbox.db_nosql.reclamar_pendientes_sql.side_effect = [[], self.bloques(1), []]
+        self.outbox.intervalo = 60
+
+        self.outbox.iniciar()
+        self.outbox.detener()
+
+        # Al detenerse se registra lo que quedaba pendiente
+        self.outbox.db_sql.save_hash_files.assert_called_once()
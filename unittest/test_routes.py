@@ -0,0 +1,101 @@
+import datetime
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from route import routes
+from route.routes import cabeceras_cache, no_modificado, parsear_rango
+
+
+class TestRoutes(unittest.TestCase):
+
+    def test_parsear_rango_sin_cabecera(self):
+        self.assertIsNone(parsear_rango(None, 100))
+        self.assertIsNone(parsear_rango('items=0-10', 100))
+
+    def test_parsear_rango_intervalo(self):
+        self.assertEqual(parsear_rango('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parsear_rango('bytes=90-', 100), (90, 99))
+
+        # El final se recorta al tamaño del archivo
+        self.assertEqual(parsear_rango('bytes=50-500', 100), (50, 99))
+
+    def test_parsear_rango_sufijo(self):
+        self.assertEqual(parsear_rango('bytes=-10', 100), (90, 99))
+        self.assertEqual(parsear_rango('bytes=-500', 100), (0, 99))
+
+    def test_parsear_rango_no_satisfacible(self):
+        self.assertFalse(parsear_rango('bytes=100-', 100))
+        self.assertFalse(parsear_rango('bytes=20-10', 100))
+        self.assertFalse(parsear_rango('bytes=-0', 100))
+
+    def test_parsear_rango_mal_formado(self):
+        # Las cabeceras inválidas o con varios intervalos se ignoran y se envía el archivo completo
+        self.assertIsNone(parsear_rango('bytes=a-b', 100))
+        self.assertIsNone(parsear_rango('bytes=-', 100))
+        self.assertIsNone(parsear_rango('bytes=0-1,5-6', 100))
+
+    def test_cabeceras_cache(self):
+        metadatos = {'hash': 'abc123', 'modificado': datetime.datetime(2024, 5, 1, 10, 30, 15, 500)}
+
+        self.assertEqual(cabeceras_cache(metadatos), {'ETag': '"abc123"', 'Last-Modified': 'Wed, 01 May 2024 10:30:15 GMT'})
+        self.assertEqual(cabeceras_cache(None), {})
+
+    def test_no_modificado_etag(self):
+        metadatos = {'hash': 'abc123', 'modificado': datetime.datetime(2024, 5, 1, 10, 30, 15)}
+
+        self.assertTrue(no_modificado(metadatos, '"abc123"', None))
+        self.assertTrue(no_modificado(metadatos, '"otro", W/"abc123"', None))
+        self.assertTrue(no_modificado(metadatos, '*', None))
+        self.assertFalse(no_modificado(metadatos, '"otro"', None))
+
+        # If-None-Match tiene prioridad sobre la fecha
+        self.assertFalse(no_modificado(metadatos, '"otro"', 'Wed, 01 May 2024 10:30:15 GMT'))
+
+    def test_no_modificado_fecha(self):
+        metadatos = {'hash': None, 'modificado': datetime.datetime(2024, 5, 1, 10, 30, 15, 500)}
+
+        self.assertTrue(no_modificado(metadatos, None, 'Wed, 01 May 2024 10:30:15 GMT'))
+        self.assertFalse(no_modificado(metadatos, None, 'Wed, 01 May 2024 10:30:14 GMT'))
+        self.assertFalse(no_modificado(metadatos, None, 'fecha inválida'))
+
+        # Sin hash guardado no se puede comparar la etiqueta y sin metadatos no hay 304
+        self.assertFalse(no_modificado(metadatos, '"abc123"', None))
+        self.assertFalse(no_modificado(None, '"abc123"', None))
+
+
+class TestServirArchivo(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.metadatos = {'hash': 'abc123', 'modificado': datetime.datetime(2024, 5, 1, 10, 30, 15)}
+        self.parches = [patch.object(routes.service, 'verify_and_validate_token', MagicMock(return_value={})),
+                        patch.object(routes.archivo.nosql_async, 'metadatos_por_nombre', AsyncMock(return_value=self.metadatos)),
+                        patch.object(routes.archivo, 'load_file', AsyncMock())]
+        for parche in self.parches:
+            parche.start()
+
+    def tearDown(self):
+        for parche in self.parches:
+            parche.stop()
+
+    async def test_get_copia_vigente(self):
+        respuesta = await routes.servir_archivo('archivo.txt', 'Bearer token', None, 'sellado', '"abc123"', None, True)
+
+        # Con GET la copia vigente es un 304 y el archivo no se abre
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta.headers['etag'], '"abc123"')
+        routes.archivo.load_file.assert_not_awaited()
+
+    async def test_post_precondicion_fallida(self):
+        respuesta = await routes.servir_archivo('archivo.txt', 'Bearer token', None, 'sellado', '"abc123"', None, False)
+
+        # Con POST una etiqueta que coincide es un 412 (RFC 7232)
+        self.assertEqual(respuesta.status_code, 412)
+        routes.archivo.load_file.assert_not_awaited()
+
+    async def test_post_ignora_fecha(self):
+        routes.archivo.load_file.return_value = {'message': 'Error: Archivo no existe'}
+
+        respuesta = await routes.servir_archivo('archivo.txt', 'Bearer token', None, 'sellado', None,
+                                                'Wed, 01 May 2024 10:30:15 GMT', False)
+
+        # If-Modified-Since solo aplica a GET: el POST sigue con la carga
+        self.assertEqual(respuesta, {'message': 'Error: Archivo no existe'})
@@ -1,10 +1,13 @@
 import unittest
 import jwt
 import datetime
+import time
 from services.services import Services
+from services.cache_tokens import CacheTokens
+from services.archivos import Archivo
 from decouple import config
 from fastapi import HTTPException
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 
 class TestServices(unittest.TestCase):
 
@@ -83,3 +86,72 @@ class TestServices(unittest.TestCase):
 
         self.assertEqual(result['status'], 500)
         self.assertEqual('Error interno del servidor: Error genérico: fallo en config', result['detail'])
+
+    def test_token_en_cache(self):
+        services = Services()
+        services.cache_tokens = CacheTokens()
+
+        primero = services.verify_and_validate_token(self.token_valido)
+        with patch('services.services.jwt.decode') as decode_mock, patch('services.services.config') as config_mock:
+            segundo = services.verify_and_validate_token(self.token_valido)
+
+        # La segunda petición no lee SECRET_KEY ni vuelve a verificar el token
+        decode_mock.assert_not_called()
+        config_mock.assert_not_called()
+        self.assertIs(segundo, primero)
+        self.assertEqual(services.cache_tokens.estadisticas()['aciertos'], 1)
+
+    def test_token_fallido_no_se_guarda(self):
+        services = Services()
+        services.cache_tokens = CacheTokens()
+
+        with self.assertRaises(HTTPException):
+            services.verify_and_validate_token(self.token_invalido)
+
+        self.assertEqual(services.cache_tokens.estadisticas()['tokens'], 0)
+
+    def test_cache_caduca_con_exp(self):
+        cache = CacheTokens()
+        huella = cache.huella('token')
+
+        # La entrada caduca con el 'exp' del token aunque el TTL sea mayor
+        cache.guardar(huella, {'exp': time.time() - 1})
+        self.assertIsNone(cache.obtener(huella))
+        self.assertEqual(cache.estadisticas()['tokens'], 0)
+
+        cache.guardar(huella, {'exp': time.time() + 60})
+        self.assertGreater(cache.obtener(huella)['exp'], time.time())
+
+    def test_cache_limite(self):
+        cache = CacheTokens()
+        cache.max_tokens = 2
+        for token in ('a', 'b', 'c'):
+            cache.guardar(cache.huella(token), {'token': token})
+
+        # Se descarta el token usado hace más tiempo
+        self.assertIsNone(cache.obtener(cache.huella('a')))
+        self.assertEqual(cache.obtener(cache.huella('c')), {'token': 'c'})
+
+
+class TestArchivoNombres(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.archivo = Archivo.__new__(Archivo)
+        self.archivo.nosql_async = MagicMock()
+        self.archivo.nosql_async.buscar_archivos = AsyncMock(return_value={})
+        self.archivo.nosql_async.open_file = AsyncMock()
+
+    async def test_buscar_id_en_nosql(self):
+        # El nombre se resuelve en la BD NoSQL aunque la fila SQL siga pendiente
+        self.archivo.nosql_async.buscar_archivos.return_value = {'a.txt': 'abc123'}
+        self.assertEqual(await self.archivo.buscar_id('a.txt'), 'abc123')
+        self.archivo.nosql_async.buscar_archivos.assert_awaited_once_with(['a.txt'])
+
+    async def test_load_file_no_existe(self):
+        respuesta = await self.archivo.load_file('b.txt', {'clave_privada': 'x'})
+        self.assertEqual(respuesta, {'message': 'Error: Archivo no existe'})
+
+    async def test_deletefile_no_existe(self):
+        respuesta = await self.archivo.deletefile('b.txt', {'clave_privada': 'x'})
+        self.assertEqual(respuesta, {'message': 'Error: Archivo no existe'})
+        self.archivo.nosql_async.open_file.assert_not_awaited()
@@ -0,0 +1,178 @@
+import datetime
+import hashlib
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+from bson import ObjectId
+from database import sesiones_subida
+from database.sesiones_subida import SesionesSubida, _estados
+
+
+class ChunksSimulados:
+    # Colección fs.chunks en memoria: lo justo para las operaciones de las sesiones
+    def __init__(self):
+        self.chunks = {}
+        self.lecturas = 0
+
+    async def bulk_write(self, operaciones, ordered=True):
+        insertados = {}
+        for i, operacion in enumerate(operaciones):
+            clave = (operacion._filter['files_id'], operacion._filter['n'])
+            if clave not in self.chunks:
+                self.chunks[clave] = operacion._doc['$setOnInsert']['data']
+                insertados[i] = ObjectId()
+        return MagicMock(upserted_ids=insertados)
+
+    async def find_one(self, filtro):
+        self.lecturas += 1
+        datos = self.chunks.get((filtro['files_id'], filtro['n']))
+        return None if datos is None else {'n': filtro['n'], 'data': datos}
+
+    def find(self, filtro, proyeccion=None, sort=None):
+        documentos = [{'n': n, 'data': self.chunks[(files_id, n)]} for files_id, n in sorted(self.chunks)
+                      if files_id == filtro['files_id'] and ('n' not in filtro or n in filtro['n']['$in'])]
+
+        async def cursor():
+            for documento in documentos:
+                yield documento
+        return cursor()
+
+    async def create_index(self, *args, **kwargs):
+        pass
+
+    async def delete_many(self, filtro):
+        for clave in [clave for clave in self.chunks if clave[0] == filtro['files_id']]:
+            del self.chunks[clave]
+
+
+async def partes(*bloques):
+    for bloque in bloques:
+        yield bloque
+
+
+class TestSesionesSubida(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.sesiones = SesionesSubida()
+        self.sesiones.error_handle = MagicMock()
+        self.contenido = bytes(range(256)) * 10 # 2560 bytes: 10 chunks de 256
+        self.sesion = {'_id': ObjectId(), 'nombre': 'grande.bin', 'content_type': 'application/octet-stream',
+                       'tamaño': len(self.contenido), 'chunk_size': 256, 'gridfs_id': ObjectId()}
+
+        self.chunks = ChunksSimulados()
+        self.colecciones = {'sesiones_subida': AsyncMock(), 'referencias': AsyncMock(), 'blobs': AsyncMock(),
+                            'fs.files': AsyncMock(), 'fs.chunks': self.chunks}
+        self.colecciones['sesiones_subida'].find_one.return_value = self.sesion
+        self.colecciones['sesiones_subida'].find_one_and_update.return_value = self.sesion
+        self.colecciones['sesiones_subida'].find_one_and_delete.return_value = self.sesion
+        self.colecciones['referencias'].find_one.return_value = None
+        self.colecciones['referencias'].insert_one.return_value = MagicMock(inserted_id='ref_id')
+        self.colecciones['blobs'].find_one_and_update.return_value = None
+        db_mock = MagicMock()
+        db_mock.__getitem__.side_effect = lambda nombre: self.colecciones[nombre]
+        self.sesiones.base_de_datos = MagicMock(return_value=db_mock)
+
+    def tearDown(self):
+        _estados.clear()
+        sesiones_subida._ultima_limpieza = None
+
+    async def test_partes_desordenadas_y_finalizar(self):
+        # Tres partes en desorden (la última incompleta) y un reenvío
+        await self.sesiones.guardar_parte(self.sesion['_id'], 1024, partes(self.contenido[1024:2000], self.contenido[2000:]))
+        await self.sesiones.guardar_parte(self.sesion['_id'], 0, partes(self.contenido[:512]))
+        await self.sesiones.guardar_parte(self.sesion['_id'], 512, partes(self.contenido[512:1024]))
+        await self.sesiones.guardar_parte(self.sesion['_id'], 0, partes(self.contenido[:512]))
+
+        estado = await self.sesiones.rangos_recibidos(self.sesion['_id'])
+        self.assertEqual(estado['rangos'], [[0, 2559]])
+        self.assertEqual(estado['recibido'], 2560)
+
+        result = await self.sesiones.finalizar(self.sesion['_id'])
+
+        # El hash coincide con el del contenido completo y los chunks fuera de orden se leyeron una sola vez
+        self.assertEqual(result['file_hash'], hashlib.sha256(self.contenido).hexdigest())
+        self.assertEqual(self.chunks.lecturas, 6 + 3) # Los 6 chunks de la primera parte y 3 consultas del siguiente que aún no estaba
+        archivo = self.colecciones['fs.files'].insert_one.call_args[0][0]
+        self.assertEqual((archivo['_id'], archivo['length'], archivo['chunkSize']), (self.sesion['gridfs_id'], 2560, 256))
+        self.assertEqual(archivo['metadata'], {'sha256': result['file_hash']})
+        self.assertEqual(archivo['filename'], result['file_hash']) # El archivo GridFS del blob se nombra por su hash
+        self.colecciones['blobs'].insert_one.assert_awaited_once()
+        self.assertEqual(result['file_id'], 'ref_id')
+
+    async def test_reenvio_con_bytes_distintos(self):
+        await self.sesiones.guardar_parte(self.sesion['_id'], 0, partes(self.contenido[:512]))
+
+        # El chunk 0 ya entró en el hash: otros bytes en esa posición se rechazan y no se sobrescriben
+        result = await self.sesiones.guardar_parte(self.sesion['_id'], 0, partes(b'x' * 512))
+
+        self.assertIn('no coincide', result['message'])
+        self.assertEqual(result['desplazamiento'], 0)
+        self.assertEqual(self.chunks.chunks[(self.sesion['gridfs_id'], 0)], self.contenido[:256])
+
+        await self.sesiones.guardar_parte(self.sesion['_id'], 512, partes(self.contenido[512:]))
+        result = await self.sesiones.finalizar(self.sesion['_id'])
+        self.assertEqual(result['file_hash'], hashlib.sha256(self.contenido).hexdigest())
+
+    async def test_limpiar_abandonadas(self):
+        await self.sesiones.guardar_parte(self.sesion['_id'], 0, partes(self.contenido[:512]))
+        otra = ObjectId() # Sesión finalizada en otro worker: solo queda su hash en este proceso
+        _estados[str(otra)] = object()
+        caducada = {'_id': self.sesion['_id']}
+        self.colecciones['sesiones_subida'].find = MagicMock(side_effect=[partes(caducada), partes()])
+
+        await self.sesiones.limpiar_abandonadas(self.sesiones.base_de_datos())
+
+        # La sesión caducada se borra con sus chunks y con su hash; el de la otra sesión también se descarta
+        filtro = self.colecciones['sesiones_subida'].find_one_and_delete.call_args[0][0]
+        self.assertEqual(filtro['_id'], self.sesion['_id'])
+        self.assertLess(filtro['actualizado']['$lt'], datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=self.sesiones.ttl - 1))
+        self.assertEqual(self.chunks.chunks, {})
+        self.assertEqual(_estados, {})
+
+        # Dentro del intervalo no se vuelve a buscar
+        await self.sesiones.limpiar_abandonadas(self.sesiones.base_de_datos())
+        self.assertEqual(self.colecciones['sesiones_subida'].find.call_count, 2)
+
+    async def test_crear_sesion_nombre_de_blob(self):
+        # El archivo GridFS de un blob (con el nombre de una subida ya borrada) no ocupa el nombre
+        self.colecciones['fs.files'].find = MagicMock(return_value=partes({'_id': ObjectId()}))
+        self.colecciones['blobs'].find_one.return_value = {'_id': 'hash'}
+        self.sesiones.nosql_async.asegurar_indices = AsyncMock()
+        self.sesiones.limpiar_abandonadas = AsyncMock()
+
+        result = await self.sesiones.crear_sesion('grande.bin', 2560)
+
+        self.assertEqual(result['message'], 'Sesión creada')
+        self.colecciones['sesiones_subida'].insert_one.assert_awaited_once()
+
+    async def test_rangos_con_huecos(self):
+        await self.sesiones.guardar_parte(self.sesion['_id'], 0, partes(self.contenido[:512]))
+        await self.sesiones.guardar_parte(self.sesion['_id'], 1024, partes(self.contenido[1024:1280]))
+
+        estado = await self.sesiones.rangos_recibidos(self.sesion['_id'])
+
+        self.assertEqual(estado['rangos'], [[0, 511], [1024, 1279]])
+        result = await self.sesiones.finalizar(self.sesion['_id'])
+        self.assertEqual(result['faltan_desde'], 512)
+        self.colecciones['fs.files'].insert_one.assert_not_awaited()
+
+    async def test_parte_no_alineada(self):
+        result = await self.sesiones.guardar_parte(self.sesion['_id'], 100, partes(b'x' * 256))
+        self.assertIn('múltiplo', result['message'])
+
+        # Una parte intermedia que no acaba en un chunk completo se rechaza
+        result = await self.sesiones.guardar_parte(self.sesion['_id'], 0, partes(self.contenido[:300]))
+        self.assertIn('múltiplo', result['message'])
+
+        result = await self.sesiones.guardar_parte(self.sesion['_id'], 2304, partes(b'x' * 300))
+        self.assertIn('supera', result['message'])
+
+    async def test_finalizar_duplicado(self):
+        self.colecciones['blobs'].find_one_and_update.return_value = {'_id': 'hash', 'refs': 1}
+        await self.sesiones.guardar_parte(self.sesion['_id'], 0, partes(self.contenido))
+
+        result = await self.sesiones.finalizar(self.sesion['_id'])
+
+        # El contenido ya existía: se descartan los chunks de la sesión y no se crea otro archivo
+        self.assertTrue(result['duplicado'])
+        self.assertEqual(self.chunks.chunks, {})
+        self.colecciones['fs.files'].insert_one.assert_not_awaited()
@@ -0,0 +1,223 @@
+import unittest
+import json
+import hashlib
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519
+from cryptography.hazmat.primitives import serialization
+from unittest.mock import MagicMock, patch
+from security.authentication import Authentication
+from blockchain import merkle, codificacion
+from blockchain.verificador import Verificador, verificar_firmas
+
+
+class TestVerificador(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.private_pem = cls.private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                        format=serialization.PrivateFormat.PKCS8,
+                                                        encryption_algorithm=serialization.NoEncryption()).decode()
+        cls.public_pem = Authentication().get_public_key(cls.private_pem)
+
+    def crear_cadena(self, cantidad, private_pem=None, previous_hash='genesis', primero=1):
+        # Cadena firmada igual que Blockchain.create_block, partiendo del registro génesis
+        auth = Authentication()
+        private_pem = private_pem or self.private_pem
+        documentos = []
+        for index in range(primero, primero + cantidad):
+            entradas = [{'file_hash': f'hash{index}', 'metadatos': {'file_id': index, 'nombre': f'archivo{index}'}}]
+            block = {'index': index, 'timestamp': '2024-01-01', 'data': f'hash{index}', 'previous_hash': previous_hash,
+                     'metadatos': entradas[0]['metadatos'], 'validator': auth.get_public_key(private_pem),
+                     'merkle_root': merkle.hoja(entradas[0]), 'algoritmo': auth.algoritmo(private_pem)}
+            block['proof'] = auth.sign_proof(previous_hash, private_pem)
+            block['proof_signature'] = auth.sign_proof(str(block['proof']), private_pem)
+            block['hash'] = hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+            block['signature'] = auth.sign_block(block, private_pem)
+            documentos.append({'block': block, 'entradas': entradas})
+            previous_hash = block['hash']
+        return documentos
+
+    def binaria(self, documentos):
+        # Misma cadena con la codificación binaria: los bloques se guardan compactados
+        auth = Authentication()
+        binaria = []
+        previous_hash = 'genesis'
+        for documento in documentos:
+            block = {clave: valor for clave, valor in documento['block'].items() if clave not in ('hash', 'signature')}
+            block['previous_hash'] = previous_hash
+            block['proof'] = auth.sign_proof(previous_hash, self.private_pem)
+            block['proof_signature'] = auth.sign_proof(str(block['proof']), self.private_pem)
+            cuerpo = codificacion.codificar(block)
+            block['hash'] = hashlib.sha256(cuerpo).hexdigest()
+            block['signature'] = auth.sign_bytes(cuerpo, self.private_pem)
+            binaria.append({'block': codificacion.compactar(block, cuerpo), 'entradas': documento['entradas']})
+            previous_hash = block['hash']
+        return binaria
+
+    def verificador(self, documentos):
+        verificador = Verificador(procesos=2, tamano_lote=2)
+        verificador.db_nosql = MagicMock()
+        verificador.db_nosql.iterar_bloques.return_value = iter(documentos)
+        verificador.db_nosql.checkpoints_recientes.return_value = []
+        verificador.authentication.get_server_public_key = MagicMock(return_value=self.public_pem)
+        verificador.blockchain.db_nosql = MagicMock()
+        verificador.blockchain.db_nosql.ultimo_registro.return_value = 'genesis'
+        return verificador
+
+    def test_cadena_valida(self):
+        avances = []
+        resultado = self.verificador(self.crear_cadena(5)).verificar(progreso=avances.append)
+        self.assertFalse(resultado['checkpoint_guardado']) # Sin clave privada no se firma checkpoint
+
+        self.assertTrue(resultado['valida'])
+        self.assertEqual(resultado['bloques'], 5)
+        self.assertEqual(resultado['ultimo_index'], 5)
+        self.assertEqual(resultado['errores'], [])
+        self.assertIn('bloques_por_segundo', resultado)
+        self.assertTrue(avances)
+
+    def test_una_verificacion_a_la_vez(self):
+        with patch('blockchain.verificador._verificacion') as verificacion:
+            verificacion.acquire.return_value = False # Otra petición está verificando la cadena
+            resultado = self.verificador(self.crear_cadena(1)).verificar()
+
+        self.assertEqual(resultado, {'message': 'Ya hay una verificación de la cadena en curso'})
+        verificacion.release.assert_not_called()
+
+    def test_cadena_alterada(self):
+        documentos = self.crear_cadena(4)
+        documentos[1]['block']['data'] = 'hash alterado' # Cambia el hash y rompe la firma
+        documentos[3]['entradas'][0]['file_hash'] = 'otro archivo' # La raíz de Merkle ya no corresponde
+
+        resultado = self.verificador(documentos).verificar()
+
+        self.assertFalse(resultado['valida'])
+        errores = {(error['index'], error['error']) for error in resultado['errores']}
+        self.assertIn((2, 'hash incorrecto'), errores)
+        self.assertIn((2, 'signature inválida'), errores)
+        self.assertIn((4, 'merkle_root no corresponde a las entradas'), errores)
+
+    def test_enlace_roto(self):
+        documentos = self.crear_cadena(3)
+        del documentos[1] # Falta un bloque: el siguiente no enlaza con el anterior
+
+        resultado = self.verificador(documentos).verificar()
+
+        self.assertIn({'index': 3, 'error': 'previous_hash no enlaza con el bloque anterior'}, resultado['errores'])
+
+    def test_verificar_firmas_proof(self):
+        block = self.crear_cadena(1)[0]['block']
+
+        self.assertEqual(verificar_firmas([self.public_pem], [block]), [])
+        self.assertEqual(verificar_firmas([self.public_pem], [dict(block, previous_hash='otro')]),
+                         [{'index': 1, 'error': 'proof inválido'}])
+
+    def test_sin_clave_servidor(self):
+        verificador = self.verificador([])
+        verificador.error_handle = MagicMock()
+        verificador.authentication.get_server_public_key.return_value = None
+
+        verificador.verificar()
+
+        verificador.error_handle.manejar_error.assert_called_once()
+
+    def test_cadena_mixta(self):
+        # La clave del servidor rota de RSA a Ed25519: los bloques antiguos se verifican con la clave anterior
+        nueva_pem = ed25519.Ed25519PrivateKey.generate().private_bytes(encoding=serialization.Encoding.PEM,
+                                                                     format=serialization.PrivateFormat.PKCS8,
+                                                                     encryption_algorithm=serialization.NoEncryption()).decode()
+        antiguos = self.crear_cadena(2)
+        nuevos = self.crear_cadena(2, nueva_pem, antiguos[-1]['block']['hash'], 3)
+        self.assertEqual(nuevos[0]['block']['algoritmo'], 'ed25519')
+
+        verificador = self.verificador(antiguos + nuevos)
+        verificador.authentication.get_server_public_key = MagicMock(return_value=Authentication().get_public_key(nueva_pem))
+        verificador.claves_anteriores = MagicMock(return_value=[self.public_pem])
+
+        resultado = verificador.verificar()
+
+        self.assertTrue(resultado['valida'], resultado['errores'])
+        self.assertEqual(resultado['bloques'], 4)
+
+    def test_validator_no_autorizado(self):
+        otra_pem = ed25519.Ed25519PrivateKey.generate().private_bytes(encoding=serialization.Encoding.PEM,
+                                                                    format=serialization.PrivateFormat.PKCS8,
+                                                                    encryption_algorithm=serialization.NoEncryption()).decode()
+        block = self.crear_cadena(1, otra_pem)[0]['block']
+
+        self.assertEqual(verificar_firmas([self.public_pem], [block]), [{'index': 1, 'error': 'validator no autorizado'}])
+
+    def test_cadena_binaria(self):
+        documentos = self.binaria(self.crear_cadena(2))
+
+        resultado = self.verificador(documentos).verificar()
+        self.assertTrue(resultado['valida'], resultado['errores'])
+
+        # Un cambio en los bytes guardados cambia el hash y rompe la firma
+        alterado = bytearray(documentos[1]['block']['cuerpo'])
+        alterado[len(codificacion.CABECERA) + 20] ^= 1 # Primer byte del hash del archivo
+        documentos[1]['block']['cuerpo'] = bytes(alterado)
+
+        # Unos bytes que ni siquiera se pueden decodificar se informan sin detener la verificación
+        documentos.append({'block': dict(documentos[0]['block'], index=3, cuerpo=b'XXXX'), 'entradas': []})
+
+        resultado = self.verificador(documentos).verificar()
+        errores = {(error['index'], error['error']) for error in resultado['errores']}
+        self.assertIn((2, 'hash incorrecto'), errores)
+        self.assertIn((2, 'signature inválida'), errores)
+        self.assertIn((3, 'bloque ilegible'), errores)
+        self.assertEqual(resultado['bloques'], 3)
+
+    def acumulador(self, documentos):
+        acumulador = ''
+        for documento in documentos:
+            acumulador = hashlib.sha256((acumulador + documento['block']['hash']).encode()).hexdigest()
+        return acumulador
+
+    def test_guarda_checkpoint(self):
+        documentos = self.crear_cadena(3)
+        verificador = self.verificador(documentos)
+
+        resultado = verificador.verificar(private_key=self.private_pem)
+
+        self.assertTrue(resultado['checkpoint_guardado'])
+        checkpoint = verificador.db_nosql.guardar_checkpoint.call_args.args[0]
+        self.assertEqual(checkpoint['index'], 3)
+        self.assertEqual(checkpoint['hash'], documentos[2]['block']['hash'])
+        self.assertEqual(checkpoint['acumulador'], self.acumulador(documentos))
+
+        # La firma del checkpoint se comprueba con la clave pública del servidor
+        contenido = verificador.contenido_checkpoint(3, checkpoint['hash'], checkpoint['acumulador'])
+        self.assertTrue(Authentication().verify_proof(contenido, checkpoint['firma'], self.public_pem))
+
+    def test_reanuda_desde_checkpoint(self):
+        documentos = self.crear_cadena(5)
+        verificador = self.verificador(documentos[3:])
+        contenido = verificador.contenido_checkpoint(3, documentos[2]['block']['hash'], self.acumulador(documentos[:3]))
+        checkpoint = {'index': 3, 'hash': documentos[2]['block']['hash'], 'acumulador': self.acumulador(documentos[:3]),
+                      'firma': Authentication().sign_proof(contenido, self.private_pem)}
+        verificador.db_nosql.checkpoints_recientes.return_value = [checkpoint]
+        verificador.db_nosql.bloque_por_indice.return_value = documentos[2]['block']
+
+        resultado = verificador.verificar(private_key=self.private_pem)
+
+        # Solo se verifican los bloques posteriores al checkpoint y el acumulador continúa el anterior
+        verificador.db_nosql.iterar_bloques.assert_called_once_with(3, 2)
+        self.assertTrue(resultado['valida'])
+        self.assertEqual(resultado['checkpoint'], 3)
+        self.assertEqual(resultado['bloques'], 2)
+        nuevo = verificador.db_nosql.guardar_checkpoint.call_args.args[0]
+        self.assertEqual(nuevo['acumulador'], self.acumulador(documentos))
+
+    def test_checkpoint_falsificado(self):
+        documentos = self.crear_cadena(3)
+        verificador = self.verificador(documentos)
+        verificador.db_nosql.checkpoints_recientes.return_value = [
+            {'index': 2, 'hash': documentos[1]['block']['hash'], 'acumulador': 'x', 'firma': 'ab' * 256}]
+
+        resultado = verificador.verificar()
+
+        # Un checkpoint sin firma válida se ignora y se verifica la cadena completa
+        verificador.db_nosql.iterar_bloques.assert_called_once_with(0, 2)
+        self.assertIsNone(resultado['checkpoint'])
+        self.assertEqual(resultado['bloques'], 3)
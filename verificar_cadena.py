@@ -0,0 +1,40 @@
+import argparse
+from connection import Connection
+from blockchain.verificador import Verificador
+
+
+def mostrar_progreso(avance):
+    print(f"{avance['bloques']} bloques verificados ({avance['bloques_por_segundo']} bloques/s), "
+          f"{avance['total_errores']} errores")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Verifica la cadena de bloques guardada en la BD NoSQL')
+    parser.add_argument('--procesos', type=int, default=None, help='Procesos para comprobar las firmas')
+    parser.add_argument('--lote', type=int, default=None, help='Bloques por lote enviado a cada proceso')
+    parser.add_argument('--desde', type=int, default=None, help='Verifica a partir de este índice (por defecto, desde el último checkpoint)')
+    parser.add_argument('--completa', action='store_true', help='Ignora los checkpoints y verifica toda la cadena')
+    parser.add_argument('--clave', default=None, help='Clave privada del servidor (PEM) para firmar el checkpoint')
+    args = parser.parse_args()
+
+    desde = 0 if args.completa else args.desde
+    private_key = None
+    if args.clave:
+        with open(args.clave, 'r') as file:
+            private_key = file.read()
+
+    conexion = Connection()
+    conexion.iniciar_nosql()
+    try:
+        resultado = Verificador(args.procesos, args.lote).verificar(desde, mostrar_progreso, private_key)
+    finally:
+        conexion.cerrar_nosql()
+
+    for error in resultado.get('errores', []):
+        print(f"Bloque {error['index']}: {error['error']}")
+    if resultado.get('checkpoint') is not None:
+        print(f"Reanudada desde el checkpoint del bloque {resultado['checkpoint']}")
+    if resultado.get('checkpoint_guardado'):
+        print(f"Checkpoint guardado en el bloque {resultado['ultimo_index']}")
+    print('Cadena válida' if resultado.get('valida') else 'Cadena NO válida')
+    raise SystemExit(0 if resultado.get('valida') else 1)